@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ru_text import content_stems
+
+# Поиск по статьям платформы для ответов чата без веб-поиска. Статья режется
+# на фрагменты (аннотация и разделы по заголовкам), фрагменты индексируются
+# BM25 по основам слов (ru_text). Индекс обновляется по статье: изменённая
+# статья удаляется из инвертированного индекса и добавляется заново, остальные
+# не трогаются. Источник — таблица Article (опубликованные статьи), без базы —
+# articles.json, из которого база и заполняется (prisma/seed.js).
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class ArticleHit:
+    __slots__ = ("key", "article_id", "slug", "title", "text", "score")
+
+    def __init__(self, key: str, article_id: Optional[str], slug: str, title: str, text: str, score: float):
+        self.key = key
+        self.article_id = article_id
+        self.slug = slug
+        self.title = title
+        self.text = text
+        self.score = score
+
+
+def block_text(block: Any) -> str:
+    if not isinstance(block, dict):
+        return ""
+    if isinstance(block.get("text"), str):
+        return block["text"].strip()
+    if isinstance(block.get("items"), list):
+        return "\n".join(f"- {item.strip()}" for item in block["items"] if isinstance(item, str))
+    return ""
+
+
+def split_passages(article: dict, max_chars: int) -> List[str]:
+    """Аннотация — первый фрагмент; дальше разделы по заголовкам, длинные — по max_chars."""
+    passages: List[str] = []
+    annotation = (article.get("annotation") or "").strip()
+    if annotation:
+        passages.append(annotation)
+
+    content = article.get("content")
+    if isinstance(content, str):
+        content = [{"type": "paragraph", "text": p} for p in content.split("\n\n")]
+    if not isinstance(content, list):
+        return passages
+
+    heading = ""
+    current: List[str] = []
+
+    def flush():
+        if current:
+            text = "\n".join(current)
+            passages.append(f"{heading}\n{text}" if heading else text)
+            current.clear()
+
+    for block in content:
+        text = block_text(block)
+        if not text:
+            continue
+        if isinstance(block, dict) and block.get("type") == "heading":
+            flush()
+            heading = text
+            continue
+        if current and sum(len(t) for t in current) + len(text) > max_chars:
+            flush()
+        current.append(text)
+    flush()
+    return passages
+
+
+class ArticleIndex:
+    def __init__(self, passage_chars: int = 800):
+        self.passage_chars = passage_chars
+        self._lock = threading.RLock()
+        # основа -> {id фрагмента: частота}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._passages: Dict[int, Tuple[str, str]] = {}  # id фрагмента -> (ключ статьи, текст)
+        # Термины фрагмента — чтобы при обновлении статьи чистить только их постинги.
+        self._terms: Dict[int, Tuple[str, ...]] = {}
+        self._articles: Dict[str, dict] = {}  # ключ -> {version, id, slug, title, passages}
+        self._next_id = 0
+        self._total_length = 0
+        self.searches = 0
+        self.updates = 0
+
+    def versions(self) -> Dict[str, str]:
+        with self._lock:
+            return {key: article["version"] for key, article in self._articles.items()}
+
+    def upsert(self, key: str, version: str, article: dict) -> None:
+        with self._lock:
+            if key in self._articles:
+                self._remove(key)
+
+            title = (article.get("title") or "").strip()
+            # Основы заголовка добавляются к каждому фрагменту: раздел статьи
+            # «Сон» находится и по вопросу, где слово есть только в заголовке.
+            title_stems = content_stems(title)
+            passage_ids = []
+            for text in split_passages(article, self.passage_chars):
+                stems = title_stems + content_stems(text)
+                if not stems:
+                    continue
+                passage_id = self._next_id
+                self._next_id += 1
+                counts = Counter(stems)
+                for stem, count in counts.items():
+                    self._postings.setdefault(stem, {})[passage_id] = count
+                self._terms[passage_id] = tuple(counts)
+                self._lengths[passage_id] = len(stems)
+                self._total_length += len(stems)
+                self._passages[passage_id] = (key, text)
+                passage_ids.append(passage_id)
+
+            self._articles[key] = {
+                "version": version,
+                "id": article.get("id"),
+                "slug": article.get("slug") or "",
+                "title": title,
+                "passages": passage_ids,
+            }
+            self.updates += 1
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            if key in self._articles:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        for passage_id in self._articles.pop(key)["passages"]:
+            del self._passages[passage_id]
+            self._total_length -= self._lengths.pop(passage_id)
+            for stem in self._terms.pop(passage_id):
+                postings = self._postings[stem]
+                del postings[passage_id]
+                if not postings:
+                    del self._postings[stem]
+
+    def search(self, query: str, limit: int = 3, min_score: float = 0.0) -> List[ArticleHit]:
+        """Лучшие фрагменты по BM25, не больше одного на статью."""
+        stems = set(content_stems(query))
+        with self._lock:
+            self.searches += 1
+            count = len(self._lengths)
+            if not stems or not count:
+                return []
+            avg_length = self._total_length / count
+
+            scores: Dict[int, float] = {}
+            for stem in stems:
+                postings = self._postings.get(stem)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[passage_id] / avg_length)
+                    scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            hits: List[ArticleHit] = []
+            seen = set()
+            for passage_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                if score < min_score or len(hits) >= limit:
+                    break
+                key, text = self._passages[passage_id]
+                if key in seen:
+                    continue
+                seen.add(key)
+                article = self._articles[key]
+                hits.append(ArticleHit(key, article["id"], article["slug"], article["title"], text, score))
+            return hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "articles": len(self._articles),
+                "passages": len(self._lengths),
+                "terms": len(self._postings),
+                "postings": sum(len(p) for p in self._postings.values()),
+                "searches": self.searches,
+                "updates": self.updates,
+            }
+
+
+# ---------- ИСТОЧНИКИ ----------
+
+
+def article_version(article: dict) -> str:
+    payload = json.dumps(
+        [article.get("title"), article.get("annotation"), article.get("content")],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def sync_from_json(index: ArticleIndex, path: str) -> Tuple[int, int]:
+    with open(path, "r", encoding="utf-8") as f:
+        articles = json.load(f)
+
+    current = index.versions()
+    seen = set()
+    updated = 0
+    for article in articles:
+        if article.get("published") is False or not article.get("slug"):
+            continue
+        key = article["slug"]
+        seen.add(key)
+        version = article_version(article)
+        if current.get(key) != version:
+            index.upsert(key, version, article)
+            updated += 1
+
+    stale = [key for key in current if key not in seen]
+    for key in stale:
+        index.remove(key)
+    return updated, len(stale)
+
+
+def sync_from_database(index: ArticleIndex, get_connection: Callable) -> Tuple[int, int]:
+    """
+    Сначала берёт только id и updatedAt опубликованных статей, полные строки —
+    лишь для новых и изменённых. Ключ статьи — её id (ссылки /feed/{id}).
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT id, "updatedAt" FROM "Article" WHERE published = true AND status = 'published'"""
+            )
+            remote = {row[0]: row[1].isoformat() for row in cur.fetchall()}
+
+            current = index.versions()
+            changed = [key for key, version in remote.items() if current.get(key) != version]
+            if changed:
+                cur.execute(
+                    """SELECT id, slug, title, annotation, content, "updatedAt"
+                    FROM "Article" WHERE id = ANY(%s)""",
+                    (changed,),
+                )
+                for article_id, slug, title, annotation, content, updated_at in cur.fetchall():
+                    index.upsert(
+                        article_id,
+                        updated_at.isoformat(),
+                        {"id": article_id, "slug": slug, "title": title, "annotation": annotation, "content": content},
+                    )
+    finally:
+        conn.close()
+
+    stale = [key for key in current if key not in remote]
+    for key in stale:
+        index.remove(key)
+    return len(changed), len(stale)
+
+
+class ArticleIndexUpdater:
+    """
+    Поддерживает индекс в актуальном состоянии: при старте и затем раз в
+    refresh_seconds. С базой источник — только она (articles.json туда уже
+    залит), без базы или пока она недоступна при пустом индексе — articles.json.
+    """
+
+    def __init__(
+        self,
+        index: ArticleIndex,
+        json_path: str,
+        get_connection: Optional[Callable] = None,
+        refresh_seconds: float = 300.0,
+    ):
+        self.index = index
+        self.json_path = json_path
+        self.get_connection = get_connection
+        self.refresh_seconds = refresh_seconds
+        self.source: Optional[str] = None
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def sync(self) -> None:
+        started = time.monotonic()
+        if self.get_connection is not None:
+            try:
+                # Переход с articles.json на базу: ключи другие (slug -> id), индекс строится заново.
+                if self.source != "database":
+                    for key in list(self.index.versions()):
+                        self.index.remove(key)
+                updated, removed = sync_from_database(self.index, self.get_connection)
+                self.source = "database"
+                self.last_error = None
+                self._log(updated, removed, started)
+                return
+            except Exception as e:
+                self.last_error = repr(e)
+                print("Article index database sync error:", repr(e))
+                if self.source is not None:
+                    return
+
+        if os.path.exists(self.json_path):
+            updated, removed = sync_from_json(self.index, self.json_path)
+            self.source = "json"
+            self._log(updated, removed, started)
+
+    def _log(self, updated: int, removed: int, started: float) -> None:
+        self.last_sync = time.time()
+        if updated or removed:
+            print(
+                f"Article index ({self.source}): {updated} updated, {removed} removed "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.sync)
+        if self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                print("Article index refresh error:", repr(e))
+
+    def stats(self) -> dict:
+        return {
+            **self.index.stats(),
+            "source": self.source,
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,231 @@
+import json
+import os
+import re
+from typing import List, Literal
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from http_transport import request_timeout
+from llm_clients import GROQ_TIMEOUTS, MODERATION_MODEL, groq_overload_error, moderation_backend
+from response_cache import CHAT_CACHE_BACKEND, CHAT_CACHE_SQLITE_PATH, build_cache, make_cache_key
+from single_flight import build_single_flight
+from token_budget import estimate_messages_tokens
+
+# Премодерация статей: промпт, серверная страховка решения модели, кеш по
+# содержимому и вызов модели через бэкенд эндпоинта moderation. Используется
+# эндпоинтами /article/moderate* в chat_app и фоновым moderation_worker.
+
+ArticleModerationDecision = Literal["approved", "rejected"]
+
+
+class ArticleModerationIn(BaseModel):
+    title: str = Field(min_length=3)
+    category: str = Field(min_length=2)
+    annotation: str = Field(min_length=10)
+    content_text: str = Field(min_length=50)
+
+
+class ArticleModerationResult(BaseModel):
+    decision: ArticleModerationDecision
+    confidence_score: int
+    reasons: List[str] = []
+    red_flags: List[str] = []
+    health_topic_match: bool
+    topic_relevance: bool
+    is_safe_content: bool
+
+
+ARTICLE_MODERATION_PROMPT = """
+Ты — строгая система премодерации статей для wellness-платформы.
+
+Твоя задача: решить, можно ли публиковать статью.
+
+ПРАВИЛА МОДЕРАЦИИ:
+1) Статья должна быть по теме здоровья / wellness / ЗОЖ.
+2) Статья должна соответствовать заявленной категории и теме.
+3) Контент должен быть безопасным: без провокаций, оскорблений, разжигания ненависти,
+   призывов к насилию, саморазрушению, опасным практикам и другим вредным материалам.
+4) Не допускать псевдонаучные, заведомо вредные или опасные рекомендации.
+5) Если есть сомнения — отклоняй (decision = "rejected").
+
+ВЕРНИ СТРОГО JSON и ничего больше.
+Формат:
+{
+  "decision": "approved | rejected",
+  "confidence_score": 0,
+  "reasons": ["..."],
+  "red_flags": ["..."],
+  "health_topic_match": true,
+  "topic_relevance": true,
+  "is_safe_content": true
+}
+""".strip()
+
+
+# Пороги серверной страховки. Входят в версию кеша модерации:
+# при их изменении старые решения из кеша больше не используются.
+ARTICLE_MIN_CONFIDENCE = 80
+ARTICLE_MAX_CONTENT_CHARS = 20000
+
+# Оценка длины JSON-ответа модерации для регулятора запросов.
+MODERATION_OUTPUT_TOKENS_ESTIMATE = 300
+
+
+def harden_article_decision(data: ArticleModerationResult) -> ArticleModerationResult:
+    is_confident = data.confidence_score >= ARTICLE_MIN_CONFIDENCE
+    is_clean = len(data.red_flags) == 0
+    must_approve = (
+        data.health_topic_match
+        and data.topic_relevance
+        and data.is_safe_content
+        and is_confident
+        and is_clean
+    )
+    data.decision = "approved" if must_approve else "rejected"
+    return data
+
+
+ARTICLE_MODERATION_VERSION = make_cache_key(
+    ARTICLE_MODERATION_PROMPT, ARTICLE_MIN_CONFIDENCE, ARTICLE_MAX_CONTENT_CHARS
+)[:12]
+
+CHAT_MODERATION_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_MODERATION_CACHE_TTL_SECONDS", "604800"))
+CHAT_MODERATION_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_MODERATION_CACHE_MAX_ENTRIES", "5000"))
+
+moderation_cache = build_cache(
+    "moderation",
+    backend=CHAT_CACHE_BACKEND,
+    ttl_seconds=CHAT_MODERATION_CACHE_TTL_SECONDS,
+    max_entries=CHAT_MODERATION_CACHE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
+# Idempotency-Key -> {"content_key", "result"}: повтор запроса от Node-бэкенда
+# получает сохранённый результат без обращения к модели.
+moderation_idempotency_cache = build_cache(
+    "moderation_idempotency",
+    backend=CHAT_CACHE_BACKEND,
+    ttl_seconds=CHAT_MODERATION_CACHE_TTL_SECONDS,
+    max_entries=CHAT_MODERATION_CACHE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
+
+
+def moderation_cache_key(body: ArticleModerationIn) -> str:
+    return make_cache_key(
+        "moderation",
+        MODERATION_MODEL,
+        ARTICLE_MODERATION_VERSION,
+        body.title.strip(),
+        body.category.strip(),
+        body.annotation.strip(),
+        body.content_text.strip()[:ARTICLE_MAX_CONTENT_CHARS],
+    )
+
+
+def build_moderation_prompt(body: ArticleModerationIn) -> str:
+    return (
+        f"{ARTICLE_MODERATION_PROMPT}\n\n"
+        f"НАЗВАНИЕ:\n{body.title.strip()}\n\n"
+        f"КАТЕГОРИЯ:\n{body.category.strip()}\n\n"
+        f"АННОТАЦИЯ:\n{body.annotation.strip()}\n\n"
+        f"ТЕКСТ СТАТЬИ:\n{body.content_text.strip()[:ARTICLE_MAX_CONTENT_CHARS]}"
+    )
+
+
+def parse_moderation_response(raw_text: str) -> dict:
+    json_text = clean_json_text(raw_text.strip())
+
+    try:
+        parsed = json.loads(json_text)
+        result = ArticleModerationResult(**parsed)
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Модель вернула невалидный ответ модерации: {str(e)}",
+        )
+
+    hardened = harden_article_decision(result)
+    return hardened.model_dump()
+
+
+# Одинаковые статьи, пришедшие одновременно, делят один вызов модели.
+moderation_flight = build_single_flight("moderation")
+
+
+def clean_json_text(raw_text: str) -> str:
+    raw_text = raw_text.strip()
+
+    # Убираем ```json ... ```
+    raw_text = re.sub(r"^```json\s*", "", raw_text, flags=re.IGNORECASE)
+    raw_text = re.sub(r"^```\s*", "", raw_text)
+    raw_text = re.sub(r"\s*```$", "", raw_text)
+
+    # Если модель вернула лишний текст, пытаемся вытащить JSON-объект
+    start = raw_text.find("{")
+    end = raw_text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        raw_text = raw_text[start:end + 1]
+
+    return raw_text.strip()
+
+
+def request_moderation(body: ArticleModerationIn, content_key: str) -> dict:
+    messages = [{"role": "user", "content": build_moderation_prompt(body)}]
+    try:
+        resp = moderation_backend.governor.call(
+            "moderation",
+            MODERATION_MODEL,
+            estimate_messages_tokens(messages) + MODERATION_OUTPUT_TOKENS_ESTIMATE,
+            lambda: moderation_backend.client.chat.completions.create(
+                model=MODERATION_MODEL,
+                messages=messages,
+                temperature=0.1,
+                timeout=request_timeout(GROQ_TIMEOUTS["moderation"]),
+            ),
+        )
+    except Exception as e:
+        print("Groq moderation error:", repr(e))
+        raise groq_overload_error(e) or HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
+
+    result = parse_moderation_response(resp.choices[0].message.content or "")
+    moderation_cache.set(content_key, result)
+    return result
+
+
+# Сколько статей пакета одновременно уходит в модель.
+CHAT_MODERATION_BATCH_CONCURRENCY = int(os.environ.get("CHAT_MODERATION_BATCH_CONCURRENCY", "4"))
+
+
+async def moderate_article_async(body: ArticleModerationIn, lane: str = "batch_moderation") -> dict:
+    content_key = moderation_cache_key(body)
+    cached = moderation_cache.get(content_key)
+    if cached is not None:
+        return cached
+
+    return await moderation_flight.ado(
+        content_key, lambda: request_moderation_async(body, content_key, lane)
+    )
+
+
+async def request_moderation_async(body: ArticleModerationIn, content_key: str, lane: str) -> dict:
+    messages = [{"role": "user", "content": build_moderation_prompt(body)}]
+    try:
+        resp = await moderation_backend.governor.acall(
+            lane,
+            MODERATION_MODEL,
+            estimate_messages_tokens(messages) + MODERATION_OUTPUT_TOKENS_ESTIMATE,
+            lambda: moderation_backend.async_client.chat.completions.create(
+                model=MODERATION_MODEL,
+                messages=messages,
+                temperature=0.1,
+                timeout=request_timeout(GROQ_TIMEOUTS["moderation"]),
+            ),
+        )
+    except Exception as e:
+        print("Groq moderation error:", repr(e))
+        raise groq_overload_error(e) or HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
+
+    result = parse_moderation_response(resp.choices[0].message.content or "")
+    moderation_cache.set(content_key, result)
+    return result
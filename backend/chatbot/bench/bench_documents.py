@@ -0,0 +1,148 @@
+"""
+Бенчмарк подготовки PDF для /expert/verify.
+
+Сравнивает старую схему (два открытия PDF, рендер 2x в PNG) с process_pdf()
+(один проход, адаптивный масштаб/формат) по времени и размеру payload,
+а также пропускную способность пула процессов.
+
+    python bench/bench_documents.py                 # синтетические PDF
+    python bench/bench_documents.py diplomas/*.pdf  # свои файлы
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import statistics
+import sys
+import time
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document_processing  # noqa: E402
+from document_processing import process_pdf, run_document_job  # noqa: E402
+
+
+def legacy_prepare(pdf_bytes: bytes, max_pages: int = 3) -> Tuple[str, int]:
+    # Повторяет прежние extract_text_from_pdf() + pdf_to_png_data_urls().
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    text = "\n".join(page.get_text("text") for page in doc).strip()[:15000]
+
+    payload = 0
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    for i in range(min(len(doc), max_pages)):
+        pix = doc.load_page(i).get_pixmap(matrix=fitz.Matrix(2.0, 2.0), alpha=False)
+        png = pix.tobytes("png")
+        payload += len(png)
+        base64.b64encode(png)
+    return text, payload
+
+
+def make_text_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 100), "DIPLOMA / ДИПЛОМ", fontsize=28)
+        for line in range(30):
+            page.insert_text((72, 150 + line * 20), f"Line {line} of page {n}: Moscow State University", fontsize=11)
+        page.draw_rect(fitz.Rect(60, 60, 540, 780), color=(0.2, 0.2, 0.6), width=3)
+    return doc.tobytes()
+
+
+def make_scan_pdf(pages: int, size: int = 1600) -> bytes:
+    # Имитация скана: шумное растровое изображение на всю страницу.
+    rnd = random.Random(42)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        samples = bytes(200 + rnd.randrange(56) for _ in range(size * size * 3))
+        pix = fitz.Pixmap(fitz.csRGB, size, size, samples, False)
+        page.insert_image(page.rect, pixmap=pix)
+        page.insert_text((72, 100), "Scanned diploma", fontsize=24)
+    return doc.tobytes()
+
+
+def sample_documents() -> List[Tuple[str, bytes]]:
+    return [
+        ("text-1p", make_text_pdf(1)),
+        ("text-5p", make_text_pdf(5)),
+        ("scan-1p", make_scan_pdf(1)),
+        ("scan-3p", make_scan_pdf(3)),
+    ]
+
+
+def timed(fn, *args) -> Tuple[float, object]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def bench_single(docs: List[Tuple[str, bytes]], repeats: int) -> None:
+    print(f"{'document':<14}{'size KB':>9}{'legacy ms':>11}{'new ms':>9}{'legacy KB':>11}{'new KB':>9}  renders")
+    for name, pdf_bytes in docs:
+        legacy_times, new_times = [], []
+        legacy_payload = new_payload = 0
+        renders = []
+        for _ in range(repeats):
+            seconds, (_, legacy_payload) = timed(legacy_prepare, pdf_bytes)
+            legacy_times.append(seconds)
+            seconds, processed = timed(process_pdf, pdf_bytes)
+            new_times.append(seconds)
+            new_payload = processed.payload_bytes
+            renders = processed.renders
+
+        summary = ", ".join(
+            f"{r['format']}@{r['zoom']}" + (f"/q{r['quality']}" if r["quality"] else "") for r in renders
+        )
+        print(
+            f"{name:<14}{len(pdf_bytes) / 1024:>9.0f}"
+            f"{statistics.median(legacy_times) * 1000:>11.0f}{statistics.median(new_times) * 1000:>9.0f}"
+            f"{legacy_payload / 1024:>11.0f}{new_payload / 1024:>9.0f}  {summary}"
+        )
+
+
+async def bench_concurrent(docs: List[Tuple[str, bytes]], jobs: int) -> None:
+    batch = [docs[i % len(docs)][1] for i in range(jobs)]
+
+    started = time.perf_counter()
+    for pdf_bytes in batch:
+        process_pdf(pdf_bytes)
+    sequential = time.perf_counter() - started
+
+    # Первый запуск поднимает процессы пула — не учитываем его.
+    await run_document_job(process_pdf, batch[0])
+    started = time.perf_counter()
+    await asyncio.gather(*(run_document_job(process_pdf, pdf_bytes) for pdf_bytes in batch))
+    pooled = time.perf_counter() - started
+
+    print(
+        f"\n{jobs} documents: sequential {sequential:.2f}s, "
+        f"pool({document_processing.DOC_PROCESS_WORKERS} workers) {pooled:.2f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*", help="PDF-файлы; по умолчанию синтетические")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.pdfs:
+        docs = []
+        for path in args.pdfs:
+            with open(path, "rb") as f:
+                docs.append((os.path.basename(path)[:13], f.read()))
+    else:
+        docs = sample_documents()
+
+    bench_single(docs, args.repeats)
+    asyncio.run(bench_concurrent(docs, args.jobs))
+
+
+if __name__ == "__main__":
+    main()
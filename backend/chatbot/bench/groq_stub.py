@@ -0,0 +1,365 @@
+"""
+Локальная заглушка Groq (OpenAI-совместимый API) для нагрузочных тестов.
+
+Отвечает на /openai/v1/chat/completions (обычный и stream), /openai/v1/responses
+(vision-проверка дипломов) и /openai/v1/models. Задержка — логнормальная по
+модели, генерация — с заданной скоростью токенов; 413/429/5xx можно
+подмешивать с заданной вероятностью, compound-модели возвращают executed_tools
+с результатами поиска. Тип ответа (чат, название, модерация, сводка, диплом)
+определяется по промпту, чтобы chat_app получал валидные ответы.
+
+    python bench/groq_stub.py --port 9100
+    python bench/groq_stub.py --latency groq/compound=4:1.0 --p429 0.05
+    GROQ_BASE_URL=http://127.0.0.1:9100 GROQ_API_KEY=stub uvicorn chat_app:app
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class StubConfig:
+    def __init__(self):
+        # модель -> (медиана до первого токена, сигма логнормального распределения)
+        self.latency: Dict[str, Tuple[float, float]] = {
+            "groq/compound": (2.5, 0.9),
+            "*": (0.35, 0.4),
+        }
+        self.tokens_per_second = 250.0
+        self.chat_tokens = 220
+        self.p413 = 0.0
+        self.p429 = 0.0
+        self.p5xx = 0.0
+        self.retry_after = 1.0
+        # Промпт длиннее — 413, как у настоящего API.
+        self.max_prompt_tokens = 8000
+        self.search_results = 3
+        self.rng = random.Random()
+
+
+config = StubConfig()
+counts: Counter = Counter()
+
+app = FastAPI()
+
+ANSWER_WORDS = (
+    "регулярный сон режим питание вода движение прогулка стресс дыхание "
+    "овощи белок отдых восстановление привычка врач консультация баланс"
+).split()
+
+SEARCH_RESULTS = [
+    ("Сон и здоровье — ВОЗ", "https://www.who.int/ru/news-room/fact-sheets/sleep"),
+    ("Здоровое питание — ВОЗ", "https://www.who.int/ru/news-room/fact-sheets/detail/healthy-diet"),
+    ("Физическая активность — ВОЗ", "https://www.who.int/ru/news-room/fact-sheets/detail/physical-activity"),
+    ("Стресс: как справляться", "https://www.who.int/ru/news-room/questions-and-answers/item/stress"),
+    ("Питьевой режим", "https://www.nhs.uk/live-well/eat-well/food-guidelines-and-food-labels/water-drinks-nutrition/"),
+]
+
+
+def estimate_prompt_tokens(text: str) -> int:
+    return max(len(text) // 3, 1)
+
+
+def sample_latency(model: str) -> float:
+    median, sigma = config.latency.get(model) or config.latency["*"]
+    return config.rng.lognormvariate(math.log(median), sigma)
+
+
+def make_text(tokens: int) -> str:
+    # Слово + пробел ~ 2 токена по оценке token_budget.
+    words = [config.rng.choice(ANSWER_WORDS) for _ in range(max(tokens // 2, 1))]
+    return (" ".join(words).capitalize() + ".").strip()
+
+
+def error_response(status_code: int, message: str, code: str) -> JSONResponse:
+    headers = {"retry-after": f"{config.retry_after:g}"} if status_code == 429 else None
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": "invalid_request_error", "code": code}},
+        headers=headers,
+    )
+
+
+def injected_error(model: str, prompt_tokens: int) -> Optional[JSONResponse]:
+    roll = config.rng.random()
+    if prompt_tokens > config.max_prompt_tokens or roll < config.p413:
+        counts[f"{model} 413"] += 1
+        return error_response(413, "Request too large for model", "request_too_large")
+    roll -= config.p413
+    if roll < config.p429:
+        counts[f"{model} 429"] += 1
+        return error_response(429, "Rate limit reached", "rate_limit_exceeded")
+    roll -= config.p429
+    if roll < config.p5xx:
+        counts[f"{model} 503"] += 1
+        return error_response(503, "Service unavailable", "service_unavailable")
+    counts[f"{model} 200"] += 1
+    return None
+
+
+def message_text(messages: List[dict]) -> str:
+    parts = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts += [c.get("text", "") for c in content if isinstance(c, dict)]
+    return "\n".join(parts)
+
+
+def completion_content(messages: List[dict]) -> Tuple[str, str]:
+    """(вид ответа, текст) по промпту запроса."""
+    system = message_text([m for m in messages if m.get("role") == "system"])
+    prompt = message_text(messages)
+    if "названия чатов" in system:
+        return "title", config.rng.choice(["Сон", "Питание", "Стресс", "Здоровье", "Режим дня"])
+    if "премодерации статей" in prompt:
+        return "moderation", json.dumps(
+            {
+                "decision": "approved",
+                "confidence_score": config.rng.randint(80, 98),
+                "reasons": ["Статья по теме здоровья"],
+                "red_flags": [],
+                "health_topic_match": True,
+                "topic_relevance": True,
+                "is_safe_content": True,
+            },
+            ensure_ascii=False,
+        )
+    if "сжимаешь переписку" in system:
+        return "summary", make_text(120)
+    return "chat", make_text(config.chat_tokens)
+
+
+def executed_tools(model: str) -> Optional[list]:
+    if "compound" not in model or not config.search_results:
+        return None
+    results = [
+        {"title": title, "url": url, "content": "", "score": 0.9}
+        for title, url in SEARCH_RESULTS[: config.search_results]
+    ]
+    return [
+        {
+            "index": 0,
+            "type": "search",
+            "arguments": json.dumps({"query": "wellness"}),
+            "output": "",
+            "search_results": {"results": results},
+        }
+    ]
+
+
+def usage(prompt_tokens: int, completion_tokens: int, elapsed: float) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "total_time": round(elapsed, 3),
+    }
+
+
+@app.get("/openai/v1/models")
+async def list_models():
+    models = [m for m in config.latency if m != "*"]
+    return {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "stub"} for m in models]}
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    messages = body.get("messages") or []
+    prompt_tokens = estimate_prompt_tokens(message_text(messages))
+
+    error = injected_error(model, prompt_tokens)
+    if error is not None:
+        return error
+
+    kind, content = completion_content(messages)
+    completion_tokens = estimate_prompt_tokens(content)
+    tools = executed_tools(model) if kind == "chat" else None
+    first_token = sample_latency(model)
+    created = int(time.time())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+    if body.get("stream"):
+        return StreamingResponse(
+            stream_chunks(completion_id, created, model, content, tools, first_token, prompt_tokens),
+            media_type="text/event-stream",
+        )
+
+    started = time.monotonic()
+    await asyncio.sleep(first_token + completion_tokens / config.tokens_per_second)
+    message = {"role": "assistant", "content": content}
+    if tools:
+        message["executed_tools"] = tools
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": usage(prompt_tokens, completion_tokens, time.monotonic() - started),
+    }
+
+
+async def stream_chunks(completion_id, created, model, content, tools, first_token, prompt_tokens):
+    started = time.monotonic()
+
+    def chunk(delta: dict, finish_reason=None, extra: Optional[dict] = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        payload.update(extra or {})
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    await asyncio.sleep(first_token)
+    yield chunk({"role": "assistant", "content": ""})
+    if tools:
+        yield chunk({"executed_tools": tools})
+
+    # Отдаём по слову: ~2 токена на кусок при заданной скорости.
+    words = content.split(" ")
+    per_piece = 2 / config.tokens_per_second
+    for i, word in enumerate(words):
+        await asyncio.sleep(per_piece)
+        yield chunk({"content": word if i == 0 else " " + word})
+
+    completion_tokens = estimate_prompt_tokens(content)
+    yield chunk(
+        {},
+        finish_reason="stop",
+        extra={"x_groq": {"id": f"req_{completion_id}", "usage": usage(prompt_tokens, completion_tokens, time.monotonic() - started)}},
+    )
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/openai/v1/responses")
+async def responses(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    items = body.get("input") or []
+    prompt = message_text(items if isinstance(items, list) else [{"content": items}])
+    images = sum(
+        1
+        for item in items if isinstance(item, dict)
+        for c in (item.get("content") or []) if isinstance(c, dict) and c.get("type") == "input_image"
+    )
+    prompt_tokens = estimate_prompt_tokens(prompt) + 1600 * images
+
+    error = injected_error(model, estimate_prompt_tokens(prompt))
+    if error is not None:
+        return error
+
+    first = re.search(r"Имя: (.+)", prompt)
+    last = re.search(r"Фамилия: (.+)", prompt)
+    full_name = " ".join(m.group(1).strip() for m in (first, last) if m) or None
+    text = json.dumps(
+        {
+            "document_type": "diploma",
+            "is_realistic_official_document": True,
+            "matches_selected_education": True,
+            "confidence_score": config.rng.randint(88, 99),
+            "full_name": full_name,
+            "institution": "Медицинский университет",
+            "qualification": "Врач",
+            "specialization": "Лечебное дело",
+            "graduation_year": "2015",
+            "document_number": "107724 0000000",
+            "red_flags": [],
+            "reasons": ["Документ выглядит подлинным"],
+            "decision": "approved",
+        },
+        ensure_ascii=False,
+    )
+    completion_tokens = estimate_prompt_tokens(text)
+
+    await asyncio.sleep(sample_latency(model) + completion_tokens / config.tokens_per_second)
+    return {
+        "id": f"resp_{uuid.uuid4().hex[:24]}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens_details": {"reasoning_tokens": 0},
+        },
+    }
+
+
+@app.get("/stub/stats")
+async def stub_stats():
+    return dict(counts)
+
+
+def parse_latency(values: List[str]) -> None:
+    # MODEL=MEDIAN[:SIGMA], MODEL "*" — для всех остальных.
+    for value in values:
+        model, _, spec = value.partition("=")
+        median, _, sigma = spec.partition(":")
+        config.latency[model.strip()] = (float(median), float(sigma or 0.4))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная заглушка Groq API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", default=[], metavar="MODEL=MEDIAN[:SIGMA]",
+                        help="задержка до первого токена, секунды (логнормальная)")
+    parser.add_argument("--tokens-per-second", type=float, default=config.tokens_per_second)
+    parser.add_argument("--chat-tokens", type=int, default=config.chat_tokens, help="длина ответа чата")
+    parser.add_argument("--p413", type=float, default=0.0)
+    parser.add_argument("--p429", type=float, default=0.0)
+    parser.add_argument("--p5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=config.retry_after)
+    parser.add_argument("--max-prompt-tokens", type=int, default=config.max_prompt_tokens)
+    parser.add_argument("--search-results", type=int, default=config.search_results)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    parse_latency(args.latency)
+    config.tokens_per_second = args.tokens_per_second
+    config.chat_tokens = args.chat_tokens
+    config.p413, config.p429, config.p5xx = args.p413, args.p429, args.p5xx
+    config.retry_after = args.retry_after
+    config.max_prompt_tokens = args.max_prompt_tokens
+    config.search_results = args.search_results
+    config.rng.seed(args.seed)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Нагрузочный тест chat_app без сети: смесь запросов к /chat, /generate-title,
+/article/moderate и /expert/verify, отчёт по пропускной способности,
+p50/p95/p99 и памяти каждого воркера uvicorn.
+
+С --spawn поднимает рядом заглушку Groq (bench/groq_stub.py) и сам сервис
+(uvicorn chat_app:app --workers N) во временном каталоге — достаточно ноутбука:
+
+    python bench/load_test.py --spawn --duration 30 --concurrency 32
+    python bench/load_test.py --spawn --workers 2 --stub-arg=--p429=0.05
+    python bench/load_test.py --url http://127.0.0.1:8000 --mix chat=50,verify=50
+
+Лимиты регулятора (CHAT_GROQ_RPM/TPM) при --spawn по умолчанию подняты, чтобы
+мерить сервис, а не лимиты аккаунта; заданные в окружении значения не трогаются.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+CHATBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "chat=70,title=20,moderate=8,verify=2"
+
+QUESTIONS = [
+    "Как наладить сон, если просыпаюсь ночью?",
+    "Сколько воды нужно пить в день?",
+    "Как справляться со стрессом на работе?",
+    "Какие упражнения делать дома без инвентаря?",
+    "Полезно ли интервальное голодание?",
+    "Как перестать есть сладкое по вечерам?",
+    "Сколько шагов в день достаточно для здоровья?",
+    "Как восстановиться после тренировки?",
+    "Что есть на завтрак, чтобы не хотелось есть до обеда?",
+    "Как понять, что пора к врачу из-за усталости?",
+    "Помогает ли медитация при тревожности?",
+    "Как совместить работу за компьютером и здоровую спину?",
+]
+
+FOLLOW_UPS = [
+    "А если я работаю в ночную смену?",
+    "Можно подробнее про второй пункт?",
+    "А что насчёт кофе?",
+    "Мне 45 лет, это что-то меняет?",
+    "Спасибо, а как это совместить с тренировками?",
+]
+
+ARTICLE_TEXT = (
+    "Регулярная физическая активность снижает риск сердечно-сосудистых заболеваний, "
+    "улучшает сон и настроение. Взрослым рекомендуется не менее 150 минут умеренной "
+    "активности в неделю: быстрая ходьба, плавание, велосипед. "
+)
+
+FIRST_NAMES = ["Анна", "Иван", "Мария", "Пётр", "Елена", "Сергей"]
+LAST_NAMES = ["Иванова", "Петров", "Смирнова", "Кузнецов", "Попова", "Соколов"]
+
+
+class LoadGenerator:
+    def __init__(self, url: str, mix: Dict[str, int], repeat_ratio: float, seed: Optional[int]):
+        self.url = url.rstrip("/")
+        self.endpoints = list(mix)
+        self.weights = [mix[e] for e in self.endpoints]
+        self.repeat_ratio = repeat_ratio
+        self.rng = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.serial = 0
+
+    def unique(self) -> bool:
+        # Часть запросов повторяет уже заданные — как живые пользователи; они попадают в кеш.
+        return self.rng.random() >= self.repeat_ratio
+
+    def next_serial(self) -> int:
+        self.serial += 1
+        return self.serial
+
+    # --------- запросы ---------
+
+    def chat_request(self) -> dict:
+        question = self.rng.choice(QUESTIONS)
+        if self.unique():
+            question = f"{question} (вопрос {self.next_serial()})"
+        messages = [{"role": "user", "content": question}]
+        # Треть диалогов — с историей: нагружает сворачивание истории.
+        if self.rng.random() < 0.3:
+            for _ in range(self.rng.randint(2, 8)):
+                messages.append({"role": "assistant", "content": "Вот несколько рекомендаций. " * 20})
+                messages.append({"role": "user", "content": self.rng.choice(FOLLOW_UPS)})
+        return {"method": "POST", "url": "/chat", "json": {"messages": messages}}
+
+    def title_request(self) -> dict:
+        text = self.rng.choice(QUESTIONS + FOLLOW_UPS)
+        if self.unique():
+            text = f"{text} {self.next_serial()}"
+        return {"method": "POST", "url": "/generate-title", "json": {"text": text}}
+
+    def moderate_request(self) -> dict:
+        serial = self.next_serial() if self.unique() else 0
+        return {
+            "method": "POST",
+            "url": "/article/moderate",
+            "json": {
+                "title": f"Польза ходьбы {serial}",
+                "category": "Фитнес",
+                "annotation": "Почему ежедневная ходьба полезна для здоровья",
+                "content_text": ARTICLE_TEXT * self.rng.randint(2, 12),
+            },
+        }
+
+    def verify_request(self) -> dict:
+        # Шумное изображение уникально, поэтому не попадает в хранилище результатов.
+        seed = self.next_serial() if self.unique() else 0
+        rnd = random.Random(seed)
+        image = Image.frombytes("L", (64, 64), bytes(rnd.randrange(256) for _ in range(64 * 64)))
+        image = image.resize((1400, 1000)).convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        index = self.rng.randrange(len(FIRST_NAMES))
+        return {
+            "method": "POST",
+            "url": "/expert/verify",
+            "data": {
+                "education_description": "Высшее медицинское образование, лечебное дело",
+                "first_name": FIRST_NAMES[index],
+                "last_name": LAST_NAMES[index],
+            },
+            "files": {"file": (f"diploma-{seed}.jpg", buffer.getvalue(), "image/jpeg")},
+        }
+
+    # --------- прогон ---------
+
+    async def worker(self, client: httpx.AsyncClient, stop_at: float) -> None:
+        while time.monotonic() < stop_at:
+            endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+            request = getattr(self, f"{endpoint}_request")()
+            method, url = request.pop("method"), request.pop("url")
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, self.url + url, **request)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            self.latencies[endpoint].append(time.perf_counter() - started)
+            self.statuses[endpoint][status] += 1
+
+    async def run(self, duration: float, concurrency: int, timeout: float) -> float:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            started = time.monotonic()
+            stop_at = started + duration
+            await asyncio.gather(*(self.worker(client, stop_at) for _ in range(concurrency)))
+            return time.monotonic() - started
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)] if ordered else 0.0
+
+
+def print_report(generator: LoadGenerator, elapsed: float) -> None:
+    print(f"\n{'endpoint':<10}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    all_latencies: List[float] = []
+    for endpoint in generator.endpoints:
+        latencies = generator.latencies.get(endpoint, [])
+        all_latencies += latencies
+        statuses = ", ".join(f"{k}:{v}" for k, v in sorted(generator.statuses[endpoint].items()))
+        print(
+            f"{endpoint:<10}{len(latencies):>9}{len(latencies) / elapsed:>8.1f}"
+            f"{percentile(latencies, 0.5) * 1000:>9.0f}{percentile(latencies, 0.95) * 1000:>9.0f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.0f}  {statuses}"
+        )
+    print(
+        f"{'total':<10}{len(all_latencies):>9}{len(all_latencies) / elapsed:>8.1f}"
+        f"{percentile(all_latencies, 0.5) * 1000:>9.0f}{percentile(all_latencies, 0.95) * 1000:>9.0f}"
+        f"{percentile(all_latencies, 0.99) * 1000:>9.0f}"
+    )
+
+
+# ---------- память воркеров ----------
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def child_pids(pid: int) -> List[int]:
+    children = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # Поле 4 — ppid; имя процесса в скобках может содержать пробелы.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(name))
+    return children
+
+
+class MemorySampler:
+    """Пиковый RSS процесса сервиса и его воркеров (Linux, /proc)."""
+
+    def __init__(self, pid: int, workers: int):
+        self.pid = pid
+        self.workers = workers
+        self.peak: Dict[int, int] = {}
+        self.last: Dict[int, int] = {}
+
+    def worker_pids(self) -> List[int]:
+        if self.workers <= 1:
+            return [self.pid]
+        # С --workers N uvicorn запускает воркеры дочерними процессами (spawn);
+        # resource_tracker и прочие служебные процессы памяти почти не занимают.
+        return child_pids(self.pid)
+
+    def sample(self) -> None:
+        for pid in self.worker_pids():
+            rss = rss_kb(pid)
+            if rss is not None:
+                self.last[pid] = rss
+                self.peak[pid] = max(self.peak.get(pid, 0), rss)
+
+    async def run(self, interval: float = 0.5) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def report(self) -> None:
+        if not os.path.isdir("/proc"):
+            print("\nmemory: /proc недоступен, замер памяти пропущен")
+            return
+        print(f"\n{'worker pid':<12}{'rss MB':>9}{'peak MB':>9}")
+        for pid in sorted(self.peak):
+            print(f"{pid:<12}{self.last[pid] / 1024:>9.1f}{self.peak[pid] / 1024:>9.1f}")
+
+
+# ---------- запуск заглушки и сервиса ----------
+
+
+async def wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не поднялся за {timeout:.0f}s")
+
+
+def spawn_processes(args, workdir: str) -> List[subprocess.Popen]:
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(CHATBOT_DIR, "bench", "groq_stub.py"), "--port", str(args.stub_port)]
+        + args.stub_arg
+    )
+
+    env = os.environ.copy()
+    env.update(
+        {
+            "GROQ_API_KEY": "bench",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{args.stub_port}",
+            "CHAT_CACHE_SQLITE_PATH": os.path.join(workdir, "cache.sqlite3"),
+            "CHAT_VERIFY_JOBS_SQLITE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        }
+    )
+    env.setdefault("CHAT_GROQ_RPM", "100000")
+    env.setdefault("CHAT_GROQ_TPM", "100000000")
+    service = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "chat_app:app",
+            "--app-dir", CHATBOT_DIR,
+            "--port", str(args.service_port),
+            "--workers", str(args.workers),
+            "--log-level", "warning",
+        ],
+        cwd=workdir,
+        env=env,
+    )
+    return [stub, service]
+
+
+async def main_async(args) -> None:
+    mix = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight or 1)
+    unknown = set(mix) - {"chat", "title", "moderate", "verify"}
+    if unknown:
+        raise SystemExit(f"Неизвестные эндпоинты в --mix: {', '.join(sorted(unknown))}")
+
+    url = args.url or f"http://127.0.0.1:{args.service_port}"
+    processes: List[subprocess.Popen] = []
+    sampler = None
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    try:
+        if args.spawn:
+            processes = spawn_processes(args, workdir)
+            await wait_ready(f"http://127.0.0.1:{args.stub_port}/openai/v1/models")
+            await wait_ready(f"{url}/stats")
+            sampler = MemorySampler(processes[1].pid, args.workers)
+
+        generator = LoadGenerator(url, mix, args.repeat_ratio, args.seed)
+        sampling = asyncio.ensure_future(sampler.run()) if sampler else None
+        print(f"{url}: {args.concurrency} concurrent clients, {args.duration:.0f}s, mix {args.mix}")
+        elapsed = await generator.run(args.duration, args.concurrency, args.timeout)
+        if sampling:
+            sampling.cancel()
+        print_report(generator, elapsed)
+        if sampler:
+            sampler.report()
+
+        async with httpx.AsyncClient(timeout=5) as client:
+            stats = (await client.get(f"{url}/stats")).json()
+        hit_rates = {name: cache["hit_rate"] for name, cache in stats.get("caches", {}).items()}
+        print("\ncache hit rate:", json.dumps(hit_rates, ensure_ascii=False))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест chat_app")
+    parser.add_argument("--url", help="адрес запущенного сервиса; по умолчанию — поднятого через --spawn")
+    parser.add_argument("--spawn", action="store_true", help="поднять заглушку Groq и сервис локально")
+    parser.add_argument("--workers", type=int, default=1, help="воркеры uvicorn при --spawn")
+    parser.add_argument("--service-port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-arg", action="append", default=[], help="аргумент для groq_stub.py")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли эндпоинтов: chat, title, moderate, verify")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="доля повторных запросов")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if not args.url and not args.spawn:
+        parser.error("нужен --url или --spawn")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,149 @@
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from groq import Groq
-from openai import OpenAI
 from dotenv import load_dotenv
 
-import base64
+import asyncio
 import hashlib
 import json
 import os
 import re
 import textwrap
+import time
 import uuid
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
 from io import BytesIO
-from typing import List, Literal, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple, TypeVar
 
-import fitz  # PyMuPDF
+import anyio
 import uvicorn
 
 load_dotenv()
 
-app = FastAPI()
+# Локальные модули читают переменные окружения при импорте — после load_dotenv().
+from article_index import ArticleHit, ArticleIndex, ArticleIndexUpdater
+from article_moderation import (
+    CHAT_MODERATION_BATCH_CONCURRENCY,
+    ArticleModerationIn,
+    clean_json_text,
+    moderate_article_async,
+    moderation_cache,
+    moderation_cache_key,
+    moderation_flight,
+    moderation_idempotency_cache,
+    request_moderation,
+)
+from chat_sessions import (
+    ChatSession,
+    SessionStore,
+    append_chat_messages,
+    count_chat_messages,
+    load_chat_messages,
+)
+from document_processing import (
+    DOC_TARGET_PAGE_BYTES,
+    DocumentError,
+    process_image,
+    process_pdf,
+    run_document_job,
+)
+from hedging import HedgedChain, model_latency_stats
+from http_transport import connection_stats, request_timeout, warm_up
+from llm_backends import LLMBackend
+from llm_clients import (
+    CHAT_HTTP_WARMUP,
+    CHAT_MODEL,
+    GROQ_API_KEY,
+    GROQ_OPENAI_BASE_URL,
+    GROQ_TIMEOUTS,
+    GROUNDED_MODEL,
+    SUMMARY_MODEL,
+    TITLE_MODEL,
+    async_http_client,
+    chat_backend,
+    groq_governor,
+    groq_overload_error,
+    http_client,
+    llm_backends_snapshot,
+    moderation_backend,
+    require_backend,
+    summary_backend,
+    title_backend,
+    vision_client,
+)
+from metrics import (
+    METRICS_CONTENT_TYPE,
+    PrometheusMiddleware,
+    observe_tokens,
+    register_stats_collector,
+    render_metrics,
+)
+from platform_auth import user_id_from_authorization
+from platform_db import DATABASE_URL, ConnectionPool, get_connection
+from response_cache import CHAT_CACHE_BACKEND, CHAT_CACHE_SQLITE_PATH, build_cache, cache_stats, make_cache_key
+from ru_text import content_stems
+from semantic_cache import SemanticCache
+from single_flight import build_single_flight, single_flight_stats
+from title_local import extract_local_title
+from token_budget import (
+    chars_to_tokens,
+    estimate_message_tokens,
+    estimate_messages_tokens,
+    estimate_tokens,
+    truncate_to_tokens,
+)
+from upload_limit import (
+    UPLOAD_FORM_OVERHEAD_BYTES,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_PATHS,
+    UploadLimitMiddleware,
+    upload_too_large,
+)
+from verification_jobs import QueueFullError, VerificationJobQueue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db_pool, session_db
+    if DATABASE_URL:
+        # Один пул на процесс: ход чата берёт соединение из пула, а не открывает новое.
+        db_pool = ConnectionPool(CHAT_DB_POOL_MIN, CHAT_DB_POOL_MAX)
+        session_db = db_pool.connection
+    # Соединения с Groq открываются до того, как сервис начнёт принимать запросы.
+    if GROQ_API_KEY and CHAT_HTTP_WARMUP:
+        await warm_up(
+            http_client,
+            async_http_client,
+            f"{GROQ_OPENAI_BASE_URL}/models",
+            {"Authorization": f"Bearer {GROQ_API_KEY}"},
+        )
+    await article_index_updater.start()
+    await verification_jobs.start(run_verification_job)
+    yield
+    await verification_jobs.stop()
+    await article_index_updater.stop()
+    http_client.close()
+    await async_http_client.aclose()
+    if db_pool is not None:
+        db_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Разрешаем запросы с фронта (Next.js)
 cors_raw = os.environ.get("CHAT_CORS_ORIGINS", "*").strip()
 cors_origins = [o.strip() for o in cors_raw.split(",") if o.strip()] if cors_raw else ["*"]
 
+# Последний добавленный middleware — внешний. Лимит загрузки внутри CORS:
+# иначе его 400 уходил бы без CORS-заголовков, и браузер вместо текста
+# ошибки показывал бы непрозрачную ошибку CORS.
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_body_bytes=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES,
+    paths=UPLOAD_PATHS,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
@@ -33,22 +151,64 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Латентность по маршрутам и запросы в обработке для /metrics.
+app.add_middleware(PrometheusMiddleware)
+
+# --------- ЦЕПОЧКИ МОДЕЛЕЙ (HEDGING) ---------
+
+# groq/compound с веб-поиском иногда отвечает в разы дольше медианы. Если основная
+# модель не ответила за p95 своих недавних ответов, параллельно спрашиваем
+# следующую модель цепочки; кто ответил первым — тот и выиграл. При ошибке
+# основной модели следующая вызывается сразу. Пустой список — без fallback.
+GROQ_CHAT_FALLBACK_MODELS = os.environ.get("GROQ_CHAT_FALLBACK_MODELS", "llama-3.3-70b-versatile")
+GROQ_TITLE_FALLBACK_MODELS = os.environ.get("GROQ_TITLE_FALLBACK_MODELS", "llama-3.1-8b-instant")
+CHAT_HEDGE_ENABLED = os.environ.get("CHAT_HEDGE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+CHAT_HEDGE_QUANTILE = float(os.environ.get("CHAT_HEDGE_QUANTILE", "0.95"))
+# Пока замеров меньше, хеджируем по фиксированной задержке.
+CHAT_HEDGE_MIN_SAMPLES = int(os.environ.get("CHAT_HEDGE_MIN_SAMPLES", "20"))
+CHAT_HEDGE_MIN_DELAY = float(os.environ.get("CHAT_HEDGE_MIN_DELAY", "1"))
+CHAT_HEDGE_MAX_DELAY = float(os.environ.get("CHAT_HEDGE_MAX_DELAY", "30"))
+
+
+def build_model_chain(
+    name: str, backend: LLMBackend, primary: str, fallbacks: str, default_delay: float
+) -> HedgedChain:
+    # Резервные модели — модели Groq; у другого бэкенда цепочка из одной его модели.
+    fallback_models = [m.strip() for m in fallbacks.split(",")] if backend.kind == "groq" else []
+    return HedgedChain(
+        name,
+        [primary] + fallback_models,
+        hedge=CHAT_HEDGE_ENABLED,
+        quantile=CHAT_HEDGE_QUANTILE,
+        min_samples=CHAT_HEDGE_MIN_SAMPLES,
+        default_delay=default_delay,
+        min_delay=CHAT_HEDGE_MIN_DELAY,
+        max_delay=CHAT_HEDGE_MAX_DELAY,
+    )
 
-# --------- CLIENTS ---------
-
-GROQ_API_KEY = (os.environ.get("GROQ_API_KEY") or "").strip()
-GROQ_CHAT_MODEL = (os.environ.get("GROQ_CHAT_MODEL") or "groq/compound").strip()
-GROQ_TITLE_MODEL = (os.environ.get("GROQ_TITLE_MODEL") or GROQ_CHAT_MODEL).strip()
-GROQ_MODERATION_MODEL = (os.environ.get("GROQ_MODERATION_MODEL") or GROQ_CHAT_MODEL).strip()
 
-# Клиенты инициализируем только если ключ задан, чтобы сервис мог стартовать
-# (в dev/preview окружениях ключ может быть не задан).
-client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
-vision_client = (
-    OpenAI(api_key=GROQ_API_KEY, base_url="https://api.groq.com/openai/v1")
-    if GROQ_API_KEY
-    else None
+chat_chain = build_model_chain(
+    "chat",
+    chat_backend,
+    CHAT_MODEL,
+    GROQ_CHAT_FALLBACK_MODELS,
+    float(os.environ.get("CHAT_HEDGE_DEFAULT_DELAY_CHAT", "8")),
 )
+grounded_chain = build_model_chain(
+    "chat_grounded",
+    chat_backend,
+    GROUNDED_MODEL,
+    GROQ_CHAT_FALLBACK_MODELS,
+    float(os.environ.get("CHAT_HEDGE_DEFAULT_DELAY_GROUNDED", "4")),
+)
+title_chain = build_model_chain(
+    "title",
+    title_backend,
+    TITLE_MODEL,
+    GROQ_TITLE_FALLBACK_MODELS,
+    float(os.environ.get("CHAT_HEDGE_DEFAULT_DELAY_TITLE", "2")),
+)
+
 
 # --------- SYSTEM PROMPT FOR CHAT ---------
 
@@ -121,6 +281,43 @@ TONE
 Дружелюбный, поддерживающий, эмпатичный, но профессиональный. Без категоричности.
 """.strip()
 
+# Версия промпта входит в ключ кеша ответов: правка промпта инвалидирует кеш.
+SYSTEM_PROMPT_VERSION = (
+    os.environ.get("CHAT_SYSTEM_PROMPT_VERSION")
+    or hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+).strip()
+
+# --------- CACHE ---------
+
+CHAT_RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_RESPONSE_CACHE_TTL_SECONDS", "21600"))
+CHAT_RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+chat_response_cache = build_cache(
+    "chat_response",
+    backend=CHAT_CACHE_BACKEND,
+    ttl_seconds=CHAT_RESPONSE_CACHE_TTL_SECONDS,
+    max_entries=CHAT_RESPONSE_CACHE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
+
+# Кеш по смыслу для первого сообщения чата: «как улучшить сон» ~ «как лучше спать»
+# через словарь синонимов (semantic_cache.SYNONYM_GROUPS), перефразы вне словаря
+# не ловятся. Включается явно; порог подбирается по логам "Semantic cache hit/miss".
+CHAT_SEMANTIC_CACHE = os.environ.get("CHAT_SEMANTIC_CACHE", "false").strip().lower() in ("1", "true", "yes")
+CHAT_SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("CHAT_SEMANTIC_CACHE_THRESHOLD", "0.75"))
+CHAT_SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_SEMANTIC_CACHE_TTL_SECONDS", "21600"))
+CHAT_SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+
+semantic_cache = (
+    SemanticCache(
+        threshold=CHAT_SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds=CHAT_SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries=CHAT_SEMANTIC_CACHE_MAX_ENTRIES,
+    )
+    if CHAT_SEMANTIC_CACHE
+    else None
+)
+
 # --------- CHAT HELPERS ---------
 
 
@@ -129,6 +326,8 @@ def extract_sources(executed_tools):
         return []
     tool = executed_tools[0]
     raw_results = getattr(tool, "search_results", None)
+    # В текущем SDK search_results — объект со списком results.
+    raw_results = getattr(raw_results, "results", raw_results)
     if not raw_results:
         return []
     out = []
@@ -152,90 +351,766 @@ class ChatIn(BaseModel):
     messages: List[ChatMessage] = Field(min_length=1)
 
 
-MAX_HISTORY_MESSAGES = 5
-MAX_MESSAGE_CHARS = 1800
-MAX_TOTAL_CHARS = 7000
+SYSTEM_PROMPT_TOKENS = estimate_message_tokens(SYSTEM_PROMPT)
+
+
+def token_limit_from_env(name: str, legacy_chars_name: str, default: int, extra_tokens: int = 0) -> int:
+    # Прежние лимиты в символах (CHAT_MAX_MESSAGE_CHARS, CHAT_MAX_TOTAL_CHARS)
+    # переводятся в токены: развёрнутые конфиги не должны молча потерять ограничения.
+    value = os.environ.get(name)
+    if value:
+        return int(value)
+    legacy = os.environ.get(legacy_chars_name)
+    if legacy:
+        tokens = chars_to_tokens(int(legacy)) + extra_tokens
+        print(f"{legacy_chars_name} устарела, используйте {name} (сейчас {tokens})")
+        return tokens
+    return default
 
-MAX_HISTORY_MESSAGES = int(os.environ.get("CHAT_MAX_HISTORY_MESSAGES", "5"))
-MAX_MESSAGE_CHARS = int(os.environ.get("CHAT_MAX_MESSAGE_CHARS", "1200"))
-MAX_TOTAL_CHARS = int(os.environ.get("CHAT_MAX_TOTAL_CHARS", "4500"))
+
+# Бюджет промпта чата в токенах (оценка token_budget), включая системный промпт.
+# Реплики, не поместившиеся в окно, сворачиваются в краткое содержание.
+# CHAT_MAX_TOTAL_CHARS ограничивал только историю, без системного промпта.
+CHAT_PROMPT_TOKEN_BUDGET = token_limit_from_env(
+    "CHAT_PROMPT_TOKEN_BUDGET", "CHAT_MAX_TOTAL_CHARS", 3500, extra_tokens=SYSTEM_PROMPT_TOKENS
+)
+CHAT_MAX_MESSAGE_TOKENS = token_limit_from_env("CHAT_MAX_MESSAGE_TOKENS", "CHAT_MAX_MESSAGE_CHARS", 600)
+MAX_HISTORY_MESSAGES = int(os.environ.get("CHAT_MAX_HISTORY_MESSAGES", "10"))
+CHAT_HISTORY_SUMMARY = os.environ.get("CHAT_HISTORY_SUMMARY", "true").strip().lower() in ("1", "true", "yes")
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", "250"))
+# Сколько токенов свёрнутых реплик отправляется на одно обновление содержания
+CHAT_SUMMARY_INPUT_TOKENS = int(os.environ.get("CHAT_SUMMARY_INPUT_TOKENS", "2500"))
+CHAT_SUMMARY_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_SUMMARY_CACHE_TTL_SECONDS", "86400"))
+CHAT_SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_SUMMARY_CACHE_MAX_ENTRIES", "5000"))
 
 MAX_TITLE_INPUT_CHARS = int(os.environ.get("CHAT_MAX_TITLE_INPUT_CHARS", "700"))
 MAX_CHAT_OUTPUT_TOKENS = int(os.environ.get("CHAT_MAX_OUTPUT_TOKENS", "800"))
 MAX_TITLE_OUTPUT_TOKENS = int(os.environ.get("CHAT_TITLE_OUTPUT_TOKENS", "20"))
 
+SUMMARY_SYSTEM_PROMPT = """
+Ты сжимаешь переписку пользователя с wellness-ассистентом.
+Тебе дают прежнее краткое содержание (может отсутствовать) и новые реплики.
+Верни обновлённое краткое содержание на русском языке, не длиннее 6 предложений:
+о чём спрашивал пользователь, важные факты о нём (возраст, цели, ограничения,
+упомянутые симптомы и рекомендации обратиться к врачу) и что уже было посоветовано.
+Без вступлений и пояснений — только текст содержания.
+""".strip()
 
-def compact_chat_history(history: List[ChatMessage]) -> List[ChatMessage]:
-    recent = history[-MAX_HISTORY_MESSAGES:]
-    trimmed: List[ChatMessage] = []
-    total = 0
+SUMMARY_PROMPT_VERSION = make_cache_key(
+    SUMMARY_SYSTEM_PROMPT, SUMMARY_MODEL, CHAT_SUMMARY_MAX_TOKENS
+)[:12]
+
+# Краткое содержание хранится по хешу префикса диалога: на следующем ходе
+# префикс тот же (или длиннее на пару реплик) — пересуммаризировать не нужно.
+summary_cache = build_cache(
+    "chat_summary",
+    backend=CHAT_CACHE_BACKEND,
+    ttl_seconds=CHAT_SUMMARY_CACHE_TTL_SECONDS,
+    max_entries=CHAT_SUMMARY_CACHE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
 
+history_compaction_stats: Counter = Counter()
+
+
+def compact_chat_history(history: List[ChatMessage]) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+    """
+    Делит историю на (старые реплики для краткого содержания, окно свежих реплик).
+    Окно набирается с конца, пока оценка токенов укладывается в бюджет
+    вместе с системным промптом и местом под краткое содержание.
+    """
+    messages = [
+        ChatMessage(role=m.role, content=m.content.strip())
+        for m in history
+        if m.content.strip()
+    ]
+
+    available = CHAT_PROMPT_TOKEN_BUDGET - SYSTEM_PROMPT_TOKENS
+    if CHAT_HISTORY_SUMMARY and len(messages) > 1:
+        available -= estimate_message_tokens("") + CHAT_SUMMARY_MAX_TOKENS
+
+    window: List[ChatMessage] = []
+    total = 0
     # Идем с конца, чтобы сохранить самые свежие реплики.
-    for msg in reversed(recent):
-        content = msg.content.strip()
-        if not content:
-            continue
+    for msg in reversed(messages[-MAX_HISTORY_MESSAGES:]):
+        content = truncate_to_tokens(msg.content, CHAT_MAX_MESSAGE_TOKENS)
+        tokens = estimate_message_tokens(content)
+
+        if total + tokens > available:
+            # Последнее сообщение пользователя отправляем хотя бы частично.
+            if not window:
+                content = truncate_to_tokens(content, available - estimate_message_tokens(""))
+                if content:
+                    window.append(ChatMessage(role=msg.role, content=content))
+                    total = available
+            break
 
-        if len(content) > MAX_MESSAGE_CHARS:
-            content = content[:MAX_MESSAGE_CHARS]
+        window.append(ChatMessage(role=msg.role, content=content))
+        total += tokens
 
-        if total + len(content) > MAX_TOTAL_CHARS:
-            remaining = MAX_TOTAL_CHARS - total
-            if remaining <= 0:
-                break
-            content = content[:remaining]
+    window.reverse()
+    older = messages[: len(messages) - len(window)]
+    return older, window
+
+
+def summary_prefix_keys(older: List[ChatMessage]) -> List[str]:
+    # Цепочка хешей: keys[i] описывает префикс older[: i + 1].
+    keys: List[str] = []
+    prev = SUMMARY_PROMPT_VERSION
+    for msg in older:
+        prev = make_cache_key("chat_summary", prev, msg.role, normalize_cache_text(msg.content))
+        keys.append(prev)
+    return keys
 
-        trimmed.append(ChatMessage(role=msg.role, content=content))
-        total += len(content)
 
-        if total >= MAX_TOTAL_CHARS:
+def request_history_summary(previous: Optional[str], new_messages: List[ChatMessage]) -> str:
+    lines: List[str] = []
+    budget = CHAT_SUMMARY_INPUT_TOKENS
+    # Если свернуть нужно сразу много реплик, в приоритете более поздние.
+    for msg in reversed(new_messages):
+        speaker = "Пользователь" if msg.role == "user" else "Ассистент"
+        content = truncate_to_tokens(msg.content, min(CHAT_MAX_MESSAGE_TOKENS, budget))
+        if not content:
             break
+        lines.append(f"{speaker}: {content}")
+        budget -= estimate_message_tokens(content)
+    lines.reverse()
 
-    return list(reversed(trimmed))
+    user_prompt = (
+        f"Прежнее краткое содержание:\n{previous or '(нет)'}\n\n"
+        "Новые реплики:\n" + "\n".join(lines)
+    )
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    resp = summary_backend.governor.call(
+        "chat",
+        SUMMARY_MODEL,
+        estimate_messages_tokens(messages) + CHAT_SUMMARY_MAX_TOKENS,
+        lambda: summary_backend.client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=messages,
+            max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+            temperature=0.2,
+            timeout=request_timeout(GROQ_TIMEOUTS["summary"]),
+        ),
+    )
+    summary = (resp.choices[0].message.content or "").strip()
+    return truncate_to_tokens(summary, CHAT_SUMMARY_MAX_TOKENS)
 
 
-def ask_groq_structured(history: List[ChatMessage]) -> dict:
-    if not client:
-        raise HTTPException(status_code=500, detail="GROQ_API_KEY не задан")
-    history = compact_chat_history(history)
+def summarize_history(older: List[ChatMessage]) -> Optional[str]:
+    """
+    Возвращает краткое содержание реплик older. Ищет в кеше самый длинный уже
+    свёрнутый префикс и досуммаризирует только реплики после него.
+    """
+    keys = summary_prefix_keys(older)
+
+    previous: Optional[str] = None
+    done = 0
+    for i in range(len(keys) - 1, -1, -1):
+        cached = summary_cache.get(keys[i])
+        if cached is not None:
+            previous, done = cached, i + 1
+            break
+
+    if done == len(older):
+        return previous
+
+    summary = extend_summary(previous, older[done:])
+    if summary:
+        summary_cache.set(keys[-1], summary)
+    return summary or previous
+
+
+def extend_summary(previous: Optional[str], new_messages: List[ChatMessage]) -> Optional[str]:
+    """Дописывает new_messages в краткое содержание; None — модель недоступна или ошибка."""
+    if not summary_backend.available:
+        return None
+    try:
+        history_compaction_stats["summary_calls"] += 1
+        return request_history_summary(previous, new_messages) or None
+    except Exception as e:
+        # Без содержания диалог всё равно продолжится — просто с коротким окном.
+        history_compaction_stats["summary_errors"] += 1
+        print("Groq summary error:", repr(e))
+        return None
+
+
+def build_chat_messages(history: List[ChatMessage], articles: Optional[List[ArticleHit]] = None) -> List[dict]:
+    older, window = compact_chat_history(history)
+
+    summary = None
+    history_compaction_stats["requests"] += 1
+    if older and CHAT_HISTORY_SUMMARY:
+        summary = summarize_history(older)
+    elif older:
+        history_compaction_stats["dropped"] += 1
+    return assemble_chat_messages(summary, window, articles)
+
 
+def assemble_chat_messages(
+    summary: Optional[str],
+    window: List[ChatMessage],
+    articles: Optional[List[ArticleHit]] = None,
+) -> List[dict]:
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    messages += [{"role": m.role, "content": m.content} for m in history]
+    if summary:
+        history_compaction_stats["summarized"] += 1
+        messages.append(
+            {"role": "system", "content": f"Краткое содержание начала диалога:\n{summary}"}
+        )
+    if articles:
+        messages.append(article_context_message(articles))
+
+    messages += [{"role": m.role, "content": m.content} for m in window]
+    history_compaction_stats["prompt_tokens"] += estimate_messages_tokens(messages)
+    return messages
+
+
+def history_compaction_snapshot() -> dict:
+    snapshot = dict(history_compaction_stats)
+    requests = history_compaction_stats["requests"]
+    snapshot["avg_prompt_tokens"] = round(history_compaction_stats["prompt_tokens"] / requests) if requests else None
+    snapshot["prompt_token_budget"] = CHAT_PROMPT_TOKEN_BUDGET
+    return snapshot
+
+
+# --------- СТАТЬИ ПЛАТФОРМЫ (ПОИСК) ---------
+
+# Фрагменты статей платформы, найденные по вопросу, уходят в промпт, а сами
+# статьи — в sources со ссылкой на платформу. Если что-то нашлось, отвечает
+# обычная модель (GROQ_GROUNDED_MODEL) — без веб-поиска compound и в разы быстрее.
+CHAT_RETRIEVAL_ENABLED = os.environ.get("CHAT_RETRIEVAL_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+CHAT_RETRIEVAL_TOP_K = int(os.environ.get("CHAT_RETRIEVAL_TOP_K", "3"))
+# Порог BM25: ниже него совпадение случайное (одно общее слово вроде «здоровье»).
+CHAT_RETRIEVAL_MIN_SCORE = float(os.environ.get("CHAT_RETRIEVAL_MIN_SCORE", "3.0"))
+# Объём фрагментов в промпте; сверх CHAT_PROMPT_TOKEN_BUDGET, историю не вытесняет.
+CHAT_RETRIEVAL_MAX_TOKENS = int(os.environ.get("CHAT_RETRIEVAL_MAX_TOKENS", "1200"))
+CHAT_RETRIEVAL_PASSAGE_CHARS = int(os.environ.get("CHAT_RETRIEVAL_PASSAGE_CHARS", "800"))
+CHAT_ARTICLE_INDEX_REFRESH_SECONDS = float(os.environ.get("CHAT_ARTICLE_INDEX_REFRESH_SECONDS", "300"))
+CHAT_ARTICLES_JSON_PATH = os.environ.get("CHAT_ARTICLES_JSON_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "articles.json"
+)
+# Адрес фронтенда: ссылка на статью — {CHAT_PLATFORM_URL}/feed/{id}
+CHAT_PLATFORM_URL = (os.environ.get("CHAT_PLATFORM_URL") or "").strip().rstrip("/")
+
+ARTICLE_CONTEXT_PROMPT = (
+    "Материалы статей платформы по теме вопроса. Опирайся на них в первую очередь "
+    "и не приписывай им того, чего в них нет. Если их недостаточно для ответа, "
+    "скажи об этом и дай общие рекомендации."
+)
+
+article_index = ArticleIndex(passage_chars=CHAT_RETRIEVAL_PASSAGE_CHARS)
+article_index_updater = ArticleIndexUpdater(
+    article_index,
+    CHAT_ARTICLES_JSON_PATH,
+    get_connection=get_connection if DATABASE_URL else None,
+    refresh_seconds=CHAT_ARTICLE_INDEX_REFRESH_SECONDS,
+)
+retrieval_stats: Counter = Counter()
+
+
+def retrieval_query(history: List[ChatMessage]) -> str:
+    user_turns = [m.content for m in history if m.role == "user"]
+    query = user_turns[-1] if user_turns else ""
+    # Короткое уточнение («а что насчёт кофе?») ищем вместе с предыдущим вопросом.
+    if len(content_stems(query)) < 3 and len(user_turns) > 1:
+        query = f"{user_turns[-2]}\n{query}"
+    return query
+
+
+def retrieve_articles(history: List[ChatMessage]) -> List[ArticleHit]:
+    if not CHAT_RETRIEVAL_ENABLED:
+        return []
+    hits = article_index.search(retrieval_query(history), CHAT_RETRIEVAL_TOP_K, CHAT_RETRIEVAL_MIN_SCORE)
+    retrieval_stats["requests"] += 1
+    retrieval_stats["grounded" if hits else "no_match"] += 1
+    return hits
+
+
+def article_context_message(articles: List[ArticleHit]) -> dict:
+    per_article = CHAT_RETRIEVAL_MAX_TOKENS // len(articles)
+    parts = [
+        f"[{i}] {hit.title}\n{truncate_to_tokens(hit.text, per_article)}"
+        for i, hit in enumerate(articles, 1)
+    ]
+    return {"role": "system", "content": ARTICLE_CONTEXT_PROMPT + "\n\n" + "\n\n".join(parts)}
+
+
+def article_sources(articles: List[ArticleHit]) -> List[dict]:
+    # Статьи только из articles.json (без базы) не имеют id — ссылку на них не построить.
+    return [
+        {"title": hit.title, "url": f"{CHAT_PLATFORM_URL}/feed/{hit.article_id}"}
+        for hit in articles
+        if hit.article_id
+    ]
+
+
+def prepare_chat_messages(history: List[ChatMessage]) -> Tuple[List[dict], List[ArticleHit]]:
+    articles = retrieve_articles(history)
+    return build_chat_messages(history, articles), articles
+
+
+def normalize_cache_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text.strip().lower().replace("ё", "е"))
 
+
+def chat_cache_key(messages: List[dict]) -> str:
+    # Системный промпт представлен версией, а не полным текстом;
+    # краткое содержание начала диалога входит в ключ как обычная реплика.
+    turns = [
+        (m["role"], normalize_cache_text(m["content"]))
+        for m in messages[1:]
+    ]
+    return make_cache_key(
+        "chat", CHAT_MODEL, SYSTEM_PROMPT_VERSION, MAX_CHAT_OUTPUT_TOKENS, turns
+    )
+
+
+def first_turn_question(history: List[ChatMessage]) -> Optional[str]:
+    if len(history) == 1 and history[0].role == "user":
+        return history[0].content
+    return None
+
+
+def semantic_cache_scope() -> str:
+    return make_cache_key(CHAT_MODEL, SYSTEM_PROMPT_VERSION, MAX_CHAT_OUTPUT_TOKENS)
+
+
+def get_cached_chat_answer(history: List[ChatMessage], cache_key: str) -> Optional[dict]:
+    cached = chat_response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    question = first_turn_question(history)
+    if semantic_cache and question:
+        match = semantic_cache.lookup(semantic_cache_scope(), question)
+        if match:
+            return match[0]
+    return None
+
+
+def store_chat_answer(history: List[ChatMessage], cache_key: str, result: dict) -> None:
+    if not result["answer"]:
+        return
+    chat_response_cache.set(cache_key, result)
+
+    question = first_turn_question(history)
+    if semantic_cache and question:
+        semantic_cache.store(semantic_cache_scope(), question, result)
+
+
+def groq_chat_http_error(e: Exception) -> HTTPException:
+    # Groq SDK кидает исключения при 4xx/5xx. Возвращаем корректный статус.
+    overload = groq_overload_error(e)
+    if overload:
+        return overload
+    status_code = getattr(e, "status_code", None)
+    error_text = str(e)
+    if status_code == 413 or "413" in error_text or "request_too_large" in error_text:
+        return HTTPException(
+            status_code=413,
+            detail="Слишком длинный запрос к ИИ. Сократите текст сообщения и попробуйте снова.",
+        )
+    return HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
+
+
+def shorten_reasoning(reasoning: Optional[str]) -> Optional[str]:
+    if reasoning:
+        reasoning = textwrap.shorten(reasoning, width=350, placeholder=" ...")
+    return reasoning
+
+
+# Одинаковые запросы, пришедшие одновременно (несколько вкладок, повторная
+# отправка), делят один вызов модели — ключ тот же, что у кеша.
+chat_flight = build_single_flight("chat")
+title_flight = build_single_flight("title")
+verification_flight = build_single_flight("expert_verification")
+
+
+# ---------- ДЕДЛАЙНЫ И ОТМЕНА ----------
+
+# Сколько по умолчанию ждём ответа модели на запрос клиента. Клиент может
+# сократить срок заголовком X-Request-Deadline (Unix-время в секундах).
+CHAT_REQUEST_DEADLINE_SECONDS = float(os.environ.get("CHAT_REQUEST_DEADLINE_SECONDS", "120"))
+DISCONNECT_POLL_SECONDS = 0.5
+
+T = TypeVar("T")
+
+# эндпоинт -> {"disconnected": n, "deadline": n}
+cancellation_stats: Dict[str, Counter] = defaultdict(Counter)
+
+
+def request_deadline(header_value: Optional[str]) -> float:
+    deadline = time.time() + CHAT_REQUEST_DEADLINE_SECONDS
+    if header_value:
+        try:
+            deadline = min(deadline, float(header_value))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный заголовок X-Request-Deadline")
+    return deadline
+
+
+def deadline_exceeded_error() -> HTTPException:
+    return HTTPException(status_code=504, detail="Истекло время ожидания ответа модели")
+
+
+async def run_until_disconnect(request: Request, endpoint: str, deadline: float, work: Awaitable[T]) -> T:
+    """
+    Выполняет work, пока клиент на связи и не истёк дедлайн. Иначе отменяет
+    работу: ожидание в очереди регулятора и сам запрос к Groq прерываются,
+    токены на ответ, который никто не прочитает, не тратятся.
+    """
+    task = asyncio.ensure_future(work)
     try:
-        resp = client.chat.completions.create(
-            model=GROQ_CHAT_MODEL,
-            messages=messages,
-            max_tokens=MAX_CHAT_OUTPUT_TOKENS,
-            temperature=0.4,
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                cancellation_stats[endpoint]["deadline"] += 1
+                print(f"Request deadline exceeded: {endpoint}")
+                raise deadline_exceeded_error()
+
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, remaining))
+            if done:
+                return task.result()
+
+            if await request.is_disconnected():
+                cancellation_stats[endpoint]["disconnected"] += 1
+                print(f"Client disconnected, upstream call cancelled: {endpoint}")
+                # 499 (nginx): ответ уже никто не получит.
+                raise HTTPException(status_code=499, detail="Клиент закрыл соединение")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def ask_groq_structured(history: List[ChatMessage]) -> dict:
+    require_backend(chat_backend)
+    # Сворачивание истории может обратиться к модели (синхронный клиент).
+    messages, articles = await asyncio.to_thread(prepare_chat_messages, history)
+    return await answer_chat(history, messages, articles)
+
+
+async def answer_chat(history: List[ChatMessage], messages: List[dict], articles: List[ArticleHit]) -> dict:
+    cache_key = chat_cache_key(messages)
+    cached = get_cached_chat_answer(history, cache_key)
+    if cached is not None:
+        return cached
+
+    return await chat_flight.ado(cache_key, lambda: fetch_chat_answer(history, messages, cache_key, articles))
+
+
+async def fetch_chat_answer(
+    history: List[ChatMessage],
+    messages: List[dict],
+    cache_key: str,
+    articles: List[ArticleHit],
+) -> dict:
+    def request_answer(model: str):
+        return chat_backend.governor.acall(
+            "chat",
+            model,
+            estimate_messages_tokens(messages) + MAX_CHAT_OUTPUT_TOKENS,
+            lambda: chat_backend.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=MAX_CHAT_OUTPUT_TOKENS,
+                temperature=0.4,
+                timeout=request_timeout(GROQ_TIMEOUTS["chat"]),
+            ),
         )
+
+    try:
+        # Ответ резервной модели кешируем под тем же ключом: он отвечает на тот же вопрос.
+        resp, _ = await (grounded_chain if articles else chat_chain).call(request_answer)
     except Exception as e:
-        # Groq SDK кидает исключения при 4xx/5xx. Возвращаем корректный статус.
         print("Groq chat error:", repr(e))
-        status_code = getattr(e, "status_code", None)
-        error_text = str(e)
-        if status_code == 413 or "413" in error_text or "request_too_large" in error_text:
-            raise HTTPException(
-                status_code=413,
-                detail="Слишком длинный запрос к ИИ. Сократите текст сообщения и попробуйте снова.",
-            )
-        raise HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
+        raise groq_chat_http_error(e)
 
     msg = resp.choices[0].message
     answer = (msg.content or "").strip()
+    reasoning = shorten_reasoning(getattr(msg, "reasoning", None))
+    sources = article_sources(articles) + extract_sources(getattr(msg, "executed_tools", None))
+
+    result = {"answer": answer, "reasoning": reasoning, "sources": sources}
+    store_chat_answer(history, cache_key, result)
+    return result
 
-    reasoning = getattr(msg, "reasoning", None)
-    if reasoning:
-        reasoning = textwrap.shorten(reasoning, width=350, placeholder=" ...")
 
-    sources = extract_sources(getattr(msg, "executed_tools", None))
+@app.post("/chat")
+async def chat(
+    body: ChatIn,
+    request: Request,
+    deadline_header: Optional[str] = Header(default=None, alias="X-Request-Deadline"),
+):
+    deadline = request_deadline(deadline_header)
+    return await run_until_disconnect(request, "chat", deadline, ask_groq_structured(body.messages))
+
+
+# ---------- СЕССИИ ЧАТА ----------
+
+# /chat/session: клиент присылает id чата (Chat.id) и только новую реплику.
+# Свёрнутая история держится в памяти воркера, реплика и ответ пишутся в
+# ChatMessage — отдельно сохранять их через Node-бэкенд не нужно.
+# Без DATABASE_URL сессии живут только в памяти (dev).
+# Нужен JWT Node-бэкенда (Authorization: Bearer ...): чат доступен только владельцу,
+# чужой или несуществующий чат — 404.
+CHAT_SESSION_MAX_ENTRIES = int(os.environ.get("CHAT_SESSION_MAX_ENTRIES", "2000"))
+CHAT_SESSION_TTL_SECONDS = int(os.environ.get("CHAT_SESSION_TTL_SECONDS", "3600"))
+# Соединения к базе на процесс; пул создаётся в lifespan.
+CHAT_DB_POOL_MIN = int(os.environ.get("CHAT_DB_POOL_MIN", "1"))
+CHAT_DB_POOL_MAX = int(os.environ.get("CHAT_DB_POOL_MAX", "10"))
+
+chat_sessions = SessionStore(max_entries=CHAT_SESSION_MAX_ENTRIES, ttl_seconds=CHAT_SESSION_TTL_SECONDS)
+db_pool: Optional[ConnectionPool] = None
+session_db: Optional[Callable] = None
+chat_session_stats: Counter = Counter()
+
+
+class ChatSessionIn(BaseModel):
+    chat_id: str = Field(min_length=1, max_length=64)
+    message: str = Field(min_length=1)
+
+
+def load_session(chat_id: str, user_id: int) -> ChatSession:
+    session = chat_sessions.get(chat_id)
+    if session is not None and session.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+    if session_db is None:
+        if session is None:
+            session = ChatSession(chat_id, user_id)
+            chat_sessions.put(session)
+        return session
+
+    if session is not None:
+        try:
+            fresh = count_chat_messages(session_db, chat_id, user_id) == session.stored_count
+        except Exception as e:
+            # База моргнула — продолжаем с тем, что в памяти.
+            print("Chat session check error:", repr(e))
+            fresh = True
+        if fresh:
+            chat_session_stats["hits"] += 1
+            return session
+        chat_session_stats["stale"] += 1
 
-    return {"answer": answer, "reasoning": reasoning, "sources": sources}
+    try:
+        rows = load_chat_messages(session_db, chat_id, user_id)
+    except Exception as e:
+        print("Chat session load error:", repr(e))
+        raise HTTPException(status_code=503, detail="История чата временно недоступна")
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
+    chat_session_stats["loads"] += 1
+    history = [
+        ChatMessage(role=role, content=text)
+        for role, text in rows
+        if role in ("user", "assistant") and text.strip()
+    ]
+    older, window = compact_chat_history(history)
+    summary = summarize_history(older) if older and CHAT_HISTORY_SUMMARY else None
+    session = ChatSession(chat_id, user_id, summary=summary, recent=window, stored_count=len(rows))
+    chat_sessions.put(session)
+    return session
 
 
-@app.post("/chat")
-def chat(body: ChatIn):
-    return ask_groq_structured(body.messages)
+def prepare_session_turn(
+    session: ChatSession, message: str
+) -> Tuple[List[dict], List[ArticleHit], List[ChatMessage], Optional[str]]:
+    """
+    Свёртка только новой реплики: окно сдвигается, выпавшие реплики дописываются
+    в краткое содержание сессии одним вызовом — вся история не перебирается.
+    """
+    older, window = compact_chat_history(session.recent + [ChatMessage(role="user", content=message)])
+    summary = session.summary
+    history_compaction_stats["requests"] += 1
+    if older and CHAT_HISTORY_SUMMARY:
+        summary = extend_summary(summary, older) or summary
+    elif older:
+        history_compaction_stats["dropped"] += 1
+
+    articles = retrieve_articles(window)
+    return assemble_chat_messages(summary, window, articles), articles, window, summary
+
+
+def commit_session_turn(
+    session: ChatSession, window: List[ChatMessage], summary: Optional[str], message: str, answer: str
+) -> None:
+    session.summary = summary
+    session.recent = window + [ChatMessage(role="assistant", content=answer)]
+    if session_db is not None:
+        try:
+            if append_chat_messages(
+                session_db, session.chat_id, session.user_id, [("user", message), ("assistant", answer)]
+            ):
+                session.stored_count += 2
+            else:
+                # Чат удалили, пока шёл ход: следующий ход получит 404.
+                chat_session_stats["write_errors"] += 1
+                print("Chat session write skipped: chat not found", session.chat_id)
+        except Exception as e:
+            # Ответ пользователю всё равно отдаём; следующий ход перечитает историю из базы.
+            chat_session_stats["write_errors"] += 1
+            print("Chat session write error:", repr(e))
+    chat_sessions.put(session)
+
+
+async def ask_in_session(chat_id: str, user_id: int, message: str) -> dict:
+    require_backend(chat_backend)
+
+    async with chat_sessions.turn_lock(chat_id):
+        session = await asyncio.to_thread(load_session, chat_id, user_id)
+        messages, articles, window, summary = await asyncio.to_thread(prepare_session_turn, session, message)
+        result = await answer_chat(window, messages, articles)
+        # Сессия меняется только после ответа: отменённый ход её не трогает.
+        await asyncio.to_thread(commit_session_turn, session, window, summary, message, result["answer"])
+        return result
+
+
+@app.post("/chat/session")
+async def chat_session(
+    body: ChatSessionIn,
+    request: Request,
+    deadline_header: Optional[str] = Header(default=None, alias="X-Request-Deadline"),
+    authorization: Optional[str] = Header(default=None),
+):
+    user_id = user_id_from_authorization(authorization)
+    message = body.message.strip()
+    if not message:
+        raise HTTPException(status_code=400, detail="Пустое сообщение")
+    deadline = request_deadline(deadline_header)
+    return await run_until_disconnect(
+        request, "chat_session", deadline, ask_in_session(body.chat_id, user_id, message)
+    )
+
+
+# ---------- СТРИМИНГ ЧАТА (SSE) ----------
+
+
+def sse_event(event: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def stream_groq_structured(
+    history: List[ChatMessage], deadline: float, endpoint: str = "chat_stream"
+) -> AsyncIterator[str]:
+    """
+    Стримит ответ модели токенами в формате Server-Sent Events.
+    События: "delta" ({"text": ...}) по мере генерации, затем "done" с теми же
+    полями, что и у /chat, либо "error" ({"status_code", "detail"}).
+    Если клиент закрыл соединение, Starlette отменяет генератор — поток Groq
+    закрывается в finally; по дедлайну клиент получает "error" с кодом 504.
+    """
+    # Сворачивание истории может обратиться к модели (синхронный клиент).
+    messages, articles = await asyncio.to_thread(prepare_chat_messages, history)
+
+    cache_key = chat_cache_key(messages)
+    cached = get_cached_chat_answer(history, cache_key)
+    if cached is not None:
+        yield sse_event("delta", {"text": cached["answer"]})
+        yield sse_event("done", cached)
+        return
+
+    answer_parts: List[str] = []
+    reasoning_parts: List[str] = []
+    executed_tools: list = []
+    stream = None
+
+    def open_stream(model: str):
+        return chat_backend.governor.acall(
+            "chat",
+            model,
+            estimate_messages_tokens(messages) + MAX_CHAT_OUTPUT_TOKENS,
+            lambda: chat_backend.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=MAX_CHAT_OUTPUT_TOKENS,
+                temperature=0.4,
+                stream=True,
+                timeout=request_timeout(GROQ_TIMEOUTS["chat"]),
+            ),
+        )
+
+    async def close_stream(unused_stream) -> None:
+        await unused_stream.close()
+
+    try:
+        # Повторы и хеджирование возможны только до начала потока: сам поток не перезапускается.
+        stream, model = await asyncio.wait_for(
+            (grounded_chain if articles else chat_chain).call(open_stream, discard=close_stream, mode="stream"),
+            timeout=deadline - time.time(),
+        )
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - time.time())
+            except StopAsyncIteration:
+                break
+            # usage у стрима приходит в последнем чанке (x_groq), а не в ответе на create.
+            observe_tokens("chat", model, getattr(getattr(chunk, "x_groq", None), "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            reasoning_piece = getattr(delta, "reasoning", None)
+            if reasoning_piece:
+                reasoning_parts.append(reasoning_piece)
+
+            # compound присылает результаты поиска отдельными дельтами
+            tools = getattr(delta, "executed_tools", None)
+            if tools:
+                executed_tools += [t for t in tools if getattr(t, "search_results", None)]
+
+            if delta.content:
+                answer_parts.append(delta.content)
+                yield sse_event("delta", {"text": delta.content})
+    except asyncio.TimeoutError:
+        cancellation_stats[endpoint]["deadline"] += 1
+        print(f"Request deadline exceeded: {endpoint}")
+        http_error = deadline_exceeded_error()
+        yield sse_event("error", {"status_code": http_error.status_code, "detail": http_error.detail})
+        return
+    except asyncio.CancelledError:
+        cancellation_stats[endpoint]["disconnected"] += 1
+        print(f"Client disconnected, upstream call cancelled: {endpoint}")
+        raise
+    except Exception as e:
+        print("Groq chat stream error:", repr(e))
+        http_error = groq_chat_http_error(e)
+        yield sse_event("error", {"status_code": http_error.status_code, "detail": http_error.detail})
+        return
+    finally:
+        if stream is not None:
+            await stream.close()
+
+    result = {
+        "answer": "".join(answer_parts).strip(),
+        "reasoning": shorten_reasoning("".join(reasoning_parts)),
+        "sources": article_sources(articles) + extract_sources(executed_tools),
+    }
+    store_chat_answer(history, cache_key, result)
+
+    yield sse_event("done", result)
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    body: ChatIn,
+    deadline_header: Optional[str] = Header(default=None, alias="X-Request-Deadline"),
+):
+    require_backend(chat_backend)
+    deadline = request_deadline(deadline_header)
+
+    return StreamingResponse(
+        stream_groq_structured(body.messages, deadline),
+        media_type="text/event-stream",
+        # Отключаем буферизацию на прокси (nginx), иначе токены придут пачкой.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ---------- ГЕНЕРАЦИЯ НАЗВАНИЯ ЧАТА ----------
@@ -244,150 +1119,291 @@ class TitleIn(BaseModel):
     text: str = Field(min_length=1)
 
 
+TITLE_SYSTEM_PROMPT = (
+    "Ты генерируешь очень короткие названия чатов на русском. "
+    "Дай заголовок 1–2 слова, без кавычек, без точки в конце. "
+    "Он должен отражать тему, а не копировать текст дословно."
+)
+TITLE_PROMPT_VERSION = hashlib.sha256(TITLE_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Ниже этого порога локальный выбор названия считается ненадёжным — идём в модель.
+CHAT_TITLE_LOCAL_MIN_CONFIDENCE = float(os.environ.get("CHAT_TITLE_LOCAL_MIN_CONFIDENCE", "0.7"))
+CHAT_TITLE_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_TITLE_CACHE_TTL_SECONDS", "604800"))
+CHAT_TITLE_CACHE_MAX_ENTRIES = int(os.environ.get("CHAT_TITLE_CACHE_MAX_ENTRIES", "5000"))
+
+title_cache = build_cache(
+    "title",
+    backend=CHAT_CACHE_BACKEND,
+    ttl_seconds=CHAT_TITLE_CACHE_TTL_SECONDS,
+    max_entries=CHAT_TITLE_CACHE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
+
+# Откуда взялось название: cache / local / model / fallback
+title_source_counts: Counter = Counter()
+
+
+def clean_title(raw_title: str) -> str:
+    title = (raw_title or "").strip()
+    title = title.strip('*"“”«» .')
+
+    if len(title) > 18:
+        title = title[:18].rstrip()
+    return title
+
+
+def fallback_title(text: str, local_title: Optional[str]) -> dict:
+    title_source_counts["fallback"] += 1
+    fallback = local_title or text.split("\n")[0][:18].strip()
+    return {"title": fallback or "Новый чат"}
+
+
 @app.post("/generate-title")
-def generate_title(body: TitleIn):
-    if not client:
-        raise HTTPException(status_code=500, detail="GROQ_API_KEY не задан")
+async def generate_title(body: TitleIn):
+    return await resolve_title(body.text)
 
-    title_system = (
-        "Ты генерируешь очень короткие названия чатов на русском. "
-        "Дай заголовок 1–2 слова, без кавычек, без точки в конце. "
-        "Он должен отражать тему, а не копировать текст дословно."
-    )
 
-    text = body.text.strip()
+async def resolve_title(text: str) -> dict:
+    text = text.strip()
     if len(text) > MAX_TITLE_INPUT_CHARS:
         text = text[:MAX_TITLE_INPUT_CHARS].rstrip()
 
-    try:
-        resp = client.chat.completions.create(
-            model=GROQ_TITLE_MODEL,
-            messages=[
-                {"role": "system", "content": title_system},
-                {"role": "user", "content": text},
-            ],
-            temperature=0.2,
-            max_tokens=MAX_TITLE_OUTPUT_TOKENS,
+    # 1) Кеш по нормализованному первому сообщению
+    cache_key = make_cache_key(
+        "title", TITLE_MODEL, TITLE_PROMPT_VERSION, normalize_cache_text(text)
+    )
+    cached = title_cache.get(cache_key)
+    if cached is not None:
+        title_source_counts["cache"] += 1
+        return cached
+
+    # 2) Локальный выбор ключевого слова — без запроса к модели
+    local_title, confidence = extract_local_title(text)
+    if local_title and confidence >= CHAT_TITLE_LOCAL_MIN_CONFIDENCE:
+        title_source_counts["local"] += 1
+        result = {"title": clean_title(local_title)}
+        title_cache.set(cache_key, result)
+        return result
+
+    # 3) Модель
+    require_backend(title_backend)
+
+    return await title_flight.ado(cache_key, lambda: request_model_title(text, local_title, cache_key))
+
+
+async def request_model_title(text: str, local_title: Optional[str], cache_key: str) -> dict:
+    messages = [
+        {"role": "system", "content": TITLE_SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ]
+
+    def request_title(model: str):
+        return title_backend.governor.acall(
+            "title",
+            model,
+            estimate_messages_tokens(messages) + MAX_TITLE_OUTPUT_TOKENS,
+            lambda: title_backend.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=MAX_TITLE_OUTPUT_TOKENS,
+                timeout=request_timeout(GROQ_TIMEOUTS["title"]),
+            ),
         )
+
+    try:
+        resp, _ = await title_chain.call(request_title)
     except Exception as e:
         print("Groq title error:", repr(e))
         status_code = getattr(e, "status_code", None)
         error_text = str(e)
 
-        if status_code == 413 or "413" in error_text or "request_too_large" in error_text:
-            fallback = text.split("\n")[0][:18].strip()
-            return {"title": fallback or "Новый чат"}
+        # Название не стоит ожидания: при перегрузке отдаём локальное.
+        if (
+            groq_overload_error(e)
+            or status_code == 413
+            or "413" in error_text
+            or "request_too_large" in error_text
+        ):
+            return fallback_title(text, local_title)
 
         raise HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
 
-    title = (resp.choices[0].message.content or "").strip()
-    title = title.strip('*"“”«» .')
+    title_source_counts["model"] += 1
+    title = clean_title(resp.choices[0].message.content or "")
+    result = {"title": title or "Новый чат"}
+    if title:
+        title_cache.set(cache_key, result)
+    return result
 
-    if len(title) > 18:
-        title = title[:18].rstrip()
 
-    return {"title": title or "Новый чат"}
+# ---------- НОВЫЙ ЧАТ: НАЗВАНИЕ И ПЕРВЫЙ ОТВЕТ ----------
 
+# Дольше этого название не ждём: ответ уже идёт, клиент получит запасное название.
+CHAT_START_TITLE_MAX_WAIT_SECONDS = float(os.environ.get("CHAT_START_TITLE_MAX_WAIT_SECONDS", "4"))
 
-# ---------- МОДЕРАЦИЯ СТАТЕЙ ----------
 
-ArticleModerationDecision = Literal["approved", "rejected"]
+async def stream_chat_start(history: List[ChatMessage], deadline: float) -> AsyncIterator[str]:
+    """
+    Первое сообщение нового чата: название и ответ запрашиваются одновременно.
+    Первое событие — "title" ({"title": ...}), дальше те же события, что у
+    /chat/stream. Дельты ответа, пришедшие раньше названия, копятся в очереди
+    и отдаются сразу после него. Ошибка названия ответ не прерывает — клиент
+    получает запасное название.
+    """
+    text = next((m.content for m in history if m.role == "user"), history[0].content)
+    title_task = asyncio.ensure_future(resolve_title(text))
 
+    events: asyncio.Queue = asyncio.Queue()
 
-class ArticleModerationIn(BaseModel):
-    title: str = Field(min_length=3)
-    category: str = Field(min_length=2)
-    annotation: str = Field(min_length=10)
-    content_text: str = Field(min_length=50)
+    async def pump_answer() -> None:
+        try:
+            async for event in stream_groq_structured(history, deadline, endpoint="chat_start"):
+                events.put_nowait(event)
+        finally:
+            events.put_nowait(None)
 
+    answer_task = asyncio.ensure_future(pump_answer())
+    try:
+        try:
+            title = await asyncio.wait_for(
+                asyncio.shield(title_task),
+                timeout=min(CHAT_START_TITLE_MAX_WAIT_SECONDS, max(deadline - time.time(), 0)),
+            )
+        except asyncio.TimeoutError:
+            print("Title not ready in time: chat_start")
+            title = fallback_title(text, extract_local_title(text)[0])
+        except Exception as e:
+            # HTTPException из resolve_title (502 и т.п.) — уже залогирована.
+            if not isinstance(e, HTTPException):
+                print("Title error:", repr(e))
+            title = fallback_title(text, extract_local_title(text)[0])
+        yield sse_event("title", title)
+
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # Исключение из генератора ответа (кроме отмены) поднимаем как есть.
+        answer_task.result()
+    finally:
+        for task in (title_task, answer_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Чтобы asyncio не ругался на необработанное исключение опоздавшего названия.
+                task.exception()
+
+
+@app.post("/chat/start")
+async def chat_start(
+    body: ChatIn,
+    deadline_header: Optional[str] = Header(default=None, alias="X-Request-Deadline"),
+):
+    require_backend(chat_backend)
+    deadline = request_deadline(deadline_header)
 
-class ArticleModerationResult(BaseModel):
-    decision: ArticleModerationDecision
-    confidence_score: int
-    reasons: List[str] = []
-    red_flags: List[str] = []
-    health_topic_match: bool
-    topic_relevance: bool
-    is_safe_content: bool
+    return StreamingResponse(
+        stream_chat_start(body.messages, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-ARTICLE_MODERATION_PROMPT = """
-Ты — строгая система премодерации статей для wellness-платформы.
+# ---------- МОДЕРАЦИЯ СТАТЕЙ ----------
 
-Твоя задача: решить, можно ли публиковать статью.
+@app.post("/article/moderate")
+def moderate_article(
+    body: ArticleModerationIn,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+):
+    content_key = moderation_cache_key(body)
+
+    if idempotency_key:
+        stored = moderation_idempotency_cache.get(idempotency_key)
+        if stored is not None:
+            if stored["content_key"] != content_key:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Idempotency-Key уже использован для другой статьи",
+                )
+            return stored["result"]
+
+    cached = moderation_cache.get(content_key)
+    if cached is not None:
+        if idempotency_key:
+            moderation_idempotency_cache.set(
+                idempotency_key, {"content_key": content_key, "result": cached}
+            )
+        return cached
 
-ПРАВИЛА МОДЕРАЦИИ:
-1) Статья должна быть по теме здоровья / wellness / ЗОЖ.
-2) Статья должна соответствовать заявленной категории и теме.
-3) Контент должен быть безопасным: без провокаций, оскорблений, разжигания ненависти,
-   призывов к насилию, саморазрушению, опасным практикам и другим вредным материалам.
-4) Не допускать псевдонаучные, заведомо вредные или опасные рекомендации.
-5) Если есть сомнения — отклоняй (decision = "rejected").
+    require_backend(moderation_backend)
 
-ВЕРНИ СТРОГО JSON и ничего больше.
-Формат:
-{
-  "decision": "approved | rejected",
-  "confidence_score": 0,
-  "reasons": ["..."],
-  "red_flags": ["..."],
-  "health_topic_match": true,
-  "topic_relevance": true,
-  "is_safe_content": true
-}
-""".strip()
+    result = moderation_flight.do(content_key, lambda: request_moderation(body, content_key))
 
+    if idempotency_key:
+        moderation_idempotency_cache.set(
+            idempotency_key, {"content_key": content_key, "result": result}
+        )
+    return result
 
-def harden_article_decision(data: ArticleModerationResult) -> ArticleModerationResult:
-    is_confident = data.confidence_score >= 80
-    is_clean = len(data.red_flags) == 0
-    must_approve = (
-        data.health_topic_match
-        and data.topic_relevance
-        and data.is_safe_content
-        and is_confident
-        and is_clean
-    )
-    data.decision = "approved" if must_approve else "rejected"
-    return data
 
+# ---------- ПАКЕТНАЯ МОДЕРАЦИЯ ----------
 
-@app.post("/article/moderate")
-def moderate_article(body: ArticleModerationIn):
-    if not client:
-        raise HTTPException(status_code=500, detail="GROQ_API_KEY не задан")
-    user_text = (
-        f"{ARTICLE_MODERATION_PROMPT}\n\n"
-        f"НАЗВАНИЕ:\n{body.title.strip()}\n\n"
-        f"КАТЕГОРИЯ:\n{body.category.strip()}\n\n"
-        f"АННОТАЦИЯ:\n{body.annotation.strip()}\n\n"
-        f"ТЕКСТ СТАТЬИ:\n{body.content_text.strip()[:20000]}"
-    )
+CHAT_MODERATION_BATCH_MAX_ITEMS = int(os.environ.get("CHAT_MODERATION_BATCH_MAX_ITEMS", "200"))
 
-    try:
-        resp = client.chat.completions.create(
-            model=GROQ_MODERATION_MODEL,
-            messages=[{"role": "user", "content": user_text}],
-            temperature=0.1,
-        )
-    except Exception as e:
-        print("Groq moderation error:", repr(e))
-        raise HTTPException(status_code=502, detail=f"Ошибка Groq API: {str(e)}")
 
-    raw_text = (resp.choices[0].message.content or "").strip()
-    json_text = clean_json_text(raw_text)
+class ArticleModerationBatchItem(ArticleModerationIn):
+    # Идентификатор статьи вызывающей стороны, возвращается как есть.
+    id: Optional[str] = None
 
-    try:
-        parsed = json.loads(json_text)
-        result = ArticleModerationResult(**parsed)
-    except Exception as e:
-        raise HTTPException(
-            status_code=502,
-            detail=f"Модель вернула невалидный ответ модерации: {str(e)}",
-        )
 
-    hardened = harden_article_decision(result)
-    return hardened.model_dump()
+class ArticleModerationBatchIn(BaseModel):
+    items: List[ArticleModerationBatchItem] = Field(
+        min_length=1, max_length=CHAT_MODERATION_BATCH_MAX_ITEMS
+    )
+
+
+async def stream_batch_moderation(items: List[ArticleModerationBatchItem]) -> AsyncIterator[str]:
+    """
+    Модерирует статьи пакета параллельно (не больше CHAT_MODERATION_BATCH_CONCURRENCY
+    одновременно) и отдаёт результат каждой статьи отдельной NDJSON-строкой
+    по мере готовности, а не в порядке пакета.
+    """
+    semaphore = asyncio.Semaphore(max(CHAT_MODERATION_BATCH_CONCURRENCY, 1))
+
+    async def run_item(index: int, item: ArticleModerationBatchItem) -> dict:
+        base = {"index": index, "id": item.id}
+        async with semaphore:
+            try:
+                result = await moderate_article_async(item)
+            except HTTPException as e:
+                return {**base, "status": "error", "status_code": e.status_code, "detail": e.detail}
+            except Exception as e:
+                print("Batch moderation error:", repr(e))
+                return {**base, "status": "error", "status_code": 500, "detail": str(e)}
+        return {**base, "status": "ok", "status_code": 200, "result": result}
+
+    tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+    finally:
+        # Клиент отключился — не тратим лимиты на оставшиеся статьи.
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/article/moderate/batch")
+async def moderate_article_batch(body: ArticleModerationBatchIn):
+    require_backend(moderation_backend)
+
+    return StreamingResponse(
+        stream_batch_moderation(body.items),
+        media_type="application/x-ndjson",
+    )
 
 
 # ---------- ВЕРИФИКАЦИЯ ЭКСПЕРТА ----------
@@ -402,6 +1418,9 @@ ALLOWED_MIME_TYPES = {
 }
 
 VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Оценка токенов на изображение и на ответ для регулятора запросов.
+VISION_IMAGE_TOKENS = {"high": 1600, "low": 300}
+VISION_OUTPUT_TOKENS_ESTIMATE = 600
 
 
 VerificationDecision = Literal["approved", "rejected"]
@@ -494,78 +1513,47 @@ EXPERT_VERIFICATION_PROMPT = """
 """.strip()
 
 
-def sha256_of_bytes(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
-
-
-def save_uploaded_file(file_bytes: bytes, original_name: str) -> str:
-    ext = os.path.splitext(original_name or "")[1].lower()
-    safe_name = f"{uuid.uuid4()}{ext}"
-    save_path = os.path.join(UPLOAD_DIR, safe_name)
-    with open(save_path, "wb") as f:
-        f.write(file_bytes)
-    return save_path
-
-
-def file_to_data_url(file_bytes: bytes, mime_type: str) -> str:
-    encoded = base64.b64encode(file_bytes).decode("utf-8")
-    return f"data:{mime_type};base64,{encoded}"
+# Загрузки читаются кусками: хеш считается на лету, в памяти держится не
+# больше одного куска. Размер тела ограничивает UploadLimitMiddleware (upload_limit.py).
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 
-def pdf_to_png_data_urls(pdf_bytes: bytes, max_pages: int = 3) -> List[str]:
+async def save_uploaded_file(file: UploadFile) -> Tuple[str, str, int]:
     """
-    Рендерим первые страницы PDF в PNG и отправляем их как изображения в vision-модель.
-    Для диплома обычно хватает 1-2 страниц.
+    Сохраняет загрузку под именем <sha256><расширение>: одинаковые документы
+    хранятся в одном экземпляре. Возвращает (путь, sha256, размер).
     """
-    data_urls: List[str] = []
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-    pages_count = min(len(doc), max_pages)
-
-    for i in range(pages_count):
-        page = doc.load_page(i)
-
-        # Увеличиваем масштаб для лучшей читаемости текста
-        matrix = fitz.Matrix(2.0, 2.0)
-        pix = page.get_pixmap(matrix=matrix, alpha=False)
-
-        png_bytes = pix.tobytes("png")
-        data_urls.append(file_to_data_url(png_bytes, "image/png"))
-
-    return data_urls
+    # Тело запроса уже ограничено UploadLimitMiddleware; здесь — лимит на сам файл.
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise upload_too_large()
 
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+    size = 0
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    """
-    Пытаемся дополнительно вытащить текст из PDF.
-    Это не основная проверка, но помогает модели.
-    """
-    text_parts: List[str] = []
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    for page in doc:
-        txt = page.get_text("text")
-        if txt:
-            text_parts.append(txt)
-
-    text = "\n".join(text_parts).strip()
-    return text[:15000]  # не раздуваем запрос
-
-
-def clean_json_text(raw_text: str) -> str:
-    raw_text = raw_text.strip()
-
-    # Убираем ```json ... ```
-    raw_text = re.sub(r"^```json\s*", "", raw_text, flags=re.IGNORECASE)
-    raw_text = re.sub(r"^```\s*", "", raw_text)
-    raw_text = re.sub(r"\s*```$", "", raw_text)
-
-    # Если модель вернула лишний текст, пытаемся вытащить JSON-объект
-    start = raw_text.find("{")
-    end = raw_text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        raw_text = raw_text[start:end + 1]
-
-    return raw_text.strip()
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise upload_too_large()
+                digest.update(chunk)
+                await out.write(chunk)
+
+        if not size:
+            raise HTTPException(status_code=400, detail="Файл пустой")
+
+        file_hash = digest.hexdigest()
+        save_path = os.path.join(UPLOAD_DIR, f"{file_hash}{ext}")
+        if await anyio.Path(save_path).exists():
+            await anyio.Path(tmp_path).unlink()
+        else:
+            await anyio.Path(tmp_path).rename(save_path)
+        return save_path, file_hash, size
+    except BaseException:
+        await anyio.Path(tmp_path).unlink(missing_ok=True)
+        raise
 
 
 def extract_response_text(response) -> str:
@@ -585,6 +1573,10 @@ def extract_response_text(response) -> str:
     return "\n".join(chunks).strip()
 
 
+# Минимальная уверенность модели для одобрения эксперта.
+EXPERT_MIN_CONFIDENCE = 90
+
+
 def harden_decision(data: DiplomaAnalysis) -> DiplomaAnalysis:
     """
     Дополнительная серверная страховка.
@@ -596,7 +1588,7 @@ def harden_decision(data: DiplomaAnalysis) -> DiplomaAnalysis:
         bool(data.full_name),
         bool(data.institution),
         bool(data.specialization or data.qualification),
-        data.confidence_score >= 90,
+        data.confidence_score >= EXPERT_MIN_CONFIDENCE,
         len(data.red_flags) == 0,
     ])
 
@@ -627,6 +1619,7 @@ def build_verification_input(
     expected_last_name: str,
     extracted_text: str,
     image_data_urls: List[str],
+    image_detail: str = "high",
 ):
     content = [
         {
@@ -650,7 +1643,7 @@ def build_verification_input(
         content.append(
             {
                 "type": "input_image",
-                "detail": "high",
+                "detail": image_detail,
                 "image_url": data_url,
             }
         )
@@ -663,12 +1656,13 @@ def build_verification_input(
     ]
 
 
-def call_vision_verification(
+async def call_vision_verification(
     education_description: str,
     expected_first_name: str,
     expected_last_name: str,
     extracted_text: str,
     image_data_urls: List[str],
+    image_detail: str = "high",
 ) -> DiplomaAnalysis:
     if not vision_client:
         raise HTTPException(status_code=500, detail="GROQ_API_KEY не задан")
@@ -678,12 +1672,27 @@ def call_vision_verification(
         expected_last_name=expected_last_name,
         extracted_text=extracted_text,
         image_data_urls=image_data_urls,
+        image_detail=image_detail,
     )
 
-    response = vision_client.responses.create(
-        model=VISION_MODEL,
-        input=input_payload,
-    )
+    text_tokens = estimate_tokens(EXPERT_VERIFICATION_PROMPT) + estimate_tokens(extracted_text)
+    image_tokens = VISION_IMAGE_TOKENS[image_detail] * len(image_data_urls)
+    try:
+        response = await groq_governor.acall(
+            "verification",
+            VISION_MODEL,
+            text_tokens + image_tokens + VISION_OUTPUT_TOKENS_ESTIMATE,
+            lambda: vision_client.responses.create(
+                model=VISION_MODEL,
+                input=input_payload,
+                timeout=request_timeout(GROQ_TIMEOUTS["vision"]),
+            ),
+        )
+    except Exception as e:
+        overload = groq_overload_error(e)
+        if overload:
+            raise overload
+        raise
 
     raw_text = extract_response_text(response)
     if not raw_text:
@@ -721,52 +1730,203 @@ def call_vision_verification(
     return analysis
 
 
-@app.post("/expert/verify")
-async def verify_expert(
-    education_description: str = Form(...),
-    first_name: str = Form(...),
-    last_name: str = Form(...),
-    file: UploadFile = File(...),
-):
-    education_description = education_description.strip()
-    first_name = first_name.strip()
-    last_name = last_name.strip()
+# Результаты проверки хранятся по хешу документа: повторная загрузка того же
+# диплома с теми же данными профиля отвечает сразу, без рендера и vision-запроса.
+EXPERT_VERIFICATION_VERSION = make_cache_key(
+    EXPERT_VERIFICATION_PROMPT, VISION_MODEL, EXPERT_MIN_CONFIDENCE
+)[:12]
+
+CHAT_VERIFICATION_STORE_BACKEND = os.environ.get("CHAT_VERIFICATION_STORE_BACKEND", "sqlite")
+CHAT_VERIFICATION_STORE_TTL_SECONDS = int(os.environ.get("CHAT_VERIFICATION_STORE_TTL_SECONDS", "7776000"))
+CHAT_VERIFICATION_STORE_MAX_ENTRIES = int(os.environ.get("CHAT_VERIFICATION_STORE_MAX_ENTRIES", "20000"))
+# Токен администратора для принудительной перепроверки (force_reverify).
+CHAT_ADMIN_TOKEN = (os.environ.get("CHAT_ADMIN_TOKEN") or "").strip()
+
+verification_store = build_cache(
+    "expert_verification",
+    backend=CHAT_VERIFICATION_STORE_BACKEND,
+    ttl_seconds=CHAT_VERIFICATION_STORE_TTL_SECONDS,
+    max_entries=CHAT_VERIFICATION_STORE_MAX_ENTRIES,
+    sqlite_path=CHAT_CACHE_SQLITE_PATH,
+)
 
-    if not education_description:
-        raise HTTPException(status_code=400, detail="Нужно указать образование")
-    if not first_name or not last_name:
-        raise HTTPException(status_code=400, detail="Нужно передать имя и фамилию профиля")
 
-    if file.content_type not in ALLOWED_MIME_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail="Поддерживаются только PDF, JPG и PNG",
-        )
+def verification_store_key(
+    file_hash: str,
+    first_name: str,
+    last_name: str,
+    education_description: str,
+) -> str:
+    education_hash = hashlib.sha256(
+        normalize_cache_text(education_description).encode("utf-8")
+    ).hexdigest()
+    return make_cache_key(
+        "expert_verification",
+        EXPERT_VERIFICATION_VERSION,
+        file_hash,
+        normalize_person_name(first_name),
+        normalize_person_name(last_name),
+        education_hash,
+    )
 
-    file_bytes = await file.read()
-    if not file_bytes:
-        raise HTTPException(status_code=400, detail="Файл пустой")
 
-    # Ограничение на слишком большие файлы
-    max_size_mb = 10
-    if len(file_bytes) > max_size_mb * 1024 * 1024:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Файл слишком большой. Максимум {max_size_mb} МБ",
-        )
+def verification_response(
+    analysis: DiplomaAnalysis,
+    file_hash: str,
+    save_path: str,
+    cached: bool,
+) -> dict:
+    return {
+        "status": analysis.decision,
+        "verified": analysis.decision == "approved",
+        "message": (
+            "Эксперт верифицирован"
+            if analysis.decision == "approved"
+            else "Не удалось подтвердить экспертность"
+        ),
+        "confidence_score": analysis.confidence_score,
+        "document_type": analysis.document_type,
+        "matches_selected_education": analysis.matches_selected_education,
+        "full_name": analysis.full_name,
+        "institution": analysis.institution,
+        "qualification": analysis.qualification,
+        "specialization": analysis.specialization,
+        "graduation_year": analysis.graduation_year,
+        "document_number": analysis.document_number,
+        "red_flags": analysis.red_flags,
+        "reasons": analysis.reasons,
+        "file_hash": file_hash,
+        "saved_path": save_path,
+        "cached": cached,
+    }
+
+
+# Статистика путей подготовки документа: сколько запросов прошло по текстовому
+# слою и сколько байт изображений удалось не отправлять в модель.
+verification_path_stats = {
+    "vision": {"requests": 0, "payload_bytes": 0, "pages": 0, "vision_seconds": 0.0},
+    "text_layer": {"requests": 0, "payload_bytes": 0, "pages": 0, "bytes_saved": 0, "vision_seconds": 0.0},
+    "image": {
+        "requests": 0,
+        "payload_bytes": 0,
+        "pages": 0,
+        "source_bytes": 0,
+        "bytes_saved": 0,
+        "vision_seconds": 0.0,
+    },
+}
 
-    save_path = save_uploaded_file(file_bytes, file.filename or "document")
-    file_hash = sha256_of_bytes(file_bytes)
 
+def record_verification_path(
+    path: str,
+    payload_bytes: int,
+    pages: int,
+    full_path_pages: int,
+    source_bytes: int = 0,
+) -> Optional[int]:
+    """
+    Учитывает запрос и возвращает оценку сэкономленных байт.
+    image: исходный файл - нормализованное изображение;
+    text_layer: средний размер страницы на полном пути * число страниц полного пути - отправлено.
+    """
+    stats = verification_path_stats[path]
+    stats["requests"] += 1
+    stats["payload_bytes"] += payload_bytes
+    stats["pages"] += pages
+
+    if path == "image":
+        saved = max(source_bytes - payload_bytes, 0)
+        stats["source_bytes"] += source_bytes
+        stats["bytes_saved"] += saved
+        return saved
+    if path != "text_layer":
+        return None
+    vision = verification_path_stats["vision"]
+    if not vision["pages"]:
+        return None
+    saved = max(int(vision["payload_bytes"] / vision["pages"] * full_path_pages) - payload_bytes, 0)
+    stats["bytes_saved"] += saved
+    return saved
+
+
+def record_vision_latency(path: str, seconds: float) -> None:
+    verification_path_stats[path]["vision_seconds"] = round(
+        verification_path_stats[path]["vision_seconds"] + seconds, 3
+    )
+
+
+async def run_verification(
+    content_type: str,
+    file_hash: str,
+    save_path: str,
+    first_name: str,
+    last_name: str,
+    education_description: str,
+) -> dict:
+    # Один и тот же документ с теми же данными профиля, отправленный дважды
+    # одновременно (двойной клик, повтор задачи), проверяется одним вызовом.
+    store_key = verification_store_key(file_hash, first_name, last_name, education_description)
+    return await verification_flight.ado(
+        store_key,
+        lambda: process_verification(
+            content_type=content_type,
+            file_hash=file_hash,
+            save_path=save_path,
+            first_name=first_name,
+            last_name=last_name,
+            education_description=education_description,
+        ),
+    )
+
+
+async def process_verification(
+    content_type: str,
+    file_hash: str,
+    save_path: str,
+    first_name: str,
+    last_name: str,
+    education_description: str,
+) -> dict:
+    """
+    Подготовка документа, vision-запрос и запись результата в хранилище.
+    Общая часть синхронного /expert/verify и фоновых задач очереди.
+    """
+    store_key = verification_store_key(file_hash, first_name, last_name, education_description)
     extracted_text = ""
     image_data_urls: List[str] = []
+    image_detail = "high"
 
     try:
-        if file.content_type == "application/pdf":
-            extracted_text = extract_text_from_pdf(file_bytes)
-            image_data_urls = pdf_to_png_data_urls(file_bytes, max_pages=3)
+        if content_type == "application/pdf":
+            # Один проход по PDF в пуле процессов: текстовый слой + рендер страниц.
+            expected = {
+                "first_name": first_name,
+                "last_name": last_name,
+                "education_description": education_description,
+            }
+            # В пул передаётся путь, а не содержимое: файл читает сам воркер.
+            processed = await run_document_job(process_pdf, save_path, 3, DOC_TARGET_PAGE_BYTES, expected)
         else:
-            image_data_urls = [file_to_data_url(file_bytes, file.content_type)]
+            # Фото: поворот по EXIF, уменьшение и перекодирование — тоже в пуле.
+            processed = await run_document_job(process_image, save_path)
+
+        extracted_text = processed.text
+        image_data_urls = processed.image_data_urls
+        image_detail = processed.image_detail
+        verification_path = processed.path
+        payload_bytes = processed.payload_bytes
+
+        bytes_saved = record_verification_path(
+            verification_path,
+            payload_bytes,
+            len(image_data_urls),
+            processed.full_path_pages,
+            processed.source_bytes,
+        )
+        print(
+            f"Expert verification path={verification_path} detail={image_detail} "
+            f"pages={len(image_data_urls)} payload_bytes={payload_bytes} bytes_saved={bytes_saved}"
+        )
 
         if not image_data_urls:
             raise HTTPException(
@@ -774,39 +1934,30 @@ async def verify_expert(
                 detail="Не удалось подготовить документ для проверки",
             )
 
-        analysis = call_vision_verification(
+        vision_started = time.perf_counter()
+        analysis = await call_vision_verification(
             education_description=education_description,
             expected_first_name=first_name,
             expected_last_name=last_name,
             extracted_text=extracted_text,
             image_data_urls=image_data_urls,
+            image_detail=image_detail,
         )
+        vision_seconds = time.perf_counter() - vision_started
+        record_vision_latency(verification_path, vision_seconds)
 
-        return {
-            "status": analysis.decision,
-            "verified": analysis.decision == "approved",
-            "message": (
-                "Эксперт верифицирован"
-                if analysis.decision == "approved"
-                else "Не удалось подтвердить экспертность"
-            ),
-            "confidence_score": analysis.confidence_score,
-            "document_type": analysis.document_type,
-            "matches_selected_education": analysis.matches_selected_education,
-            "full_name": analysis.full_name,
-            "institution": analysis.institution,
-            "qualification": analysis.qualification,
-            "specialization": analysis.specialization,
-            "graduation_year": analysis.graduation_year,
-            "document_number": analysis.document_number,
-            "red_flags": analysis.red_flags,
-            "reasons": analysis.reasons,
-            "file_hash": file_hash,
-            "saved_path": save_path,
-        }
+        verification_store.set(store_key, analysis.model_dump())
+        response = verification_response(analysis, file_hash, save_path, cached=False)
+        response["verification_path"] = verification_path
+        response["payload_bytes"] = payload_bytes
+        response["payload_bytes_saved"] = bytes_saved
+        response["vision_latency_ms"] = round(vision_seconds * 1000)
+        return response
 
     except HTTPException:
         raise
+    except DocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -814,6 +1965,157 @@ async def verify_expert(
         )
 
 
+# ---------- ОЧЕРЕДЬ ВЕРИФИКАЦИИ ----------
+
+# Асинхронный режим (async_mode=true): /expert/verify сразу отвечает 202 с job_id,
+# результат забирается через GET /expert/verify/{job_id} или приходит на вебхук.
+CHAT_VERIFY_WORKERS = int(os.environ.get("CHAT_VERIFY_WORKERS", "2"))
+CHAT_VERIFY_MAX_QUEUED = int(os.environ.get("CHAT_VERIFY_MAX_QUEUED", "100"))
+CHAT_VERIFY_JOBS_SQLITE_PATH = os.environ.get("CHAT_VERIFY_JOBS_SQLITE_PATH", "cache/verification_jobs.sqlite3")
+# Адрес берётся только из окружения (например, Node-бэкенд), не из запроса.
+CHAT_VERIFY_WEBHOOK_URL = (os.environ.get("CHAT_VERIFY_WEBHOOK_URL") or "").strip()
+# Аренда задачи воркером; продлевается каждую треть срока, пока задача в работе.
+CHAT_VERIFY_LEASE_SECONDS = int(os.environ.get("CHAT_VERIFY_LEASE_SECONDS", "600"))
+# Завершённые задачи хранят ФИО и результат проверки — держим неделю.
+CHAT_VERIFY_JOBS_RETENTION_SECONDS = int(os.environ.get("CHAT_VERIFY_JOBS_RETENTION_SECONDS", str(7 * 86400)))
+
+verification_jobs = VerificationJobQueue(
+    path=CHAT_VERIFY_JOBS_SQLITE_PATH,
+    workers=CHAT_VERIFY_WORKERS,
+    max_queued=CHAT_VERIFY_MAX_QUEUED,
+    webhook_url=CHAT_VERIFY_WEBHOOK_URL,
+    lease_seconds=CHAT_VERIFY_LEASE_SECONDS,
+    retention_seconds=CHAT_VERIFY_JOBS_RETENTION_SECONDS,
+)
+
+
+async def run_verification_job(params: dict) -> dict:
+    return await run_verification(**params)
+
+
+@app.post("/expert/verify")
+async def verify_expert(
+    request: Request,
+    education_description: str = Form(...),
+    first_name: str = Form(...),
+    last_name: str = Form(...),
+    file: UploadFile = File(...),
+    force_reverify: bool = Form(False),
+    async_mode: bool = Form(False),
+    admin_token: Optional[str] = Header(default=None, alias="X-Admin-Token"),
+    deadline_header: Optional[str] = Header(default=None, alias="X-Request-Deadline"),
+):
+    deadline = request_deadline(deadline_header)
+    education_description = education_description.strip()
+    first_name = first_name.strip()
+    last_name = last_name.strip()
+
+    if not education_description:
+        raise HTTPException(status_code=400, detail="Нужно указать образование")
+    if not first_name or not last_name:
+        raise HTTPException(status_code=400, detail="Нужно передать имя и фамилию профиля")
+
+    if file.content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Поддерживаются только PDF, JPG и PNG",
+        )
+
+    if force_reverify and (not CHAT_ADMIN_TOKEN or admin_token != CHAT_ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=403,
+            detail="Принудительная перепроверка доступна только администратору",
+        )
+
+    save_path, file_hash, _ = await save_uploaded_file(file)
+
+    store_key = verification_store_key(file_hash, first_name, last_name, education_description)
+    if not force_reverify:
+        stored = verification_store.get(store_key)
+        if stored is not None:
+            return verification_response(DiplomaAnalysis(**stored), file_hash, save_path, cached=True)
+
+    if async_mode:
+        # Файл уже сохранён на диск — в задачу кладём только путь и данные профиля.
+        try:
+            job_id = verification_jobs.submit(
+                {
+                    "save_path": save_path,
+                    "content_type": file.content_type,
+                    "file_hash": file_hash,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "education_description": education_description,
+                }
+            )
+        except QueueFullError:
+            raise HTTPException(
+                status_code=503,
+                detail="Очередь верификации переполнена, попробуйте позже",
+            )
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/expert/verify/{job_id}",
+            },
+        )
+
+    return await run_until_disconnect(
+        request,
+        "expert_verify",
+        deadline,
+        run_verification(
+            content_type=file.content_type,
+            file_hash=file_hash,
+            save_path=save_path,
+            first_name=first_name,
+            last_name=last_name,
+            education_description=education_description,
+        ),
+    )
+
+
+@app.get("/expert/verify/{job_id}")
+def verify_expert_job(job_id: str):
+    job = verification_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача верификации не найдена")
+    return job
+
+
+# ---------- СЛУЖЕБНОЕ ----------
+
+
+@app.get("/stats")
+def service_stats():
+    return {
+        "caches": cache_stats(),
+        "single_flight": single_flight_stats(),
+        "cancellations": {endpoint: dict(counts) for endpoint, counts in cancellation_stats.items()},
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "title_sources": dict(title_source_counts),
+        "rate_governor": groq_governor.stats(),
+        "llm_backends": llm_backends_snapshot(),
+        "http": connection_stats.snapshot(),
+        "model_latency": model_latency_stats(),
+        "history_compaction": history_compaction_snapshot(),
+        "chat_sessions": {**chat_sessions.stats(), **dict(chat_session_stats)},
+        "retrieval": {**dict(retrieval_stats), "index": article_index_updater.stats()},
+        "verification_paths": verification_path_stats,
+        "verification_jobs": verification_jobs.stats(),
+    }
+
+
+register_stats_collector(service_stats)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8000"))
     host = os.environ.get("HOST", "0.0.0.0")
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+# Серверное состояние диалога для /chat/session: клиент присылает только id
+# чата и новую реплику. В памяти воркера — свёрнутая история (краткое
+# содержание + окно свежих реплик), источник истины — таблицы Chat/ChatMessage.
+# Перед каждым ходом число сообщений чата сверяется с базой: если ход обработал
+# другой воркер или сообщения дописал Node-бэкенд, история перечитывается.
+# Чат доступен только владельцу (Chat.userId): все запросы фильтруются по нему,
+# а сессия в памяти помнит, чья она.
+# connection — фабрика контекстных менеджеров соединения (ConnectionPool.connection).
+
+
+class ChatSession:
+    __slots__ = ("chat_id", "user_id", "summary", "recent", "stored_count", "touched")
+
+    def __init__(
+        self,
+        chat_id: str,
+        user_id: Optional[int] = None,
+        summary: Optional[str] = None,
+        recent: Optional[list] = None,
+        stored_count: int = 0,
+    ):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        # Краткое содержание всего, что не вошло в recent.
+        self.summary = summary
+        self.recent = recent or []
+        # Сколько сообщений из базы учтено в summary + recent.
+        self.stored_count = stored_count
+        self.touched = time.monotonic()
+
+
+class SessionStore:
+    """LRU с ограничением по числу сессий и времени простоя."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        # Один ход чата за раз: второй запрос того же чата ждёт первый.
+        self._turn_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.evictions = 0
+
+    def get(self, chat_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.touched > self.ttl_seconds:
+                del self._sessions[chat_id]
+                self.evictions += 1
+                return None
+            self._sessions.move_to_end(chat_id)
+            return session
+
+    def put(self, session: ChatSession) -> None:
+        with self._lock:
+            session.touched = time.monotonic()
+            self._sessions[session.chat_id] = session
+            self._sessions.move_to_end(session.chat_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def turn_lock(self, chat_id: str) -> asyncio.Lock:
+        lock = self._turn_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._turn_locks[chat_id] = lock
+        return lock
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+            }
+
+
+# ---------- ChatMessage ----------
+
+
+def load_chat_messages(connection: Callable, chat_id: str, user_id: int) -> Optional[List[Tuple[str, str]]]:
+    """(роль, текст) всех сообщений чата по порядку; None — чата нет или он чужой."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT 1 FROM "Chat" WHERE "id" = %s AND "userId" = %s""", (chat_id, user_id))
+            if cur.fetchone() is None:
+                return None
+            cur.execute(
+                """SELECT role, text FROM "ChatMessage" WHERE "chatId" = %s ORDER BY "createdAt", id""",
+                (chat_id,),
+            )
+            return [(role, text) for role, text in cur.fetchall()]
+
+
+def count_chat_messages(connection: Callable, chat_id: str, user_id: int) -> int:
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT COUNT(*) FROM "ChatMessage" m JOIN "Chat" c ON c."id" = m."chatId"
+                WHERE c."id" = %s AND c."userId" = %s""",
+                (chat_id, user_id),
+            )
+            return cur.fetchone()[0]
+
+
+def append_chat_messages(connection: Callable, chat_id: str, user_id: int, messages: List[Tuple[str, str]]) -> bool:
+    """False — чата нет или он чужой, ничего не записано."""
+    # id и updatedAt Prisma проставляет на клиенте, поэтому задаём их сами.
+    # createdAt с шагом в миллисекунду — чтобы порядок реплики и ответа сохранился:
+    # колонка TIMESTAMP(3), меньший шаг округлится, и Node-контроллер, сортирующий
+    # только по createdAt, мог бы показать ответ раньше вопроса.
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE "Chat" SET "updatedAt" = now() WHERE "id" = %s AND "userId" = %s""",
+                (chat_id, user_id),
+            )
+            if cur.rowcount == 0:
+                conn.rollback()
+                return False
+            for i, (role, text) in enumerate(messages):
+                cur.execute(
+                    """INSERT INTO "ChatMessage" (id, "chatId", role, text, "createdAt")
+                    VALUES (%s, %s, %s, %s, now() + %s * interval '1 millisecond')""",
+                    (str(uuid.uuid4()), chat_id, role, text, i),
+                )
+        conn.commit()
+        return True
@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import List, Optional, Union
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from ru_text import content_stems, normalize_text
+
+# Подготовка документов для vision-модели. Тяжёлая работа (разбор PDF, рендер,
+# кодирование) выполняется в пуле процессов, чтобы не блокировать event loop.
+
+# 0 — без пула процессов, в отдельном потоке (удобно для отладки)
+DOC_PROCESS_WORKERS = int(os.environ.get("CHAT_DOC_PROCESS_WORKERS", "2"))
+# Целевой размер одной страницы после кодирования
+DOC_TARGET_PAGE_BYTES = int(os.environ.get("CHAT_DOC_TARGET_PAGE_BYTES", str(600 * 1024)))
+DOC_MAX_TEXT_CHARS = 15000
+
+# Быстрый путь по текстовому слою: если в тексте PDF нашлись ФИО и данные
+# об образовании, модели хватает одной уменьшенной страницы с detail="low".
+TEXT_LAYER_FAST_PATH = os.environ.get("CHAT_TEXT_LAYER_FAST_PATH", "true").strip().lower() in ("1", "true", "yes")
+TEXT_LAYER_MIN_SCORE = float(os.environ.get("CHAT_TEXT_LAYER_MIN_SCORE", "0.8"))
+TEXT_LAYER_MIN_CHARS = 200
+TEXT_LAYER_PAGE_BYTES = int(os.environ.get("CHAT_TEXT_LAYER_PAGE_BYTES", str(150 * 1024)))
+TEXT_LAYER_ZOOMS = (1.0, 0.8)
+
+INSTITUTION_STEMS = ("университ", "институт", "академ", "колледж", "училищ", "школ")
+
+# Фото и сканы JPG/PNG: длинная сторона после уменьшения (текст диплома
+# остаётся читаемым) и качество JPEG при перекодировании.
+IMAGE_MAX_LONG_EDGE = int(os.environ.get("CHAT_IMAGE_MAX_LONG_EDGE", "2000"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("CHAT_IMAGE_JPEG_QUALITY", "85"))
+
+# Варианты рендера от лучшего к самому компактному.
+RENDER_ZOOMS = (2.0, 1.6, 1.3, 1.0)
+JPEG_QUALITIES = (85, 70, 55)
+
+
+class DocumentError(ValueError):
+    pass
+
+
+@dataclass
+class ProcessedDocument:
+    text: str = ""
+    image_data_urls: List[str] = field(default_factory=list)
+    payload_bytes: int = 0
+    # Параметры рендера каждой страницы: zoom, format, quality, bytes
+    renders: List[dict] = field(default_factory=list)
+    # "vision" — полный рендер, "text_layer" — одна страница по сильному тексту
+    path: str = "vision"
+    image_detail: str = "high"
+    # Сколько страниц ушло бы в модель по полному пути
+    full_path_pages: int = 0
+    text_layer: Optional[dict] = None
+    # Размер исходного файла (для изображений — до нормализации)
+    source_bytes: int = 0
+
+
+def score_text_layer(
+    text: str,
+    first_name: str,
+    last_name: str,
+    education_description: str,
+) -> dict:
+    """
+    Оценивает, насколько текстовый слой PDF подтверждает данные пользователя:
+    ФИО (вес 0.5), учебное заведение (0.2) и совпадение слов из описания
+    образования — специальности/квалификации (0.3).
+    """
+    normalized = normalize_text(text)
+    text_stems = set(content_stems(text))
+
+    name_match = bool(
+        first_name
+        and last_name
+        and normalize_text(first_name).strip() in normalized
+        and normalize_text(last_name).strip() in normalized
+    )
+    institution_match = any(stem.startswith(INSTITUTION_STEMS) for stem in text_stems)
+
+    expected = set(content_stems(education_description))
+    coverage = len(expected & text_stems) / len(expected) if expected else 0.0
+
+    score = 0.5 * name_match + 0.2 * institution_match + 0.3 * coverage
+    return {
+        "score": round(score, 3),
+        "name_match": name_match,
+        "institution_match": institution_match,
+        "education_coverage": round(coverage, 3),
+        "text_chars": len(text),
+    }
+
+
+def file_to_data_url(file_bytes: bytes, mime_type: str) -> str:
+    encoded = base64.b64encode(file_bytes).decode("utf-8")
+    return f"data:{mime_type};base64,{encoded}"
+
+
+def encode_page(page, target_bytes: int, zooms=RENDER_ZOOMS):
+    """
+    Подбирает масштаб и формат так, чтобы страница уложилась в target_bytes.
+    Для векторных/текстовых страниц пробуем PNG (чёткий текст); сканы и фото
+    PNG почти не сжимает, поэтому для страниц с растром сразу берём JPEG со
+    снижающимся качеством, затем меньший масштаб.
+    Возвращает (bytes, mime, описание рендера).
+    """
+    try_png = not page.get_images(full=False)
+    smallest = None
+    for zoom in zooms:
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+
+        if try_png:
+            png_bytes = pix.tobytes("png")
+            if len(png_bytes) <= target_bytes:
+                return png_bytes, "image/png", {"zoom": zoom, "format": "png", "quality": None}
+
+        for quality in JPEG_QUALITIES:
+            jpg_bytes = pix.tobytes("jpg", jpg_quality=quality)
+            info = {"zoom": zoom, "format": "jpeg", "quality": quality}
+            if len(jpg_bytes) <= target_bytes:
+                return jpg_bytes, "image/jpeg", info
+            if smallest is None or len(jpg_bytes) < len(smallest[0]):
+                smallest = (jpg_bytes, "image/jpeg", info)
+
+    # Не уложились даже в самом компактном варианте — отдаём наименьший.
+    return smallest
+
+
+def process_pdf(
+    source: Union[bytes, str],
+    max_pages: int = 3,
+    target_page_bytes: int = DOC_TARGET_PAGE_BYTES,
+    expected: Optional[dict] = None,
+) -> ProcessedDocument:
+    """
+    Открывает PDF один раз: извлекает текстовый слой всех страниц
+    и рендерит первые страницы для vision-модели.
+    source — содержимое PDF или путь к сохранённому файлу (так в пул процессов
+    не приходится передавать байты документа).
+    expected — {"first_name", "last_name", "education_description"}: если текстовый
+    слой их уверенно подтверждает, рендерится только первая страница в низком разрешении.
+    """
+    result = ProcessedDocument()
+
+    if isinstance(source, str):
+        doc = fitz.open(source, filetype="pdf")
+    else:
+        doc = fitz.open(stream=source, filetype="pdf")
+    try:
+        text_parts = [txt for txt in (page.get_text("text") for page in doc) if txt]
+        result.text = "\n".join(text_parts).strip()[:DOC_MAX_TEXT_CHARS]  # не раздуваем запрос
+        result.full_path_pages = min(len(doc), max_pages)
+
+        pages_to_render = result.full_path_pages
+        zooms = RENDER_ZOOMS
+        if TEXT_LAYER_FAST_PATH and expected and len(result.text) >= TEXT_LAYER_MIN_CHARS:
+            result.text_layer = score_text_layer(result.text, **expected)
+            if result.text_layer["score"] >= TEXT_LAYER_MIN_SCORE:
+                result.path = "text_layer"
+                result.image_detail = "low"
+                pages_to_render = min(pages_to_render, 1)
+                target_page_bytes = min(target_page_bytes, TEXT_LAYER_PAGE_BYTES)
+                zooms = TEXT_LAYER_ZOOMS
+
+        for index in range(pages_to_render):
+            image_bytes, mime, info = encode_page(doc.load_page(index), target_page_bytes, zooms)
+            result.image_data_urls.append(file_to_data_url(image_bytes, mime))
+            result.payload_bytes += len(image_bytes)
+            result.renders.append({**info, "bytes": len(image_bytes)})
+    finally:
+        doc.close()
+
+    return result
+
+
+def process_image(source: Union[bytes, str], max_long_edge: int = IMAGE_MAX_LONG_EDGE) -> ProcessedDocument:
+    """
+    Нормализует фото документа: поворот по EXIF, уменьшение до max_long_edge
+    по длинной стороне и перекодирование в JPEG без метаданных.
+    """
+    result = ProcessedDocument(path="image", full_path_pages=1)
+    try:
+        image = Image.open(source if isinstance(source, str) else BytesIO(source))
+        # Для JPEG декодер сразу уменьшает картинку в 2/4/8 раз — без лишней работы.
+        image.draft("RGB", (max_long_edge, max_long_edge))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError) as e:
+        raise DocumentError("Не удалось прочитать изображение") from e
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # Прозрачный фон заливаем белым, а не чёрным.
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image.thumbnail((max_long_edge, max_long_edge), Image.Resampling.LANCZOS)
+
+    out = BytesIO()
+    # exif не передаём — метаданные (геолокация, модель телефона) не сохраняются.
+    image.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    image_bytes = out.getvalue()
+
+    result.source_bytes = os.path.getsize(source) if isinstance(source, str) else len(source)
+    result.image_data_urls.append(file_to_data_url(image_bytes, "image/jpeg"))
+    result.payload_bytes = len(image_bytes)
+    result.renders.append(
+        {
+            "width": image.width,
+            "height": image.height,
+            "format": "jpeg",
+            "quality": IMAGE_JPEG_QUALITY,
+            "bytes": len(image_bytes),
+        }
+    )
+    return result
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_document_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if DOC_PROCESS_WORKERS <= 0:
+        return None
+    if _pool is None:
+        # spawn: воркеры не наследуют потоки и состояние uvicorn-процесса.
+        _pool = ProcessPoolExecutor(
+            max_workers=DOC_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def run_document_job(fn, *args):
+    pool = get_document_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, fn, *args)
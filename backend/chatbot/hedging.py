@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from percentiles import percentile
+from rate_governor import AttemptTiming, attempt_timing
+
+# Цепочка моделей с хеджированием: запрос уходит первой модели цепочки; если она
+# не ответила за порог (p95 её недавних ответов), параллельно запускается
+# следующая модель, и выигрывает тот, кто ответит первым — второй запрос
+# отменяется. При ошибке модели сразу пробуем следующую (fallback).
+# Задержки считаются отдельно по цепочке, модели и режиму: открытие стрима и
+# полный ответ — разные величины, а у названия чата свои промпты и лимиты.
+# И замер, и порог хеджа считаются от начала попытки вызова (AttemptTiming от
+# регулятора), без ожидания в очереди и пауз между повторами: иначе под 429
+# порог рос бы, а хеджи срабатывали бы, пока основной запрос ещё в очереди,
+# удваивая нагрузку на и так ограниченный аккаунт.
+
+T = TypeVar("T")
+
+# Как часто проверять, началась ли попытка основной модели: пока запрос ждёт
+# в очереди регулятора (или паузу перед повтором), хедж не запускается.
+HEDGE_POLL_SECONDS = 0.05
+
+# Границы корзин гистограммы задержек, секунды.
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+
+class ModelLatency:
+    def __init__(self):
+        self.samples: deque = deque(maxlen=500)
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.attempts = 0
+        self.hedges = 0
+        self.wins = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def observe_cancelled(self, seconds: float) -> None:
+        # Отменённый запрос шёл как минимум столько — учитываем это в пороге,
+        # иначе p95 считался бы только по быстрым ответам и хеджей становилось бы больше.
+        self.samples.append(seconds)
+        self.cancelled += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        return percentile(self.samples, q)
+
+    def snapshot(self) -> dict:
+        def rounded(value):
+            return round(value, 3) if value is not None else None
+
+        labels = [f"le_{bound:g}" for bound in LATENCY_BUCKETS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.total_seconds, 3),
+            "p50": rounded(self.quantile(0.5)),
+            "p95": rounded(self.quantile(0.95)),
+            "p99": rounded(self.quantile(0.99)),
+            "buckets": dict(zip(labels, self.bucket_counts)),
+            "attempts": self.attempts,
+            "hedges": self.hedges,
+            "wins": self.wins,
+            "win_rate": round(self.wins / self.attempts, 4) if self.attempts else None,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+        }
+
+
+# (цепочка, режим, модель) -> задержки; режим — "full" или "stream".
+model_latency: Dict[Tuple[str, str, str], ModelLatency] = defaultdict(ModelLatency)
+
+
+class HedgedChain:
+    def __init__(
+        self,
+        name: str,
+        models: List[str],
+        hedge: bool = True,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        default_delay: float = 8.0,
+        min_delay: float = 1.0,
+        max_delay: float = 30.0,
+    ):
+        self.name = name
+        # Порядок важен, дубли убираем (например, fallback совпал с основной моделью).
+        self.models = list(dict.fromkeys(m for m in models if m))
+        self.hedge = hedge
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def latency(self, model: str, mode: str) -> ModelLatency:
+        return model_latency[(self.name, mode, model)]
+
+    def hedge_delay(self, model: str, mode: str = "full") -> float:
+        stats = self.latency(model, mode)
+        if len(stats.samples) < self.min_samples:
+            return self.default_delay
+        return min(max(stats.quantile(self.quantile), self.min_delay), self.max_delay)
+
+    async def call(
+        self,
+        fn: Callable[[str], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[None]]] = None,
+        mode: str = "full",
+    ) -> Tuple[T, str]:
+        """
+        Возвращает (результат, модель-победитель). discard закрывает результат
+        проигравшего запроса, если тот успел завершиться (например, открытый стрим).
+        mode — "stream", если fn только открывает поток: задержки считаются отдельно.
+        fn должна идти через RateGovernor: хедж срабатывает по началу попытки,
+        которое отмечает регулятор.
+        """
+
+        async def timed(model: str, timing: AttemptTiming) -> T:
+            # Своя задача — свой контекст: регулятор отметит попытку именно этого вызова.
+            attempt_timing.set(timing)
+            started = time.monotonic()
+            result = await fn(model)
+            seconds = timing.seconds if timing.seconds is not None else time.monotonic() - started
+            self.latency(model, mode).observe(seconds)
+            return result
+
+        pending: Dict[asyncio.Task, str] = {}
+        timings: Dict[asyncio.Task, AttemptTiming] = {}
+        next_index = 0
+        last_error: Optional[BaseException] = None
+
+        def launch(hedged: bool) -> None:
+            nonlocal next_index
+            model = self.models[next_index]
+            next_index += 1
+            stats = self.latency(model, mode)
+            stats.attempts += 1
+            if hedged:
+                stats.hedges += 1
+                print(f"Hedged request ({self.name}): {model}")
+            timing = AttemptTiming()
+            task = asyncio.ensure_future(timed(model, timing))
+            pending[task] = model
+            timings[task] = timing
+
+        def hedge_deadline(task: asyncio.Task) -> Optional[float]:
+            # Порог отсчитывается от начала попытки у регулятора, а не от запуска задачи:
+            # под 429 запрос может долго стоять в очереди, и хедж тогда лишь удвоил бы
+            # нагрузку на аккаунт, который и так упёрся в лимит.
+            timing = timings[task]
+            if timing.started is None or timing.seconds is not None:
+                return None
+            return timing.started + self.hedge_delay(pending[task], mode)
+
+        launch(hedged=False)
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and next_index < len(self.models):
+                    deadline = hedge_deadline(list(pending)[-1])
+                    if deadline is None:
+                        timeout = HEDGE_POLL_SECONDS
+                    elif deadline <= time.monotonic():
+                        launch(hedged=True)
+                        continue
+                    else:
+                        timeout = deadline - time.monotonic()
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        self.latency(model, mode).wins += 1
+                        return task.result(), model
+                    last_error = task.exception()
+                    self.latency(model, mode).errors += 1
+                    print(f"Model error ({self.name}, {model}):", repr(last_error))
+
+                if not pending and next_index < len(self.models):
+                    launch(hedged=False)
+
+            raise last_error
+        finally:
+            for task, model in pending.items():
+                timing = timings[task]
+                # Отменённый ещё в очереди регулятора о модели ничего не говорит.
+                if timing.started is not None and timing.seconds is None:
+                    self.latency(model, mode).observe_cancelled(time.monotonic() - timing.started)
+                task.cancel()
+                if discard:
+                    task.add_done_callback(lambda t: _discard_result(t, discard))
+
+
+def _discard_result(task: asyncio.Task, discard) -> None:
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(discard(task.result()))
+
+
+def model_latency_stats() -> dict:
+    """{цепочка: {режим: {модель: снимок}}}."""
+    snapshot: Dict[str, Dict[str, dict]] = {}
+    for (chain, mode, model), stats in list(model_latency.items()):
+        snapshot.setdefault(chain, {}).setdefault(mode, {})[model] = stats.snapshot()
+    return snapshot
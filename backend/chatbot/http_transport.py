@@ -0,0 +1,153 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from collections import Counter
+from typing import List
+
+import httpx
+
+# Общий HTTP-стек для клиентов Groq/OpenAI: один пул соединений на процесс
+# вместо отдельного пула у каждого SDK-клиента, явные лимиты и таймауты,
+# HTTP/2 при наличии пакета h2 и прогрев соединений при старте сервиса.
+# Синхронные клиенты (Groq, OpenAI для vision) делят один httpx.Client —
+# оба ходят на api.groq.com, поэтому переиспользуют одни и те же соединения.
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("CHAT_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("CHAT_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("CHAT_HTTP_KEEPALIVE_EXPIRY", "120"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("CHAT_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_DEFAULT_TIMEOUT = float(os.environ.get("CHAT_HTTP_TIMEOUT", "60"))
+# auto — HTTP/2, если установлен h2; true/false — принудительно
+HTTP2_MODE = os.environ.get("CHAT_HTTP2", "auto").strip().lower()
+HTTP_WARMUP_CONNECTIONS = int(os.environ.get("CHAT_HTTP_WARMUP_CONNECTIONS", "2"))
+
+HTTP2_ENABLED = (
+    importlib.util.find_spec("h2") is not None
+    if HTTP2_MODE == "auto"
+    else HTTP2_MODE in ("1", "true", "yes")
+)
+
+
+def request_timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=HTTP_CONNECT_TIMEOUT)
+
+
+class ConnectionStats:
+    """
+    Считает запросы и новые соединения через trace-расширение httpcore:
+    доля переиспользования = 1 - новые соединения / запросы.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self.http_versions: Counter = Counter()
+
+    def _event(self, name: str) -> None:
+        if name == "connection.connect_tcp.complete":
+            key = "new_connections"
+        elif name == "connection.start_tls.complete":
+            key = "tls_handshakes"
+        else:
+            return
+        with self._lock:
+            self.counts[key] += 1
+
+    def trace(self, name: str, info: dict) -> None:
+        self._event(name)
+
+    async def atrace(self, name: str, info: dict) -> None:
+        self._event(name)
+
+    def on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self.trace
+        with self._lock:
+            self.counts["requests"] += 1
+
+    async def on_request_async(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self.atrace
+        with self._lock:
+            self.counts["requests"] += 1
+
+    def on_response(self, response: httpx.Response) -> None:
+        with self._lock:
+            self.http_versions[response.http_version] += 1
+
+    async def on_response_async(self, response: httpx.Response) -> None:
+        self.on_response(response)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            requests = self.counts["requests"]
+            new_connections = self.counts["new_connections"]
+            return {
+                "http2_enabled": HTTP2_ENABLED,
+                "requests": requests,
+                "new_connections": new_connections,
+                "tls_handshakes": self.counts["tls_handshakes"],
+                "reuse_rate": round(1 - new_connections / requests, 4) if requests else None,
+                "http_versions": dict(self.http_versions),
+            }
+
+
+connection_stats = ConnectionStats()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def build_http_client() -> httpx.Client:
+    return httpx.Client(
+        http2=HTTP2_ENABLED,
+        limits=_limits(),
+        timeout=request_timeout(HTTP_DEFAULT_TIMEOUT),
+        event_hooks={
+            "request": [connection_stats.on_request],
+            "response": [connection_stats.on_response],
+        },
+    )
+
+
+def build_async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        limits=_limits(),
+        timeout=request_timeout(HTTP_DEFAULT_TIMEOUT),
+        event_hooks={
+            "request": [connection_stats.on_request_async],
+            "response": [connection_stats.on_response_async],
+        },
+    )
+
+
+async def warm_up(
+    http_client: httpx.Client,
+    async_http_client: httpx.AsyncClient,
+    url: str,
+    headers: dict,
+    connections: int = HTTP_WARMUP_CONNECTIONS,
+) -> None:
+    """
+    Открывает соединения заранее (DNS, TCP, TLS), чтобы первый запрос
+    пользователя после деплоя не платил за рукопожатие. Ошибки не фатальны.
+    С HTTP/2 достаточно одного соединения — запросы мультиплексируются.
+    """
+    count = 1 if HTTP2_ENABLED else max(connections, 1)
+
+    def sync_get():
+        return http_client.get(url, headers=headers, timeout=request_timeout(10))
+
+    jobs: List = [asyncio.to_thread(sync_get) for _ in range(count)]
+    jobs += [async_http_client.get(url, headers=headers, timeout=request_timeout(10)) for _ in range(count)]
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    for error in errors[:1]:
+        print("HTTP warm-up error:", repr(error))
+    print(f"HTTP warm-up: {len(results) - len(errors)}/{len(results)} connections ready (http2={HTTP2_ENABLED})")
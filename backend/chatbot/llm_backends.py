@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from openai import AsyncOpenAI, OpenAI
+
+from token_budget import estimate_message_tokens, estimate_tokens
+
+# LLM-бэкенды по эндпоинтам. Бэкенд — пара клиентов с интерфейсом
+# chat.completions.create (синхронный и асинхронный) и свой регулятор запросов.
+# Виды: groq — клиенты Groq из chat_app; openai — любой OpenAI-совместимый
+# сервер (vLLM, llama.cpp server, Ollama и т.п., в том числе локальная модель
+# на CPU); stub — детерминированная заглушка без сети для тестов.
+# Конфигурация — CHAT_LLM_BACKENDS, JSON {"имя": {"kind": ..., ...}}:
+#   openai: base_url, api_key (или api_key_env), model, rpm, tpm
+#   stub:   reply (фиксированный ответ), model, delay (секунды)
+# model — модель, которую используют все эндпоинты этого бэкенда: у локального
+# сервера обычно одна модель, и имена Groq-моделей ему ничего не говорят.
+
+# Лимиты регулятора для бэкендов без лимитов аккаунта: очередь и повторы
+# остаются, но в RPM/TPM локальный сервер не упирается.
+UNLIMITED_RPM = 1_000_000
+UNLIMITED_TPM = 1_000_000_000
+
+
+class LLMBackend:
+    __slots__ = ("name", "kind", "client", "async_client", "governor", "model", "missing_detail")
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        client,
+        async_client,
+        governor,
+        model: Optional[str] = None,
+        missing_detail: Optional[str] = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.client = client
+        self.async_client = async_client
+        self.governor = governor
+        self.model = model
+        # Текст ошибки 500, если клиенты не созданы (например, не задан ключ).
+        self.missing_detail = missing_detail or f"LLM-бэкенд {name} не настроен"
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None and self.async_client is not None
+
+    def model_for(self, default: str) -> str:
+        return self.model or default
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "kind": self.kind, "model": self.model, "available": self.available}
+
+
+# ---------- ЗАГЛУШКА ----------
+
+
+def stub_reply(messages: List[dict], reply: Optional[str]) -> str:
+    if reply is not None:
+        return reply
+    # Без фиксированного ответа — начало последнего сообщения: тот же запрос, тот же ответ.
+    last = next((m.get("content") or "" for m in reversed(messages) if isinstance(m.get("content"), str)), "")
+    return " ".join(last.split()[:8]) or "stub"
+
+
+def stub_usage(messages: List[dict], text: str) -> SimpleNamespace:
+    prompt = sum(estimate_message_tokens(m.get("content") or "") for m in messages if isinstance(m.get("content"), str))
+    completion = estimate_tokens(text)
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion)
+
+
+def stub_response(model: str, messages: List[dict], text: str) -> SimpleNamespace:
+    message = SimpleNamespace(role="assistant", content=text, reasoning=None, executed_tools=None)
+    return SimpleNamespace(
+        id="stub-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+        model=model,
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        usage=stub_usage(messages, text),
+    )
+
+
+def stub_chunk(model: str, content: Optional[str], usage=None) -> SimpleNamespace:
+    choices = []
+    if content is not None:
+        delta = SimpleNamespace(content=content, reasoning=None, executed_tools=None)
+        choices.append(SimpleNamespace(index=0, delta=delta, finish_reason=None))
+    return SimpleNamespace(model=model, choices=choices, x_groq=SimpleNamespace(usage=usage) if usage else None)
+
+
+class StubStream:
+    """Асинхронный поток чанков, как у SDK при stream=True: слово за словом, usage в последнем."""
+
+    def __init__(self, model: str, messages: List[dict], text: str):
+        words = text.split(" ")
+        self._chunks = [stub_chunk(model, word + " ") for word in words[:-1]] + [stub_chunk(model, words[-1])]
+        self._chunks.append(stub_chunk(model, None, usage=stub_usage(messages, text)))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._chunks:
+            raise StopAsyncIteration
+        return self._chunks.pop(0)
+
+    async def close(self) -> None:
+        self._chunks = []
+
+
+class _StubCompletions:
+    def __init__(self, reply: Optional[str], delay: float, asynchronous: bool):
+        self.reply = reply
+        self.delay = delay
+        self.asynchronous = asynchronous
+        self.calls = 0
+
+    def _create(self, model: str, messages: List[dict], stream: bool):
+        self.calls += 1
+        text = stub_reply(messages, self.reply)
+        if stream:
+            return StubStream(model, messages, text)
+        return stub_response(model, messages, text)
+
+    def create(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        if not self.asynchronous:
+            if self.delay:
+                time.sleep(self.delay)
+            return self._create(model, messages, stream)
+
+        async def acreate():
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return self._create(model, messages, stream)
+
+        return acreate()
+
+
+class StubClient:
+    """Заглушка с интерфейсом client.chat.completions.create (OpenAI SDK)."""
+
+    def __init__(self, reply: Optional[str] = None, delay: float = 0.0, asynchronous: bool = False):
+        self.chat = SimpleNamespace(completions=_StubCompletions(reply, delay, asynchronous))
+
+
+# ---------- РЕЕСТР ----------
+
+
+def build_backend(
+    name: str,
+    options: dict,
+    http_client=None,
+    async_http_client=None,
+    governor_factory: Optional[Callable[[int, int], object]] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> LLMBackend:
+    kind = options.get("kind")
+    if kind not in ("openai", "stub"):
+        raise ValueError(f"CHAT_LLM_BACKENDS: у бэкенда {name} неизвестный kind {kind!r}")
+
+    governor = governor_factory(
+        int(options.get("rpm", UNLIMITED_RPM)),
+        int(options.get("tpm", UNLIMITED_TPM)),
+    )
+    model = options.get("model")
+
+    if kind == "stub":
+        reply = options.get("reply")
+        delay = float(options.get("delay", 0))
+        return LLMBackend(
+            name,
+            kind,
+            StubClient(reply, delay),
+            StubClient(reply, delay, asynchronous=True),
+            governor,
+            model=model or "stub",
+        )
+
+    base_url = (options.get("base_url") or "").strip().rstrip("/")
+    if not base_url:
+        raise ValueError(f"CHAT_LLM_BACKENDS: у бэкенда {name} не задан base_url")
+    if not model:
+        raise ValueError(f"CHAT_LLM_BACKENDS: у бэкенда {name} не задан model")
+    api_key = options.get("api_key")
+    if api_key is None and options.get("api_key_env"):
+        api_key = (env or {}).get(options["api_key_env"])
+    # Локальные серверы ключ не проверяют, но SDK без него не создаётся.
+    api_key = api_key or "local"
+
+    return LLMBackend(
+        name,
+        kind,
+        OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client),
+        AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=async_http_client),
+        governor,
+        model=model,
+    )
+
+
+def build_llm_backends(
+    config: Dict[str, dict],
+    groq: LLMBackend,
+    http_client=None,
+    async_http_client=None,
+    governor_factory: Optional[Callable[[int, int], object]] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> Dict[str, LLMBackend]:
+    backends = {"groq": groq}
+    for name, options in config.items():
+        if name == "groq":
+            raise ValueError("CHAT_LLM_BACKENDS: имя groq занято встроенным бэкендом")
+        backends[name] = build_backend(name, options, http_client, async_http_client, governor_factory, env)
+    return backends
+
+
+def select_backends(backends: Dict[str, LLMBackend], routes: Dict[str, str]) -> Dict[str, LLMBackend]:
+    """Эндпоинт -> бэкенд по именам из routes; неизвестное имя — ошибка при старте."""
+    selected = {}
+    for endpoint, name in routes.items():
+        if name not in backends:
+            raise ValueError(f"Неизвестный LLM-бэкенд {name!r} для эндпоинта {endpoint}")
+        selected[endpoint] = backends[name]
+    return selected
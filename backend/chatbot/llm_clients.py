@@ -0,0 +1,173 @@
+import json
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+from groq import AsyncGroq, Groq
+from openai import AsyncOpenAI
+
+from http_transport import build_async_http_client, build_http_client
+from llm_backends import LLMBackend, build_llm_backends, select_backends
+from metrics import upstream_observer
+from rate_governor import GovernorRejected, RateGovernor
+
+# Клиенты моделей, регулятор запросов и LLM-бэкенды по эндпоинтам. Отдельно
+# от chat_app, чтобы фоновые процессы (moderation_worker) вызывали модель,
+# не поднимая FastAPI-приложение, очередь верификации и индекс статей.
+# Переменные окружения читаются при импорте — вызывающий сначала делает load_dotenv().
+
+# --------- CLIENTS ---------
+
+GROQ_API_KEY = (os.environ.get("GROQ_API_KEY") or "").strip()
+GROQ_CHAT_MODEL = (os.environ.get("GROQ_CHAT_MODEL") or "groq/compound").strip()
+GROQ_TITLE_MODEL = (os.environ.get("GROQ_TITLE_MODEL") or GROQ_CHAT_MODEL).strip()
+GROQ_MODERATION_MODEL = (os.environ.get("GROQ_MODERATION_MODEL") or GROQ_CHAT_MODEL).strip()
+GROQ_SUMMARY_MODEL = (os.environ.get("GROQ_SUMMARY_MODEL") or GROQ_TITLE_MODEL).strip()
+# Отвечает, когда нашлись статьи платформы по теме: веб-поиск compound не нужен.
+GROQ_GROUNDED_MODEL = (os.environ.get("GROQ_GROUNDED_MODEL") or "llama-3.3-70b-versatile").strip()
+
+# Другой адрес — например, локальная заглушка bench/groq_stub.py для нагрузочных тестов.
+GROQ_BASE_URL = (os.environ.get("GROQ_BASE_URL") or "https://api.groq.com").strip().rstrip("/")
+GROQ_OPENAI_BASE_URL = f"{GROQ_BASE_URL}/openai/v1"
+CHAT_HTTP_WARMUP = os.environ.get("CHAT_HTTP_WARMUP", "true").strip().lower() in ("1", "true", "yes")
+
+# Таймауты ответа по эндпоинтам (секунды); подключение — CHAT_HTTP_CONNECT_TIMEOUT.
+GROQ_TIMEOUTS = {
+    "chat": float(os.environ.get("CHAT_TIMEOUT_CHAT", "60")),
+    "summary": float(os.environ.get("CHAT_TIMEOUT_SUMMARY", "20")),
+    "title": float(os.environ.get("CHAT_TIMEOUT_TITLE", "10")),
+    "moderation": float(os.environ.get("CHAT_TIMEOUT_MODERATION", "60")),
+    "vision": float(os.environ.get("CHAT_TIMEOUT_VISION", "90")),
+}
+
+# Один пул соединений на все синхронные клиенты и один — на асинхронные.
+
+http_client = build_http_client()
+async_http_client = build_async_http_client()
+
+# Клиенты инициализируем только если ключ задан, чтобы сервис мог стартовать
+# (в dev/preview окружениях ключ может быть не задан).
+# max_retries=0: повторы делает groq_governor, иначе SDK повторял бы в обход лимитов.
+client = (
+    Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0, http_client=http_client)
+    if GROQ_API_KEY
+    else None
+)
+# Асинхронный клиент для стриминга: не занимает слот threadpool на время ответа.
+async_client = (
+    AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0, http_client=async_http_client)
+    if GROQ_API_KEY
+    else None
+)
+# Vision тоже асинхронный: запрос можно отменить, если клиент ушёл.
+vision_client = (
+    AsyncOpenAI(
+        api_key=GROQ_API_KEY,
+        base_url=GROQ_OPENAI_BASE_URL,
+        max_retries=0,
+        http_client=async_http_client,
+    )
+    if GROQ_API_KEY
+    else None
+)
+
+# --------- RATE GOVERNOR ---------
+
+# Лимиты аккаунта Groq по умолчанию для каждой модели; отдельные модели —
+# через CHAT_GROQ_MODEL_LIMITS='{"model": {"rpm": 30, "tpm": 30000}}'.
+CHAT_GROQ_RPM = int(os.environ.get("CHAT_GROQ_RPM", "30"))
+CHAT_GROQ_TPM = int(os.environ.get("CHAT_GROQ_TPM", "60000"))
+CHAT_GROQ_MODEL_LIMITS = json.loads(os.environ.get("CHAT_GROQ_MODEL_LIMITS") or "{}")
+CHAT_GROQ_MAX_RETRIES = int(os.environ.get("CHAT_GROQ_MAX_RETRIES", "3"))
+
+# Сколько запрос полосы может ждать своей очереди, прежде чем получить 503.
+GOVERNOR_MAX_WAIT_SECONDS = {
+    "chat": float(os.environ.get("CHAT_GOVERNOR_MAX_WAIT_CHAT", "20")),
+    "title": float(os.environ.get("CHAT_GOVERNOR_MAX_WAIT_TITLE", "5")),
+    "moderation": float(os.environ.get("CHAT_GOVERNOR_MAX_WAIT_MODERATION", "60")),
+    "verification": float(os.environ.get("CHAT_GOVERNOR_MAX_WAIT_VERIFICATION", "120")),
+    "batch_moderation": float(os.environ.get("CHAT_GOVERNOR_MAX_WAIT_BATCH", "600")),
+}
+
+groq_governor = RateGovernor(
+    default_rpm=CHAT_GROQ_RPM,
+    default_tpm=CHAT_GROQ_TPM,
+    model_limits=CHAT_GROQ_MODEL_LIMITS,
+    max_wait_seconds=GOVERNOR_MAX_WAIT_SECONDS,
+    max_retries=CHAT_GROQ_MAX_RETRIES,
+    observer=upstream_observer,
+)
+
+
+def groq_overload_error(e: Exception) -> Optional[HTTPException]:
+    # Очередь регулятора не дождалась лимита или Groq так и не перестал отвечать 429.
+    if isinstance(e, GovernorRejected) or getattr(e, "status_code", None) == 429:
+        return HTTPException(
+            status_code=503,
+            detail="Сервис ИИ перегружен, попробуйте позже",
+        )
+    return None
+
+# --------- LLM-БЭКЕНДЫ ---------
+
+# Эндпоинт можно перевести с Groq на другой бэкенд из CHAT_LLM_BACKENDS
+# (см. llm_backends.py), например название чата и модерацию — на локальную
+# модель: CHAT_LLM_BACKENDS='{"local": {"kind": "openai",
+# "base_url": "http://127.0.0.1:8080/v1", "model": "qwen2.5-1.5b-instruct"}}',
+# CHAT_LLM_BACKEND_TITLE=local, CHAT_LLM_BACKEND_MODERATION=local.
+# Vision (проверка дипломов) всегда идёт в Groq: ей нужен Responses API.
+CHAT_LLM_BACKENDS = json.loads(os.environ.get("CHAT_LLM_BACKENDS") or "{}")
+LLM_ENDPOINTS = ("chat", "summary", "title", "moderation")
+
+
+def build_backend_governor(rpm: int, tpm: int) -> RateGovernor:
+    # У каждого бэкенда свои лимиты: локальный сервер не тратит лимиты аккаунта Groq.
+    return RateGovernor(
+        default_rpm=rpm,
+        default_tpm=tpm,
+        max_wait_seconds=GOVERNOR_MAX_WAIT_SECONDS,
+        max_retries=CHAT_GROQ_MAX_RETRIES,
+        observer=upstream_observer,
+    )
+
+
+llm_backends = build_llm_backends(
+    CHAT_LLM_BACKENDS,
+    groq=LLMBackend("groq", "groq", client, async_client, groq_governor, missing_detail="GROQ_API_KEY не задан"),
+    http_client=http_client,
+    async_http_client=async_http_client,
+    governor_factory=build_backend_governor,
+    env=os.environ,
+)
+endpoint_backends = select_backends(
+    llm_backends,
+    {
+        endpoint: (os.environ.get(f"CHAT_LLM_BACKEND_{endpoint.upper()}") or "groq").strip()
+        for endpoint in LLM_ENDPOINTS
+    },
+)
+chat_backend = endpoint_backends["chat"]
+summary_backend = endpoint_backends["summary"]
+title_backend = endpoint_backends["title"]
+moderation_backend = endpoint_backends["moderation"]
+
+# Модели, которые реально вызываются: у бэкенда может быть своя.
+CHAT_MODEL = chat_backend.model_for(GROQ_CHAT_MODEL)
+GROUNDED_MODEL = chat_backend.model_for(GROQ_GROUNDED_MODEL)
+SUMMARY_MODEL = summary_backend.model_for(GROQ_SUMMARY_MODEL)
+TITLE_MODEL = title_backend.model_for(GROQ_TITLE_MODEL)
+MODERATION_MODEL = moderation_backend.model_for(GROQ_MODERATION_MODEL)
+
+
+def require_backend(backend: LLMBackend) -> None:
+    if not backend.available:
+        raise HTTPException(status_code=500, detail=backend.missing_detail)
+
+
+def llm_backends_snapshot() -> dict:
+    snapshot = {"endpoints": {endpoint: backend.describe() for endpoint, backend in endpoint_backends.items()}}
+    # Регулятор Groq и так в rate_governor; здесь — регуляторы остальных бэкендов.
+    snapshot["governors"] = {
+        name: backend.governor.stats() for name, backend in llm_backends.items() if backend.kind != "groq"
+    }
+    return snapshot
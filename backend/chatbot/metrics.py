@@ -0,0 +1,292 @@
+import time
+from typing import Callable, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.process_collector import ProcessCollector
+from starlette.routing import Match
+
+# Метрики Prometheus для /metrics. На горячем пути — только счётчики запросов
+# и вызовов Groq (инкремент под локом, без аллокаций сверх меток); всё, что уже
+# считается для /stats (кеши, single-flight, регулятор, очередь верификации),
+# читается из снимка /stats в момент scrape, а не дублируется при каждом запросе.
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+UPSTREAM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0)
+
+http_request_duration = Histogram(
+    "chat_http_request_duration_seconds",
+    "Время обработки HTTP-запроса (для SSE — до конца потока)",
+    ["route", "method", "status"],
+    buckets=REQUEST_BUCKETS,
+    registry=registry,
+)
+http_requests_in_flight = Gauge(
+    "chat_http_requests_in_flight",
+    "HTTP-запросы в обработке",
+    ["route"],
+    registry=registry,
+)
+upstream_duration = Histogram(
+    "chat_upstream_request_duration_seconds",
+    "Время одного вызова модели (для стрима — до начала потока)",
+    ["lane", "model", "outcome"],
+    buckets=UPSTREAM_BUCKETS,
+    registry=registry,
+)
+upstream_in_flight = Gauge(
+    "chat_upstream_requests_in_flight",
+    "Вызовы модели в процессе",
+    ["lane", "model"],
+    registry=registry,
+)
+upstream_errors = Counter(
+    "chat_upstream_errors_total",
+    "Ошибки вызовов модели по статусу (429, 413, 5xx, connection, timeout, other)",
+    ["lane", "model", "status"],
+    registry=registry,
+)
+upstream_tokens = Counter(
+    "chat_upstream_tokens_total",
+    "Токены по usage из ответа модели",
+    ["lane", "model", "kind"],
+    registry=registry,
+)
+
+
+# ---------- HTTP ----------
+
+
+def route_label(scope) -> str:
+    # Шаблон маршрута, а не путь: /expert/verify/{job_id} — одна серия, а не по серии на задачу.
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return getattr(route, "path", "other")
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    """
+    Чистый ASGI-middleware: в отличие от BaseHTTPMiddleware не буферизует
+    стриминговые ответы и не мешает отмене запроса при разрыве соединения.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_label(scope)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = http_requests_in_flight.labels(route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            http_request_duration.labels(route, scope["method"], str(status["code"])).observe(
+                time.perf_counter() - started
+            )
+
+
+# ---------- ВЫЗОВЫ МОДЕЛИ ----------
+
+
+def error_status(error: BaseException) -> str:
+    status_code = getattr(error, "status_code", None)
+    if status_code:
+        return str(status_code)
+    name = type(error).__name__
+    if name == "APITimeoutError":
+        return "timeout"
+    if name == "APIConnectionError":
+        return "connection"
+    if name == "GovernorRejected":
+        return "rejected"
+    return "other"
+
+
+def observe_tokens(lane: str, model: str, usage) -> None:
+    if usage is None:
+        return
+    # chat.completions — prompt/completion_tokens, Responses API (vision) — input/output_tokens.
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "input_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(usage, "output_tokens", None)
+    if isinstance(prompt, int):
+        upstream_tokens.labels(lane, model, "prompt").inc(prompt)
+    if isinstance(completion, int):
+        upstream_tokens.labels(lane, model, "completion").inc(completion)
+
+
+class UpstreamObserver:
+    """Наблюдатель за вызовами модели для RateGovernor: каждая попытка, включая повторы."""
+
+    def started(self, lane: str, model: str) -> None:
+        upstream_in_flight.labels(lane, model).inc()
+
+    def finished(
+        self,
+        lane: str,
+        model: str,
+        seconds: float,
+        response=None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        upstream_in_flight.labels(lane, model).dec()
+        if error is None:
+            outcome = "ok"
+            observe_tokens(lane, model, getattr(response, "usage", None))
+        elif isinstance(error, Exception):
+            outcome = "error"
+            upstream_errors.labels(lane, model, error_status(error)).inc()
+        else:
+            # CancelledError: клиент ушёл, дедлайн или проигравший хедж.
+            outcome = "cancelled"
+        upstream_duration.labels(lane, model, outcome).observe(seconds)
+
+
+upstream_observer = UpstreamObserver()
+
+
+# ---------- СНИМОК /stats ----------
+
+
+class ServiceStatsCollector:
+    """Переводит снимок /stats в метрики при каждом scrape."""
+
+    def __init__(self, snapshot: Callable[[], dict]):
+        self.snapshot = snapshot
+
+    def collect(self):
+        stats = self.snapshot()
+
+        cache_hits = CounterMetricFamily("chat_cache_hits", "Попадания в кеш", labels=["cache"])
+        cache_misses = CounterMetricFamily("chat_cache_misses", "Промахи кеша", labels=["cache"])
+        cache_size = GaugeMetricFamily("chat_cache_entries", "Записей в кеше", labels=["cache"])
+        cache_hit_rate = GaugeMetricFamily("chat_cache_hit_rate", "Доля попаданий в кеш", labels=["cache"])
+        caches = dict(stats.get("caches") or {})
+        if stats.get("semantic_cache"):
+            caches["semantic"] = stats["semantic_cache"]
+        for name, cache in caches.items():
+            cache_hits.add_metric([name], cache["hits"])
+            cache_misses.add_metric([name], cache["misses"])
+            cache_size.add_metric([name], cache["size"])
+            cache_hit_rate.add_metric([name], cache["hit_rate"])
+        yield from (cache_hits, cache_misses, cache_size, cache_hit_rate)
+
+        flight_calls = CounterMetricFamily(
+            "chat_single_flight_upstream_calls", "Вызовы, выполненные ведущим", labels=["flight"]
+        )
+        flight_coalesced = CounterMetricFamily(
+            "chat_single_flight_coalesced", "Запросы, дождавшиеся чужого вызова", labels=["flight"]
+        )
+        for name, flight in (stats.get("single_flight") or {}).items():
+            flight_calls.add_metric([name], flight["upstream_calls"])
+            flight_coalesced.add_metric([name], flight["coalesced"])
+        yield from (flight_calls, flight_coalesced)
+
+        cancellations = CounterMetricFamily(
+            "chat_cancellations", "Отменённые запросы", labels=["endpoint", "reason"]
+        )
+        for endpoint, counts in (stats.get("cancellations") or {}).items():
+            for reason, count in counts.items():
+                cancellations.add_metric([endpoint, reason], count)
+        yield cancellations
+
+        title_sources = CounterMetricFamily(
+            "chat_title_sources", "Откуда взялось название чата", labels=["source"]
+        )
+        for source, count in (stats.get("title_sources") or {}).items():
+            title_sources.add_metric([source], count)
+        yield title_sources
+
+        governor = stats.get("rate_governor") or {}
+        lane_requests = CounterMetricFamily(
+            "chat_governor_requests", "Разрешения регулятора", labels=["lane"]
+        )
+        lane_rejected = CounterMetricFamily(
+            "chat_governor_rejected", "Запросы, не дождавшиеся лимита", labels=["lane"]
+        )
+        lane_retries = CounterMetricFamily("chat_governor_retries", "Повторы после 429/5xx", labels=["lane"])
+        for lane, counts in (governor.get("lanes") or {}).items():
+            lane_requests.add_metric([lane], counts["requests"])
+            lane_rejected.add_metric([lane], counts["rejected"])
+            lane_retries.add_metric([lane], counts["retries"])
+        model_queued = GaugeMetricFamily(
+            "chat_governor_queued", "Ожидающие в очереди регулятора", labels=["model"]
+        )
+        model_tokens = GaugeMetricFamily(
+            "chat_governor_tokens_available", "Свободные токены в ведре TPM", labels=["model"]
+        )
+        for model, state in (governor.get("models") or {}).items():
+            model_queued.add_metric([model], state["queued"])
+            model_tokens.add_metric([model], state["tokens_available"])
+        yield from (lane_requests, lane_rejected, lane_retries, model_queued, model_tokens)
+
+        http = stats.get("http") or {}
+        if http:
+            yield CounterMetricFamily(
+                "chat_upstream_connections_opened", "Новые соединения к Groq", value=http["new_connections"]
+            )
+
+        labels = ["chain", "mode", "model"]
+        hedge_attempts = CounterMetricFamily("chat_model_attempts", "Запросы к модели в цепочке", labels=labels)
+        hedge_hedges = CounterMetricFamily("chat_model_hedges", "Хеджирующие запросы к модели", labels=labels)
+        hedge_wins = CounterMetricFamily("chat_model_wins", "Ответы модели, ставшие итоговыми", labels=labels)
+        for chain, modes in (stats.get("model_latency") or {}).items():
+            for mode, models in modes.items():
+                for model, latency in models.items():
+                    hedge_attempts.add_metric([chain, mode, model], latency["attempts"])
+                    hedge_hedges.add_metric([chain, mode, model], latency["hedges"])
+                    hedge_wins.add_metric([chain, mode, model], latency["wins"])
+        yield from (hedge_attempts, hedge_hedges, hedge_wins)
+
+        jobs = stats.get("verification_jobs") or {}
+        if jobs:
+            yield GaugeMetricFamily(
+                "chat_verification_queue_depth", "Задачи верификации в очереди", value=jobs["queue_depth"]
+            )
+            yield GaugeMetricFamily(
+                "chat_verification_running", "Задачи верификации в работе", value=jobs["running"]
+            )
+            job_results = CounterMetricFamily(
+                "chat_verification_jobs", "Завершённые задачи верификации", labels=["result"]
+            )
+            for result in ("completed", "failed", "rejected"):
+                job_results.add_metric([result], jobs[result])
+            yield job_results
+
+
+def register_stats_collector(snapshot: Callable[[], dict]) -> None:
+    registry.register(ServiceStatsCollector(snapshot))
+
+
+def render_metrics() -> bytes:
+    return generate_latest(registry)
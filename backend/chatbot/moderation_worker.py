@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Set
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pydantic import ValidationError
+from psycopg2.extras import RealDictCursor, execute_values
+
+load_dotenv()
+
+# Только модерация и клиенты модели: FastAPI-приложение chat_app не поднимается.
+from article_moderation import CHAT_MODERATION_BATCH_CONCURRENCY, ArticleModerationIn, moderate_article_async
+from llm_clients import moderation_backend
+from platform_db import get_connection
+
+# Фоновая премодерация: забирает статьи со статусом pending пачками, модерирует
+# их параллельно тем же промптом и harden_article_decision(), что и
+# /article/moderate, и пишет решения обратно одним UPDATE.
+# Транзакции короткие: захват пачки (pending -> processing с арендой
+# moderationLeaseUntil, SKIP LOCKED) коммитится сразу, модель вызывается вне
+# транзакции, решения пишутся второй транзакцией — только в строки, аренда
+# которых всё ещё наша. Статьи упавшего воркера (processing с истёкшей арендой)
+# забирает следующий захват. Несколько процессов воркера могут работать
+# одновременно.
+# Статья, которую модель так и не смогла оценить за WORKER_MAX_ATTEMPTS попыток
+# или которая не проходит ограничения ArticleModerationIn, возвращается в pending
+# (её увидит модератор), в moderationReason пишется причина, а этот процесс
+# больше её не берёт. Счётчик попыток живёт в памяти процесса.
+
+WORKER_BATCH_SIZE = int(os.environ.get("MODERATION_WORKER_BATCH_SIZE", "20"))
+WORKER_CONCURRENCY = int(
+    os.environ.get("MODERATION_WORKER_CONCURRENCY", str(CHAT_MODERATION_BATCH_CONCURRENCY))
+)
+WORKER_POLL_SECONDS = float(os.environ.get("MODERATION_WORKER_POLL_SECONDS", "30"))
+WORKER_MAX_ATTEMPTS = int(os.environ.get("MODERATION_WORKER_MAX_ATTEMPTS", "3"))
+WORKER_RETRY_DELAY_SECONDS = float(os.environ.get("MODERATION_WORKER_RETRY_DELAY_SECONDS", "300"))
+# Аренда захваченной пачки: должна покрывать модерацию всей пачки.
+WORKER_LEASE_SECONDS = int(os.environ.get("MODERATION_WORKER_LEASE_SECONDS", "600"))
+# 0 — HTTP-эндпоинт с метриками не поднимается
+WORKER_METRICS_PORT = int(os.environ.get("MODERATION_WORKER_METRICS_PORT", "0"))
+
+
+def extract_article_text(content: Any) -> str:
+    # Та же логика, что extractArticleText() в Node-бэкенде.
+    if isinstance(content, str):
+        return content
+    if not isinstance(content, list):
+        return ""
+
+    parts: List[str] = []
+    for block in content:
+        if not isinstance(block, dict):
+            continue
+        if isinstance(block.get("text"), str):
+            parts.append(block["text"])
+        if isinstance(block.get("items"), list):
+            parts += [item for item in block["items"] if isinstance(item, str)]
+    return "\n".join(parts).strip()
+
+
+class WorkerStats:
+    def __init__(self):
+        self.started_at = time.time()
+        self.batches = 0
+        self.claimed = 0
+        self.approved = 0
+        self.rejected = 0
+        self.failed = 0
+        self.errors = 0
+        self.pending = None
+        self.last_batch_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_batch(self, claimed: int, approved: int, rejected: int, failed: int, errors: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.claimed += claimed
+            self.approved += approved
+            self.rejected += rejected
+            self.failed += failed
+            self.errors += errors
+            self.last_batch_seconds = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            uptime = time.time() - self.started_at
+            done = self.approved + self.rejected + self.failed
+            return {
+                "uptime_seconds": round(uptime, 1),
+                "batches": self.batches,
+                "claimed": self.claimed,
+                "approved": self.approved,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "errors": self.errors,
+                "pending": self.pending,
+                "last_batch_seconds": round(self.last_batch_seconds, 2),
+                "articles_per_minute": round(done / uptime * 60, 2) if uptime else 0.0,
+            }
+
+
+stats = WorkerStats()
+
+
+def start_metrics_server(port: int) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(stats.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Moderation worker metrics on :{port}")
+
+
+def count_pending(conn) -> int:
+    with conn.cursor() as cur:
+        cur.execute("""SELECT COUNT(*) FROM "Article" WHERE "moderationStatus" = 'pending'""")
+        count = cur.fetchone()[0]
+    conn.commit()
+    return int(count)
+
+
+def claim_batch(conn, limit: int, skip_ids: List[str]) -> List[dict]:
+    """
+    Переводит пачку статей в processing с арендой на WORKER_LEASE_SECONDS и сразу
+    коммитит. Берутся pending-статьи и processing-статьи с истёкшей арендой.
+    Значение аренды в строке ("lease") служит меткой захвата для write_decisions().
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            UPDATE "Article" AS a
+            SET "moderationStatus" = 'processing',
+                "moderationLeaseUntil" = NOW() + make_interval(secs => %s)
+            FROM (
+                SELECT "id"
+                FROM "Article"
+                WHERE ("moderationStatus" = 'pending'
+                       OR ("moderationStatus" = 'processing' AND "moderationLeaseUntil" < NOW()))
+                  AND NOT ("id" = ANY(%s::text[]))
+                ORDER BY "createdAt"
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) AS claimed
+            WHERE a."id" = claimed."id"
+            RETURNING a."id", a."title", a."category", a."annotation", a."content",
+                      a."moderationLeaseUntil" AS "lease"
+            """,
+            (WORKER_LEASE_SECONDS, skip_ids, limit),
+        )
+        rows = list(cur.fetchall())
+    conn.commit()
+    return rows
+
+
+def write_decisions(conn, decisions: List[tuple], released: List[tuple]) -> None:
+    """
+    decisions: (id, status, reason, score, lease); released: (id, reason, lease) —
+    статьи, которые возвращаются в pending (повтор позже или отказ от попыток;
+    reason None оставляет прежнюю причину). Одна транзакция на пачку; строки,
+    аренду которых за это время перехватил другой воркер, не трогаются.
+    """
+    if decisions:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                UPDATE "Article" AS a
+                SET "moderationStatus" = v.status,
+                    "moderationReason" = v.reason,
+                    "moderationScore" = v.score,
+                    "moderatedAt" = NOW(),
+                    "moderationLeaseUntil" = NULL
+                FROM (VALUES %s) AS v(id, status, reason, score, lease)
+                WHERE a."id" = v.id
+                  AND a."moderationStatus" = 'processing'
+                  AND a."moderationLeaseUntil" = v.lease
+                """,
+                decisions,
+                template="(%s, %s, %s, %s::integer, %s::timestamp)",
+            )
+    if released:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                UPDATE "Article" AS a
+                SET "moderationStatus" = 'pending',
+                    "moderationReason" = COALESCE(v.reason, a."moderationReason"),
+                    "moderationLeaseUntil" = NULL
+                FROM (VALUES %s) AS v(id, reason, lease)
+                WHERE a."id" = v.id
+                  AND a."moderationStatus" = 'processing'
+                  AND a."moderationLeaseUntil" = v.lease
+                """,
+                released,
+                template="(%s, %s, %s::timestamp)",
+            )
+    conn.commit()
+
+
+def validation_detail(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+
+async def moderate_row(row: dict, semaphore: asyncio.Semaphore) -> dict:
+    # Те же ограничения, что у /article/moderate: статью без аннотации или
+    # с коротким текстом модели не отправляем — её разберёт модератор.
+    body = ArticleModerationIn.model_validate(
+        {
+            "title": row["title"] or "",
+            "category": row["category"] or "",
+            "annotation": row["annotation"] or "",
+            "content_text": extract_article_text(row["content"]),
+        }
+    )
+    async with semaphore:
+        return await moderate_article_async(body)
+
+
+class ModerationWorker:
+    def __init__(self, batch_size: int, concurrency: int):
+        self.batch_size = batch_size
+        self.concurrency = max(concurrency, 1)
+        self.stopping = False
+        # id -> (число неудачных попыток, время следующей попытки)
+        self.retries: Dict[str, tuple] = {}
+        # Исчерпали попытки: остаются pending, этим процессом больше не берутся.
+        self.given_up: Set[str] = set()
+
+    def _skip_ids(self) -> List[str]:
+        now = time.time()
+        waiting = [article_id for article_id, (_, retry_at) in self.retries.items() if retry_at > now]
+        return waiting + list(self.given_up)
+
+    async def run_batch(self, conn) -> int:
+        rows = await asyncio.to_thread(claim_batch, conn, self.batch_size, self._skip_ids())
+        if not rows:
+            return 0
+
+        started = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(moderate_row(row, semaphore) for row in rows),
+            return_exceptions=True,
+        )
+
+        decisions: List[tuple] = []
+        released: List[tuple] = []
+        approved = rejected = failed = errors = 0
+        for row, result in zip(rows, results):
+            article_id = row["id"]
+            if isinstance(result, BaseException):
+                attempts = self.retries.get(article_id, (0, 0.0))[0] + 1
+                if isinstance(result, ValidationError):
+                    # Повтор не поможет: статья не изменится, пока её не поправят.
+                    detail = validation_detail(result)
+                    attempts = WORKER_MAX_ATTEMPTS
+                else:
+                    detail = result.detail if isinstance(result, HTTPException) else str(result)
+                print(f"Moderation failed for {article_id} (attempt {attempts}): {detail}")
+                errors += 1
+                if attempts >= WORKER_MAX_ATTEMPTS:
+                    self.retries.pop(article_id, None)
+                    self.given_up.add(article_id)
+                    released.append((article_id, f"Автомодерация не удалась: {detail}"[:1000], row["lease"]))
+                    failed += 1
+                else:
+                    self.retries[article_id] = (attempts, time.time() + WORKER_RETRY_DELAY_SECONDS)
+                    released.append((article_id, None, row["lease"]))
+                continue
+
+            self.retries.pop(article_id, None)
+            decisions.append(
+                (
+                    article_id,
+                    result["decision"],
+                    "; ".join(result.get("reasons") or [])[:1000] or None,
+                    result.get("confidence_score"),
+                    row["lease"],
+                )
+            )
+            if result["decision"] == "approved":
+                approved += 1
+            else:
+                rejected += 1
+
+        await asyncio.to_thread(write_decisions, conn, decisions, released)
+
+        seconds = time.time() - started
+        stats.record_batch(len(rows), approved, rejected, failed, errors, seconds)
+        print(
+            f"Moderation batch: claimed={len(rows)} approved={approved} rejected={rejected} "
+            f"failed={failed} retry_later={errors - failed} seconds={seconds:.1f}"
+        )
+        return len(rows)
+
+    async def run(self, once: bool) -> None:
+        conn = await asyncio.to_thread(get_connection)
+        try:
+            while not self.stopping:
+                stats.pending = await asyncio.to_thread(count_pending, conn)
+                processed = await self.run_batch(conn)
+                if processed:
+                    continue
+                if once:
+                    break
+                await asyncio.sleep(WORKER_POLL_SECONDS)
+        finally:
+            conn.close()
+
+
+async def main(batch_size: int, concurrency: int, once: bool) -> None:
+    if not moderation_backend.available:
+        raise SystemExit(moderation_backend.missing_detail)
+
+    worker = ModerationWorker(batch_size=batch_size, concurrency=concurrency)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Дорабатываем текущую пачку и выходим.
+        loop.add_signal_handler(sig, lambda: setattr(worker, "stopping", True))
+
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+    print(f"Moderation worker started: batch_size={batch_size}, concurrency={concurrency}")
+    await worker.run(once=once)
+    print("Moderation worker stopped:", json.dumps(stats.snapshot()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="разобрать очередь и выйти")
+    parser.add_argument("--batch-size", type=int, default=WORKER_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    args = parser.parse_args()
+
+    asyncio.run(main(batch_size=args.batch_size, concurrency=args.concurrency, once=args.once))
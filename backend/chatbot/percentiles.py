@@ -0,0 +1,12 @@
+from typing import Iterable, Optional
+
+# Перцентили по окну последних замеров для /stats и /metrics: выборки
+# небольшие (сотни значений), поэтому просто сортируем, без гистограмм.
+
+
+def percentile(values: Iterable[float], q: float) -> Optional[float]:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 3)
@@ -0,0 +1,27 @@
+import os
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException
+
+# Пользователь платформы по JWT Node-бэкенда: тот же JWT_SECRET и та же
+# полезная нагрузка { userId, email, role }, что у authMiddleware в backend/src.
+
+JWT_SECRET = os.getenv("JWT_SECRET", "")
+
+
+def user_id_from_authorization(authorization: Optional[str]) -> int:
+    if not JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Авторизация не настроена (JWT_SECRET)")
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    try:
+        payload = jwt.decode(authorization[len("Bearer "):].strip(), JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Неверный токен")
+
+    user_id = payload.get("userId")
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise HTTPException(status_code=401, detail="Неверный токен")
+    return user_id
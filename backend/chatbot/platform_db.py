@@ -0,0 +1,53 @@
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# Подключение к базе платформы (Postgres, схема Prisma) для чат-сервиса
+# и фонового воркера модерации.
+
+
+def normalize_database_url_for_psycopg2(url: str) -> str:
+    # Prisma-параметр ?schema=... psycopg2 не понимает.
+    if not url:
+        return url
+
+    parsed = urlparse(url)
+    query_params = parse_qsl(parsed.query, keep_blank_values=True)
+    filtered_query = [(k, v) for k, v in query_params if k.lower() != "schema"]
+    return urlunparse(parsed._replace(query=urlencode(filtered_query)))
+
+
+DATABASE_URL = normalize_database_url_for_psycopg2(os.getenv("DATABASE_URL", ""))
+
+
+def get_connection():
+    return psycopg2.connect(DATABASE_URL)
+
+
+class ConnectionPool:
+    """
+    ThreadedConnectionPool, из которого соединение берётся через with.
+    Сам пул при нехватке соединений падает с PoolError, поэтому потоки
+    ждут свободное соединение на семафоре.
+    """
+
+    def __init__(self, minconn: int, maxconn: int):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, DATABASE_URL)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self._pool.getconn()
+            try:
+                yield conn
+            finally:
+                # Незавершённую транзакцию пул откатит, разорванное соединение закроет.
+                self._pool.putconn(conn, close=bool(conn.closed))
+
+    def close(self) -> None:
+        self._pool.closeall()
@@ -0,0 +1,378 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from percentiles import percentile
+
+# Общий регулятор запросов к Groq: все эндпоинты ходят в один аккаунт, поэтому
+# лимиты (запросы и токены в минуту) считаются здесь, по каждой модели отдельно.
+# Ожидающие запросы выстраиваются по приоритету полосы: интерактивный чат не
+# стоит в очереди за пакетной модерацией. 429/5xx повторяются с задержкой
+# (retry-after или экспоненциальная с джиттером), SDK-ретраи при этом выключены.
+
+T = TypeVar("T")
+
+# Меньше — важнее.
+LANE_PRIORITIES = {
+    "chat": 0,
+    "title": 1,
+    "moderation": 2,
+    "verification": 2,
+    "batch_moderation": 3,
+}
+
+# Как часто ожидающий не первым в очереди перепроверяет свою очередь (async).
+POLL_SECONDS = 0.05
+
+
+class AttemptTiming:
+    """
+    Время последней попытки вызова — без ожидания в очереди и пауз между
+    повторами. Вызывающий кладёт объект в attempt_timing, регулятор заполняет.
+    """
+
+    __slots__ = ("started", "seconds")
+
+    def __init__(self):
+        self.started: Optional[float] = None  # monotonic начала текущей попытки
+        self.seconds: Optional[float] = None  # длительность завершённой попытки
+
+
+attempt_timing: ContextVar[Optional[AttemptTiming]] = ContextVar("attempt_timing", default=None)
+
+
+class GovernorRejected(Exception):
+    def __init__(self, lane: str, waited: float):
+        super().__init__(f"rate governor: lane {lane} waited {waited:.1f}s")
+        self.lane = lane
+        self.waited = waited
+
+
+class _Bucket:
+    """Token bucket с непрерывным пополнением: capacity единиц в минуту."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(per_minute, 1))
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Запрос больше ёмкости ждёт полного ведра, а не вечно.
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _ModelState:
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        # До этого момента (monotonic) модель не трогаем — после 429.
+        self.blocked_until = 0.0
+        self.waiters: list = []
+
+
+class _Ticket:
+    __slots__ = ("lane", "tokens", "cancelled")
+
+    def __init__(self, lane: str, tokens: int):
+        self.lane = lane
+        self.tokens = tokens
+        self.cancelled = False
+
+
+class RateGovernor:
+    def __init__(
+        self,
+        default_rpm: int,
+        default_tpm: int,
+        model_limits: Optional[Dict[str, dict]] = None,
+        max_wait_seconds: Optional[Dict[str, float]] = None,
+        max_retries: int = 3,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 20.0,
+        observer=None,
+    ):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.model_limits = model_limits or {}
+        self.max_wait_seconds = max_wait_seconds or {}
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        # Объект с started(lane, model) и finished(lane, model, seconds, response, error)
+        # узнаёт о каждой попытке вызова — для метрик.
+        self.observer = observer
+
+        self._cond = threading.Condition()
+        self._models: Dict[str, _ModelState] = {}
+        self._seq = itertools.count()
+
+        self._lane_counts: Dict[str, Counter] = {lane: Counter() for lane in LANE_PRIORITIES}
+        self._lane_waits: Dict[str, deque] = {lane: deque(maxlen=500) for lane in LANE_PRIORITIES}
+        self._upstream_errors: Counter = Counter()
+
+    # --------- очередь ---------
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            limits = self.model_limits.get(model, {})
+            state = _ModelState(
+                rpm=int(limits.get("rpm", self.default_rpm)),
+                tpm=int(limits.get("tpm", self.default_tpm)),
+            )
+            self._models[model] = state
+        return state
+
+    def _enqueue(self, lane: str, model: str, tokens: int) -> _Ticket:
+        ticket = _Ticket(lane, tokens)
+        with self._cond:
+            heapq.heappush(self._state(model).waiters, (LANE_PRIORITIES[lane], next(self._seq), ticket))
+        return ticket
+
+    def _try_acquire(self, model: str, ticket: _Ticket) -> Optional[float]:
+        """None — разрешение выдано, иначе сколько секунд ещё ждать."""
+        with self._cond:
+            state = self._state(model)
+            while state.waiters and state.waiters[0][2].cancelled:
+                heapq.heappop(state.waiters)
+            if state.waiters[0][2] is not ticket:
+                return POLL_SECONDS
+
+            now = time.monotonic()
+            state.requests.refill(now)
+            state.tokens.refill(now)
+            delay = max(
+                state.blocked_until - now,
+                state.requests.wait_time(1),
+                state.tokens.wait_time(ticket.tokens),
+            )
+            if delay > 0:
+                return delay
+
+            state.requests.take(1)
+            state.tokens.take(ticket.tokens)
+            heapq.heappop(state.waiters)
+            # Следующий в очереди может проходить.
+            self._cond.notify_all()
+            return None
+
+    def _cancel(self, ticket: _Ticket) -> None:
+        with self._cond:
+            ticket.cancelled = True
+            self._cond.notify_all()
+
+    def _granted(self, lane: str, waited: float) -> None:
+        with self._cond:
+            self._lane_counts[lane]["requests"] += 1
+            self._lane_waits[lane].append(waited)
+
+    def _rejected(self, lane: str, ticket: _Ticket, waited: float) -> GovernorRejected:
+        self._cancel(ticket)
+        with self._cond:
+            self._lane_counts[lane]["rejected"] += 1
+        return GovernorRejected(lane, waited)
+
+    def acquire(self, lane: str, model: str, tokens: int) -> None:
+        started = time.monotonic()
+        max_wait = self.max_wait_seconds.get(lane, 60.0)
+        ticket = self._enqueue(lane, model, tokens)
+        while True:
+            delay = self._try_acquire(model, ticket)
+            waited = time.monotonic() - started
+            if delay is None:
+                self._granted(lane, waited)
+                return
+            if waited >= max_wait:
+                raise self._rejected(lane, ticket, waited)
+            with self._cond:
+                self._cond.wait(min(delay, max_wait - waited))
+
+    async def aacquire(self, lane: str, model: str, tokens: int) -> None:
+        started = time.monotonic()
+        max_wait = self.max_wait_seconds.get(lane, 60.0)
+        ticket = self._enqueue(lane, model, tokens)
+        try:
+            while True:
+                delay = self._try_acquire(model, ticket)
+                waited = time.monotonic() - started
+                if delay is None:
+                    self._granted(lane, waited)
+                    return
+                if waited >= max_wait:
+                    raise self._rejected(lane, ticket, waited)
+                await asyncio.sleep(min(delay, max_wait - waited))
+        except asyncio.CancelledError:
+            self._cancel(ticket)
+            raise
+
+    def settle(self, model: str, reserved: int, response) -> None:
+        # Возвращаем в ведро разницу между оценкой и фактическим расходом.
+        usage = getattr(response, "usage", None)
+        used = getattr(usage, "total_tokens", None)
+        if not isinstance(used, int):
+            return
+        with self._cond:
+            state = self._state(model)
+            if used < reserved:
+                state.tokens.give_back(reserved - used)
+            else:
+                state.tokens.take(used - reserved)
+
+    # --------- повторы ---------
+
+    def _retry_delay(self, model: str, lane: str, e: Exception, attempt: int) -> Optional[float]:
+        status_code = getattr(e, "status_code", None)
+        connection_error = type(e).__name__ in ("APIConnectionError", "APITimeoutError")
+        if not (status_code == 429 or (status_code or 0) >= 500 or connection_error):
+            return None
+
+        with self._cond:
+            self._upstream_errors[str(status_code or "connection")] += 1
+        if attempt >= self.max_retries:
+            return None
+
+        retry_after = None
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except (TypeError, ValueError):
+            retry_after = None
+
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max_seconds) + random.uniform(0, self.backoff_base_seconds)
+        else:
+            # Full jitter: одновременно получившие 429 не вернутся все разом.
+            delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+        with self._cond:
+            self._lane_counts[lane]["retries"] += 1
+            if status_code == 429:
+                # Лимит аккаунта исчерпан — притормаживаем всех, а не только этот запрос.
+                state = self._state(model)
+                state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+        print(f"Groq {status_code or 'connection error'} ({lane}, {model}), retry in {delay:.1f}s")
+        return delay
+
+    def _attempt_started(self, lane: str, model: str) -> float:
+        started = time.monotonic()
+        timing = attempt_timing.get()
+        if timing is not None:
+            timing.started = started
+            timing.seconds = None
+        if self.observer is not None:
+            self.observer.started(lane, model)
+        return started
+
+    def _attempt_finished(self, lane: str, model: str, started: float, response=None, error=None) -> None:
+        seconds = time.monotonic() - started
+        timing = attempt_timing.get()
+        if timing is not None:
+            timing.seconds = seconds
+        if self.observer is not None:
+            self.observer.finished(lane, model, seconds, response=response, error=error)
+
+    def _attempt(self, lane: str, model: str, fn: Callable[[], T]) -> T:
+        started = self._attempt_started(lane, model)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._attempt_finished(lane, model, started, error=e)
+            raise
+        self._attempt_finished(lane, model, started, response=result)
+        return result
+
+    async def _aattempt(self, lane: str, model: str, fn: Callable[[], Awaitable[T]]) -> T:
+        started = self._attempt_started(lane, model)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._attempt_finished(lane, model, started, error=e)
+            raise
+        self._attempt_finished(lane, model, started, response=result)
+        return result
+
+    def call(self, lane: str, model: str, tokens: int, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            self.acquire(lane, model, tokens)
+            try:
+                result = self._attempt(lane, model, fn)
+            except Exception as e:
+                delay = self._retry_delay(model, lane, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.settle(model, tokens, result)
+            return result
+
+    async def acall(self, lane: str, model: str, tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            await self.aacquire(lane, model, tokens)
+            try:
+                result = await self._aattempt(lane, model, fn)
+            except Exception as e:
+                delay = self._retry_delay(model, lane, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.settle(model, tokens, result)
+            return result
+
+    # --------- метрики ---------
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            models = {}
+            for model, state in self._models.items():
+                state.requests.refill(now)
+                state.tokens.refill(now)
+                models[model] = {
+                    "rpm": int(state.requests.capacity),
+                    "tpm": int(state.tokens.capacity),
+                    "requests_available": int(state.requests.level),
+                    "tokens_available": int(state.tokens.level),
+                    "queued": sum(1 for _, _, t in state.waiters if not t.cancelled),
+                    "blocked_seconds": round(max(state.blocked_until - now, 0.0), 2),
+                }
+            lanes = {
+                lane: {
+                    "requests": counts["requests"],
+                    "rejected": counts["rejected"],
+                    "retries": counts["retries"],
+                    "wait_seconds_p50": percentile(self._lane_waits[lane], 0.5),
+                    "wait_seconds_p95": percentile(self._lane_waits[lane], 0.95),
+                }
+                for lane, counts in self._lane_counts.items()
+            }
+            return {
+                "models": models,
+                "lanes": lanes,
+                "upstream_errors": dict(self._upstream_errors),
+            }
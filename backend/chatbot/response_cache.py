@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# memory — в памяти процесса, sqlite — на диске (переживает рестарт), off — выключен
+CHAT_CACHE_BACKEND = os.environ.get("CHAT_CACHE_BACKEND", "memory")
+CHAT_CACHE_SQLITE_PATH = os.environ.get("CHAT_CACHE_SQLITE_PATH", "cache/chat_cache.sqlite3")
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Стабильный ключ кеша: sha256 от JSON-представления частей ключа.
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Базовый кеш ответов: TTL, ограничение размера (LRU) и счётчики попаданий.
+    Значения — JSON-сериализуемые dict.
+    """
+
+    backend = "base"
+
+    def __init__(self, name: str, ttl_seconds: int, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self._get(key)
+        with self._counter_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        evicted = self._set(key, value, time.time() + self.ttl_seconds)
+        if evicted:
+            with self._counter_lock:
+                self.evictions += evicted
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "size": self.size(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: dict, expires_at: float) -> int:
+        raise NotImplementedError
+
+    def size(self) -> int:
+        raise NotImplementedError
+
+
+class DisabledCache(ResponseCache):
+    backend = "off"
+
+    def _get(self, key: str) -> Optional[dict]:
+        return None
+
+    def _set(self, key: str, value: dict, expires_at: float) -> int:
+        return 0
+
+    def size(self) -> int:
+        return 0
+
+
+class MemoryCache(ResponseCache):
+    backend = "memory"
+
+    def __init__(self, name: str, ttl_seconds: int, max_entries: int):
+        super().__init__(name, ttl_seconds, max_entries)
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: dict, expires_at: float) -> int:
+        evicted = 0
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def size(self) -> int:
+        return len(self._items)
+
+
+class SqliteCache(ResponseCache):
+    """
+    Кеш на диске: переживает перезапуски сервиса. Несколько кешей могут жить
+    в одном файле — записи разделяются по namespace (= имя кеша).
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, name: str, ttl_seconds: int, max_entries: int, path: str):
+        super().__init__(name, ttl_seconds, max_entries)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                namespace   TEXT NOT NULL,
+                key         TEXT NOT NULL,
+                value       TEXT NOT NULL,
+                expires_at  REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS response_cache_lru ON response_cache (namespace, accessed_at)"
+        )
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE namespace = ? AND key = ?",
+                (self.name, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE namespace = ? AND key = ?",
+                    (self.name, key),
+                )
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.name, key),
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: dict, expires_at: float) -> int:
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO response_cache (namespace, key, value, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (self.name, key, payload, expires_at, now),
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE namespace = ? AND expires_at <= ?",
+                (self.name, now),
+            )
+            # Вытесняем самые давно использованные записи сверх лимита.
+            cur = self._conn.execute(
+                """
+                DELETE FROM response_cache
+                WHERE namespace = ? AND key IN (
+                    SELECT key FROM response_cache
+                    WHERE namespace = ?
+                    ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.name, self.name, self.max_entries),
+            )
+            self._conn.commit()
+        return max(cur.rowcount, 0)
+
+    def size(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM response_cache WHERE namespace = ?",
+                (self.name,),
+            ).fetchone()
+        return int(row[0])
+
+
+CACHES: Dict[str, ResponseCache] = {}
+
+
+def build_cache(
+    name: str,
+    backend: str,
+    ttl_seconds: int,
+    max_entries: int,
+    sqlite_path: str,
+) -> ResponseCache:
+    backend = (backend or "memory").strip().lower()
+    if backend == "sqlite":
+        cache: ResponseCache = SqliteCache(name, ttl_seconds, max_entries, sqlite_path)
+    elif backend in ("off", "none", "disabled"):
+        cache = DisabledCache(name, ttl_seconds, max_entries)
+    else:
+        cache = MemoryCache(name, ttl_seconds, max_entries)
+
+    CACHES[name] = cache
+    return cache
+
+
+def cache_stats() -> Dict[str, dict]:
+    return {name: cache.stats() for name, cache in CACHES.items()}
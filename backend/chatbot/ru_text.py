@@ -0,0 +1,131 @@
+import re
+from typing import List
+
+# Общие утилиты для работы с русским текстом: нормализация, токенизация,
+# стоп-слова и стемминг (упрощённая реализация алгоритма Snowball для русского).
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+RUSSIAN_STOPWORDS = frozenset(
+    """
+    а алло без более больше будем будет будете будешь буду будут будь бы был была были было быть
+    в вам вами вас ваш ваша ваше ваши вдруг ведь во вот впрочем все всё всегда всего всех всю вы
+    где да даже два для до другой его ее её ей ему если есть еще ещё же за здесь и из или им ими
+    их к как какая какие каким какой какую когда кто куда ли либо между меня мне много
+    может можно мой моя мы на над надо наш не него нее неё ней нельзя нет ни нибудь никогда ним
+    них ничего но ну о об один он она они оно опять от очень по под после потом потому почему
+    почти при про раз разве с сам сама сами само свое своё свой себе себя сейчас со совсем так
+    такой там тебе тебя теперь то тогда того тоже той только том тот три тут ты у уж уже
+    хоть чего чей чем через что чтобы чтоб чуть эта эти этим этих это этого этой этом этот эту
+    я просто подскажите подскажи скажите скажи пожалуйста расскажи расскажите хочу хотел
+    хотела нужно нужен нужна какое каких каком сделать делать стоит
+    """.split()
+)
+
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND = re.compile(r"(ив|ивши|ившись|ыв|ывши|ывшись|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$"
+)
+_PARTICIPLE = re.compile(r"(ивш|ывш|ующ|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|"
+    r"ить|ыть|ишь|ую|ю|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|"
+    r"ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL = re.compile(r"(ост|ость)$")
+_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+
+def normalize_text(text: str) -> str:
+    return (text or "").lower().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize_text(text))
+
+
+def _rv_start(word: str) -> int:
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _r2_start(word: str) -> int:
+    # R1 — после первой пары «гласная + согласная», R2 — то же внутри R1.
+    start = 0
+    for _ in range(2):
+        i = start
+        while i < len(word) and word[i] not in _VOWELS:
+            i += 1
+        while i < len(word) and word[i] in _VOWELS:
+            i += 1
+        start = min(i + 1, len(word))
+    return start
+
+
+def _cut(pattern: re.Pattern, text: str):
+    m = pattern.search(text)
+    if not m:
+        return text, False
+    return text[: m.start()], True
+
+
+def stem_ru(word: str) -> str:
+    word = normalize_text(word)
+    if len(word) < 3 or not re.fullmatch(r"[а-я]+", word):
+        return word
+
+    rv_start = _rv_start(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратность + прилагательное/глагол/существительное.
+    rv, found = _cut(_PERFECTIVE_GERUND, rv)
+    if not found:
+        rv, _ = _cut(_REFLEXIVE, rv)
+        rv, found = _cut(_ADJECTIVE, rv)
+        if found:
+            rv, _ = _cut(_PARTICIPLE, rv)
+        else:
+            rv, found = _cut(_VERB, rv)
+            if not found:
+                rv, _ = _cut(_NOUN, rv)
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс только в R2.
+    r2_in_rv = max(_r2_start(word) - rv_start, 0)
+    m = _DERIVATIONAL.search(rv)
+    if m and m.start() >= r2_in_rv:
+        rv = rv[: m.start()]
+
+    # Шаг 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        rv, found = _cut(_SUPERLATIVE, rv)
+        if found and rv.endswith("нн"):
+            rv = rv[:-1]
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def content_stems(text: str) -> List[str]:
+    """
+    Значимые слова текста в виде основ: без стоп-слов и однобуквенных токенов.
+    """
+    return [
+        stem_ru(token)
+        for token in tokenize(text)
+        if token not in RUSSIAN_STOPWORDS and len(token) > 1
+    ]
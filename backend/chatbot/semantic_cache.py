@@ -0,0 +1,197 @@
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from ru_text import content_stems, stem_ru
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Перефразы ловятся нормализацией, а не похожестью написания: основы слов из
+# одной группы сводятся к одному понятию, и «как улучшить сон» / «как лучше
+# спать» дают одинаковый набор {улучшить, сон}. Символьные n-граммы для этого
+# не годились: они сближают однокоренные слова, но не синонимы, и при этом
+# склеивают вопросы с разными уточнениями. Словарь покрывает частые темы
+# wellness-вопросов; слова вне его сравниваются по основе. Уточнение
+# («кофе при беременности» и просто «кофе») добавляет понятие и роняет
+# похожесть ниже порога — такие вопросы не считаются одинаковыми.
+# Понятие -> словоформы (сравниваются основы stem_ru, поэтому форм немного).
+SYNONYM_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "сон": ("сон", "сна", "сну", "сном", "спать", "сплю", "спит", "спится", "высыпаться", "выспаться"),
+    "засыпание": ("уснуть", "заснуть", "засыпать", "засыпаю", "засыпание"),
+    "бессонница": ("бессонница",),
+    "улучшить": ("улучшить", "улучшать", "улучшение", "лучше", "наладить", "налаживать", "нормализовать"),
+    "похудеть": ("похудеть", "похудение", "худеть", "сбросить"),
+    "стресс": ("стресс", "нервы", "нервничать", "напряжение"),
+    "тревога": ("тревога", "тревожность", "беспокойство"),
+    "усталость": ("усталость", "устаю", "уставать", "утомляемость"),
+    "энергия": ("энергия", "бодрость"),
+    "вред": ("вред", "вредно", "вреден", "опасно"),
+    "польза": ("польза", "полезно", "полезен"),
+    "тренировка": ("тренировка", "тренировки", "тренироваться", "упражнение", "упражнения"),
+    "бег": ("бег", "бегать", "пробежка"),
+    "ходьба": ("ходьба", "ходить", "прогулка", "шаги"),
+    "ночь": ("ночь", "ночью", "ночной"),
+    "питание": ("питание", "рацион", "еда"),
+}
+
+# Основа -> понятие.
+CONCEPTS: Dict[str, str] = {
+    stem_ru(word): concept for concept, words in SYNONYM_GROUPS.items() for word in words
+}
+
+
+def question_terms(text: str) -> FrozenSet[str]:
+    """Понятия вопроса: основы значимых слов, синонимы сведены к одному понятию."""
+    return frozenset(CONCEPTS.get(stem, stem) for stem in content_stems(text))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [
+            (rnd.randrange(1, _MERSENNE_PRIME), rnd.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, terms: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+            for s in terms
+        ]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._params
+        )
+
+
+class SemanticCache:
+    """
+    Кеш ответов на похожие (не только идентичные) вопросы.
+    Кандидаты ищутся через MinHash LSH, итоговая похожесть — точный Jaccard
+    по понятиям вопроса (question_terms).
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        ttl_seconds: int,
+        max_entries: int,
+        bands: int = 16,
+        rows: int = 4,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = rows
+        self.hits = 0
+        self.misses = 0
+
+        self._hasher = MinHasher(bands * rows)
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[tuple]:
+        return [
+            (scope, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for key in entry["band_keys"]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def lookup(self, scope: str, question: str) -> Optional[Tuple[dict, float, str]]:
+        """
+        Возвращает (значение, похожесть, исходный вопрос) лучшего совпадения
+        выше порога, иначе None.
+        """
+        terms = question_terms(question)
+        if not terms:
+            return None
+        band_keys = self._band_keys(scope, self._hasher.signature(terms))
+
+        now = time.time()
+        best: Optional[Tuple[float, int]] = None
+        with self._lock:
+            candidates: Set[int] = set()
+            for key in band_keys:
+                candidates |= self._buckets.get(key, set())
+
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry["expires_at"] <= now:
+                    self._remove(entry_id)
+                    continue
+                score = jaccard(terms, entry["terms"])
+                if best is None or score > best[0]:
+                    best = (score, entry_id)
+
+            if best is None or best[0] < self.threshold:
+                self.misses += 1
+                if best is not None:
+                    print(
+                        f"Semantic cache miss: best_similarity={best[0]:.3f} "
+                        f"threshold={self.threshold} question={question[:80]!r}"
+                    )
+                return None
+
+            self.hits += 1
+            entry = self._entries[best[1]]
+            self._entries.move_to_end(best[1])
+
+        print(
+            f"Semantic cache hit: similarity={best[0]:.3f} threshold={self.threshold} "
+            f"question={question[:80]!r} matched={entry['question'][:80]!r}"
+        )
+        return entry["value"], best[0], entry["question"]
+
+    def store(self, scope: str, question: str, value: dict) -> None:
+        terms = question_terms(question)
+        if not terms:
+            return
+        band_keys = self._band_keys(scope, self._hasher.signature(terms))
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "question": question,
+                "terms": terms,
+                "band_keys": band_keys,
+                "value": value,
+                "expires_at": time.time() + self.ttl_seconds,
+            }
+            for key in band_keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
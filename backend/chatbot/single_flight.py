@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+# Single-flight: одинаковые запросы, пришедшие одновременно, делят один вызов
+# к модели. Первый («ведущий») выполняет работу, остальные ждут его результат
+# или его исключение. Ключ — тот же нормализованный ключ, что и у кеша ответов:
+# кеш помогает после завершения вызова, single-flight — пока вызов ещё идёт.
+# Синхронные (threadpool) и асинхронные вызовы коалесцируются раздельно.
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        # (loop, ключ) -> задача: задачу можно ждать только из её собственного loop.
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._waiters: Dict[Tuple[int, str], int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отмена одного ожидающего (клиент ушёл) не отменяет вызов для остальных.
+        # Когда уходит последний ожидающий, вызов отменяется — ответ больше никому не нужен.
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                self.cancelled += 1
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _forget(self, key: Tuple[int, str], task: asyncio.Task) -> None:
+        self._tasks.pop(key, None)
+        # Забираем исключение, даже если все ожидающие уже ушли.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+        total = self.leaders + self.coalesced
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+            "cancelled": self.cancelled,
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+FLIGHTS: Dict[str, SingleFlight] = {}
+
+
+def build_single_flight(name: str) -> SingleFlight:
+    flight = SingleFlight(name)
+    FLIGHTS[name] = flight
+    return flight
+
+
+def single_flight_stats() -> dict:
+    return {name: flight.stats() for name, flight in FLIGHTS.items()}
@@ -0,0 +1,28 @@
+import json
+import os
+import sys
+import tempfile
+
+# Тесты идут без сети и без базы: все LLM-эндпоинты переведены на заглушку,
+# кеши и фоновые пулы выключены. Окружение задаётся до импорта модулей сервиса —
+# они читают настройки при импорте.
+for name in ("GROQ_API_KEY", "DATABASE_URL"):
+    os.environ.pop(name, None)
+os.environ.update(
+    {
+        "CHAT_LLM_BACKENDS": json.dumps({"stub": {"kind": "stub", "model": "stub-model"}}),
+        "CHAT_LLM_BACKEND_CHAT": "stub",
+        "CHAT_LLM_BACKEND_SUMMARY": "stub",
+        "CHAT_LLM_BACKEND_TITLE": "stub",
+        "CHAT_LLM_BACKEND_MODERATION": "stub",
+        "CHAT_CACHE_BACKEND": "off",
+        "CHAT_HTTP_WARMUP": "false",
+        "CHAT_VERIFICATION_STORE_BACKEND": "off",
+        "CHAT_DOC_PROCESS_WORKERS": "0",
+        "JWT_SECRET": "chatbot-tests-jwt-secret-0123456789abcdef",
+    }
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Сервис пишет uploads/ и cache/ относительно рабочего каталога — не в дерево репозитория.
+os.chdir(tempfile.mkdtemp(prefix="chatbot-tests-"))
@@ -0,0 +1,178 @@
+import json
+from datetime import datetime
+
+from article_index import ArticleIndex, ArticleIndexUpdater, split_passages, sync_from_database, sync_from_json
+
+SLEEP = {
+    "slug": "son",
+    "title": "Как наладить сон",
+    "annotation": "Режим и вечерние привычки помогают быстрее засыпать.",
+    "content": [
+        {"type": "heading", "text": "Режим"},
+        {"type": "paragraph", "text": "Ложитесь и вставайте в одно и то же время, даже в выходные."},
+        {"type": "heading", "text": "Кофеин"},
+        {"type": "paragraph", "text": "Кофе после обеда мешает уснуть: кофеин действует до восьми часов."},
+    ],
+}
+WATER = {
+    "slug": "voda",
+    "title": "Сколько пить воды",
+    "annotation": "Потребность в воде зависит от веса и нагрузки.",
+    "content": [{"type": "list", "items": ["Пейте воду при жажде", "Летом воды нужно больше"]}],
+}
+RUNNING = {
+    "slug": "beg",
+    "title": "Бег для начинающих",
+    "annotation": "Начинайте с чередования ходьбы и бега.",
+    "content": "Первые недели бегайте по двадцать минут.\n\nРастяжка после пробежки обязательна.",
+}
+
+
+def index_with(*articles) -> ArticleIndex:
+    index = ArticleIndex(passage_chars=800)
+    for article in articles:
+        index.upsert(article["slug"], "v1", article)
+    return index
+
+
+def test_passages_split_by_headings():
+    assert split_passages(SLEEP, 800) == [
+        SLEEP["annotation"],
+        "Режим\nЛожитесь и вставайте в одно и то же время, даже в выходные.",
+        "Кофеин\nКофе после обеда мешает уснуть: кофеин действует до восьми часов.",
+    ]
+    assert split_passages(WATER, 800)[1] == "- Пейте воду при жажде\n- Летом воды нужно больше"
+    assert split_passages(RUNNING, 800)[1:] == ["Первые недели бегайте по двадцать минут.\nРастяжка после пробежки обязательна."]
+    # Длинный раздел режется по max_chars.
+    assert len(split_passages(RUNNING, 30)) == 3
+
+
+def test_search_finds_relevant_passage():
+    index = index_with(SLEEP, WATER, RUNNING)
+
+    hits = index.search("можно ли пить кофе вечером", limit=3)
+    assert hits[0].slug == "son"
+    assert hits[0].text.startswith("Кофеин")
+    assert index.search("сколько воды пить летом")[0].slug == "voda"
+    # Слово есть только в заголовке статьи.
+    assert index.search("начинающим")[0].slug == "beg"
+
+
+def test_one_hit_per_article_and_min_score():
+    index = index_with(SLEEP, WATER, RUNNING)
+
+    hits = index.search("сон режим кофеин засыпать", limit=3)
+    assert [hit.slug for hit in hits] == ["son"]
+    assert index.search("кофе", min_score=100.0) == []
+    assert index.search("что это") == []
+    assert index.search("квантовая физика") == []
+
+
+def test_upsert_replaces_and_remove_clears_postings():
+    index = index_with(SLEEP, WATER)
+    index.upsert("son", "v2", dict(SLEEP, content=[{"type": "paragraph", "text": "Про дневной отдых."}]))
+
+    assert not any(hit.slug == "son" for hit in index.search("кофеин"))
+    assert index.search("дневной отдых")[0].slug == "son"
+    assert index.versions() == {"son": "v2", "voda": "v1"}
+
+    index.remove("son")
+    index.remove("voda")
+    stats = index.stats()
+    assert (stats["articles"], stats["passages"], stats["terms"], stats["postings"]) == (0, 0, 0, 0)
+
+
+def write_articles(path, articles):
+    path.write_text(json.dumps(articles, ensure_ascii=False), encoding="utf-8")
+
+
+def test_sync_from_json_updates_only_changes(tmp_path):
+    path = tmp_path / "articles.json"
+    write_articles(path, [SLEEP, WATER, dict(RUNNING, published=False)])
+    index = ArticleIndex()
+
+    assert sync_from_json(index, str(path)) == (2, 0)
+    assert sync_from_json(index, str(path)) == (0, 0)
+
+    write_articles(path, [dict(SLEEP, annotation="Новая аннотация про сон.")])
+    assert sync_from_json(index, str(path)) == (1, 1)
+    assert set(index.versions()) == {"son"}
+
+
+class FakeArticles:
+    """Таблица Article для запросов sync_from_database."""
+
+    def __init__(self, rows):
+        self.rows = rows  # id -> (slug, title, annotation, content, updatedAt)
+        self.fetched = []
+
+    def connect(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if params is None:
+            self.result = [(article_id, row[4]) for article_id, row in self.rows.items()]
+        else:
+            self.fetched.append(sorted(params[0]))
+            self.result = [(article_id, *self.rows[article_id]) for article_id in params[0]]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def article_row(article, updated_at):
+    return (article["slug"], article["title"], article["annotation"], article["content"], updated_at)
+
+
+def test_sync_from_database_fetches_changed_rows():
+    first = datetime(2026, 4, 1)
+    db = FakeArticles({"1": article_row(SLEEP, first), "2": article_row(WATER, first)})
+    index = ArticleIndex()
+
+    assert sync_from_database(index, db.connect) == (2, 0)
+    db.rows["2"] = article_row(dict(WATER, title="Вода летом"), datetime(2026, 4, 2))
+    del db.rows["1"]
+    assert sync_from_database(index, db.connect) == (1, 1)
+
+    assert db.fetched == [["1", "2"], ["2"]]
+    hit = index.search("вода летом")[0]
+    assert (hit.article_id, hit.title) == ("2", "Вода летом")
+
+
+def test_updater_falls_back_to_json_only_when_empty(tmp_path):
+    path = tmp_path / "articles.json"
+    write_articles(path, [SLEEP])
+    db = FakeArticles({"1": article_row(WATER, datetime(2026, 4, 1))})
+    available = {"db": False}
+
+    def connect():
+        if not available["db"]:
+            raise ConnectionError("db down")
+        return db
+
+    updater = ArticleIndexUpdater(ArticleIndex(), str(path), get_connection=connect, refresh_seconds=0)
+    updater.sync()
+    assert updater.source == "json" and set(updater.index.versions()) == {"son"}
+
+    # База поднялась: индекс строится заново по id статей.
+    available["db"] = True
+    updater.sync()
+    assert updater.source == "database" and set(updater.index.versions()) == {"1"}
+
+    # База снова недоступна: остаётся индекс из базы, articles.json не подмешивается.
+    available["db"] = False
+    updater.sync()
+    assert updater.source == "database" and set(updater.index.versions()) == {"1"}
+    assert updater.stats()["last_error"] == "ConnectionError('db down')"
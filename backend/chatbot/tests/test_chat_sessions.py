@@ -0,0 +1,245 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+import chat_app
+from chat_sessions import ChatSession, SessionStore, append_chat_messages, load_chat_messages
+
+INTERVAL_MS = {"microsecond": 0.001, "millisecond": 1.0, "second": 1000.0}
+
+
+class FakeDatabase:
+    """
+    Таблицы Chat и ChatMessage в памяти — ровно для запросов chat_sessions.
+    createdAt хранится в миллисекундах, как TIMESTAMP(3) в Postgres.
+    """
+
+    def __init__(self, chats):
+        self.chats = dict(chats)  # chat_id -> userId
+        self.messages = []  # dict(id, chatId, role, text, createdAt)
+        self.updated = {}
+        self.commits = 0
+        self.clock_ms = 1_700_000_000_000
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+    def add(self, chat_id, role, text):
+        # Сообщение, записанное мимо сервиса (например, Node-бэкендом).
+        self.clock_ms += 1000
+        self.messages.append({"id": f"ext-{len(self.messages)}", "chatId": chat_id, "role": role, "text": text, "createdAt": self.clock_ms})
+
+    def owns(self, chat_id, user_id):
+        return self.chats.get(chat_id) == user_id
+
+    def rows(self, chat_id):
+        # Node-контроллер сортирует только по createdAt.
+        ordered = sorted((m for m in self.messages if m["chatId"] == chat_id), key=lambda m: m["createdAt"])
+        return [(m["role"], m["text"]) for m in ordered]
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        query = " ".join(query.split())
+        if query.startswith('SELECT 1 FROM "Chat"'):
+            self.result = [(1,)] if self.db.owns(*params) else []
+        elif query.startswith("SELECT COUNT(*)"):
+            owned = self.db.owns(*params)
+            self.result = [(sum(owned and m["chatId"] == params[0] for m in self.db.messages),)]
+        elif query.startswith("SELECT role, text"):
+            ordered = sorted(
+                (m for m in self.db.messages if m["chatId"] == params[0]), key=lambda m: (m["createdAt"], m["id"])
+            )
+            self.result = [(m["role"], m["text"]) for m in ordered]
+        elif query.startswith('INSERT INTO "ChatMessage"'):
+            message_id, chat_id, role, text, step = params
+            unit = re.search(r"interval '1 (\w+)'", query).group(1)
+            if step == 0:
+                # now() — время транзакции: общее для всех строк одного append.
+                self.db.clock_ms += 1000
+            created_at = round(self.db.clock_ms + step * INTERVAL_MS[unit])
+            self.db.messages.append({"id": message_id, "chatId": chat_id, "role": role, "text": text, "createdAt": created_at})
+        elif query.startswith('UPDATE "Chat"'):
+            self.rowcount = int(self.db.owns(*params))
+            if self.rowcount:
+                self.db.updated[params[0]] = self.db.clock_ms
+        else:
+            raise AssertionError(f"unexpected query: {query}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase({"chat-1": 1, "chat-2": 1, "chat-3": 2})
+    monkeypatch.setattr(chat_app, "session_db", database.connection)
+    monkeypatch.setattr(chat_app, "chat_sessions", SessionStore(max_entries=100, ttl_seconds=3600))
+    return database
+
+
+def auth(user_id=1, secret=os.environ["JWT_SECRET"]):
+    return {"Authorization": "Bearer " + jwt.encode({"userId": user_id, "email": "u@example.org"}, secret)}
+
+
+@pytest.fixture
+def client():
+    with TestClient(chat_app.app) as test_client:
+        yield test_client
+
+
+# ---------- ChatMessage ----------
+
+
+def test_appended_messages_keep_order():
+    db = FakeDatabase({"chat-1": 1})
+    assert append_chat_messages(db.connection, "chat-1", 1, [("user", "вопрос"), ("assistant", "ответ")])
+
+    created = [m["createdAt"] for m in db.messages]
+    assert created[0] < created[1]
+    assert db.rows("chat-1") == [("user", "вопрос"), ("assistant", "ответ")]
+    assert "chat-1" in db.updated
+    assert db.commits == 1
+
+
+def test_load_missing_chat():
+    db = FakeDatabase({"chat-1": 1})
+    assert load_chat_messages(db.connection, "chat-1", 1) == []
+    assert load_chat_messages(db.connection, "nope", 1) is None
+
+
+def test_foreign_chat_not_accessible():
+    db = FakeDatabase({"chat-1": 1})
+    assert load_chat_messages(db.connection, "chat-1", 2) is None
+    assert not append_chat_messages(db.connection, "chat-1", 2, [("user", "вопрос")])
+    assert db.messages == [] and db.commits == 0
+
+
+# ---------- SessionStore ----------
+
+
+def test_session_store_evicts_oldest():
+    store = SessionStore(max_entries=2, ttl_seconds=3600)
+    for chat_id in ("a", "b"):
+        store.put(ChatSession(chat_id))
+    store.get("a")
+    store.put(ChatSession("c"))
+
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_session_store_expires_idle():
+    store = SessionStore(max_entries=10, ttl_seconds=60)
+    session = ChatSession("a")
+    store.put(session)
+    session.touched = time.monotonic() - 61
+
+    assert store.get("a") is None
+    assert store.stats()["sessions"] == 0
+
+
+# ---------- /chat/session ----------
+
+
+def test_session_round_trip(db, client):
+    db.add("chat-1", "user", "Привет")
+    db.add("chat-1", "assistant", "Здравствуйте! Чем помочь?")
+
+    first = client.post("/chat/session", headers=auth(), json={"chat_id": "chat-1", "message": "Как быстрее уснуть"})
+    assert first.status_code == 200
+    assert first.json()["answer"] == "Как быстрее уснуть"
+
+    second = client.post("/chat/session", headers=auth(), json={"chat_id": "chat-1", "message": "А если пить кофе вечером"})
+    assert second.status_code == 200
+
+    assert db.rows("chat-1") == [
+        ("user", "Привет"),
+        ("assistant", "Здравствуйте! Чем помочь?"),
+        ("user", "Как быстрее уснуть"),
+        ("assistant", "Как быстрее уснуть"),
+        ("user", "А если пить кофе вечером"),
+        ("assistant", "А если пить кофе вечером"),
+    ]
+    session = chat_app.chat_sessions.get("chat-1")
+    assert session.stored_count == 6
+    assert [m.content for m in session.recent][-2:] == ["А если пить кофе вечером", "А если пить кофе вечером"]
+
+
+def test_session_reloaded_after_external_write(db, client):
+    client.post("/chat/session", headers=auth(), json={"chat_id": "chat-2", "message": "Сколько ходить в день"})
+    db.add("chat-2", "user", "Записано другим воркером")
+    db.add("chat-2", "assistant", "Ответ другого воркера")
+
+    stale = chat_app.chat_session_stats["stale"]
+    resp = client.post("/chat/session", headers=auth(), json={"chat_id": "chat-2", "message": "А бегать"})
+
+    assert resp.status_code == 200
+    assert chat_app.chat_session_stats["stale"] == stale + 1
+    session = chat_app.chat_sessions.get("chat-2")
+    assert session.stored_count == 6
+    assert "Ответ другого воркера" in [m.content for m in session.recent]
+
+
+def test_session_for_missing_chat(db, client):
+    resp = client.post("/chat/session", headers=auth(), json={"chat_id": "nope", "message": "Привет"})
+    assert resp.status_code == 404
+    assert db.messages == []
+
+
+def test_session_requires_token(db, client):
+    body = {"chat_id": "chat-1", "message": "Привет"}
+    assert client.post("/chat/session", json=body).status_code == 401
+    assert client.post("/chat/session", headers=auth(secret="other-secret-" + "x" * 32), json=body).status_code == 401
+    assert db.messages == []
+
+
+def test_session_of_other_user(db, client):
+    # chat-3 принадлежит пользователю 2.
+    resp = client.post("/chat/session", headers=auth(user_id=1), json={"chat_id": "chat-3", "message": "Привет"})
+    assert resp.status_code == 404
+
+    own = client.post("/chat/session", headers=auth(user_id=2), json={"chat_id": "chat-3", "message": "Привет"})
+    assert own.status_code == 200
+    # Сессия уже в памяти — чужой пользователь всё равно получает 404.
+    again = client.post("/chat/session", headers=auth(user_id=1), json={"chat_id": "chat-3", "message": "Привет"})
+    assert again.status_code == 404
+    assert db.rows("chat-3") == [("user", "Привет"), ("assistant", "Привет")]
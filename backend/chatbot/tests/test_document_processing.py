@@ -0,0 +1,189 @@
+import asyncio
+import base64
+import random
+from io import BytesIO
+
+import fitz
+import pytest
+from PIL import Image
+
+import document_processing
+from document_processing import (
+    DocumentError,
+    encode_page,
+    process_image,
+    process_pdf,
+    run_document_job,
+    score_text_layer,
+)
+
+
+def make_pdf(pages) -> bytes:
+    doc = fitz.open()
+    for html in pages:
+        page = doc.new_page()
+        page.insert_htmlbox(fitz.Rect(50, 50, 550, 800), html)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def noise_png(size=(600, 600)) -> bytes:
+    # Шум почти не сжимается — как скан или фото.
+    image = Image.frombytes("RGB", size, random.Random(1).randbytes(size[0] * size[1] * 3))
+    out = BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def scanned_page():
+    doc = fitz.open()
+    page = doc.new_page(width=300, height=420)
+    page.insert_image(page.rect, stream=noise_png())
+    return doc, page
+
+
+def test_pdf_text_from_all_pages_rendered_up_to_limit(tmp_path):
+    data = make_pdf([f"<p>Страница {n}</p>" for n in range(1, 6)])
+    path = tmp_path / "diploma.pdf"
+    path.write_bytes(data)
+
+    from_bytes = process_pdf(data, max_pages=3)
+    from_path = process_pdf(str(path), max_pages=3)
+
+    assert from_bytes.text == from_path.text
+    assert [f"Страница {n}" in from_bytes.text for n in range(1, 6)] == [True] * 5
+    assert from_bytes.full_path_pages == 3
+    assert len(from_bytes.image_data_urls) == len(from_bytes.renders) == 3
+    assert from_bytes.payload_bytes == sum(render["bytes"] for render in from_bytes.renders)
+    assert from_bytes.path == "vision" and from_bytes.image_detail == "high"
+
+
+def test_pdf_text_truncated(monkeypatch):
+    monkeypatch.setattr(document_processing, "DOC_MAX_TEXT_CHARS", 50)
+    result = process_pdf(make_pdf(["<p>" + "диплом " * 100 + "</p>"]))
+    assert len(result.text) == 50
+
+
+def test_text_page_encoded_as_png():
+    doc = fitz.open(stream=make_pdf(["<p>Диплом о высшем образовании</p>"]), filetype="pdf")
+    data, mime, info = encode_page(doc.load_page(0), 600 * 1024)
+
+    assert mime == "image/png"
+    assert info == {"zoom": 2.0, "format": "png", "quality": None}
+    assert len(data) <= 600 * 1024
+
+
+def test_scanned_page_encoded_as_jpeg_within_target():
+    doc, page = scanned_page()
+    data, mime, info = encode_page(page, 100 * 1024)
+
+    assert mime == "image/jpeg" and info["format"] == "jpeg"
+    assert len(data) <= 100 * 1024
+    doc.close()
+
+
+def test_smallest_render_when_target_unreachable():
+    doc, page = scanned_page()
+    data, mime, info = encode_page(page, 1)
+
+    # Самый компактный вариант: меньший масштаб и худшее качество.
+    assert mime == "image/jpeg"
+    assert (info["zoom"], info["quality"]) == (1.0, 55)
+    doc.close()
+
+
+def test_document_job_runs_off_event_loop():
+    async def run():
+        return await run_document_job(process_pdf, make_pdf(["<p>Диплом</p>"]), 1)
+
+    assert document_processing.get_document_pool() is None
+    result = asyncio.run(run())
+    assert "Диплом" in result.text
+
+
+# ---------- текстовый слой ----------
+
+DIPLOMA_HTML = (
+    "<p>ДИПЛОМ о высшем образовании. Настоящий диплом выдан Иванову Петру Сергеевичу "
+    "в том, что он освоил программу специалитета по специальности «Лечебное дело» "
+    "и успешно прошёл государственную итоговую аттестацию. Решением государственной "
+    "экзаменационной комиссии присвоена квалификация врач-лечебник. "
+    "Московский государственный медицинский университет.</p>"
+)
+EXPECTED = {"first_name": "Петр", "last_name": "Иванов", "education_description": "Лечебное дело, врач-лечебник"}
+
+
+def test_text_layer_score():
+    text = fitz.open(stream=make_pdf([DIPLOMA_HTML]), filetype="pdf").load_page(0).get_text()
+
+    strong = score_text_layer(text, **EXPECTED)
+    assert strong["name_match"] and strong["institution_match"]
+    assert strong["score"] >= document_processing.TEXT_LAYER_MIN_SCORE
+
+    weak = score_text_layer(text, first_name="Анна", last_name="Смирнова", education_description="Психология")
+    assert not weak["name_match"]
+    assert weak["score"] < document_processing.TEXT_LAYER_MIN_SCORE
+
+
+def test_strong_text_layer_sends_one_low_detail_page():
+    data = make_pdf([DIPLOMA_HTML, "<p>Приложение к диплому</p>", "<p>Оценки</p>"])
+
+    fast = process_pdf(data, max_pages=3, expected=EXPECTED)
+    assert fast.path == "text_layer" and fast.image_detail == "low"
+    assert len(fast.image_data_urls) == 1 and fast.full_path_pages == 3
+    assert fast.renders[0]["zoom"] in document_processing.TEXT_LAYER_ZOOMS
+    assert fast.payload_bytes <= document_processing.TEXT_LAYER_PAGE_BYTES
+
+    other = dict(EXPECTED, first_name="Анна", last_name="Смирнова")
+    full = process_pdf(data, max_pages=3, expected=other)
+    assert full.path == "vision" and len(full.image_data_urls) == 3
+    assert full.text_layer["name_match"] is False
+
+
+def test_fast_path_disabled(monkeypatch):
+    monkeypatch.setattr(document_processing, "TEXT_LAYER_FAST_PATH", False)
+    result = process_pdf(make_pdf([DIPLOMA_HTML]), expected=EXPECTED)
+    assert result.path == "vision" and result.text_layer is None
+
+
+# ---------- фото документов ----------
+
+
+def encoded_image(data_url: str) -> Image.Image:
+    assert data_url.startswith("data:image/jpeg;base64,")
+    return Image.open(BytesIO(base64.b64decode(data_url.split(",", 1)[1])))
+
+
+def test_photo_downscaled_rotated_and_stripped():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: повернуть на 90° по часовой
+    exif[0x0110] = "Телефон"  # Model
+    out = BytesIO()
+    Image.new("RGB", (3000, 1500), (200, 180, 160)).save(out, format="JPEG", exif=exif)
+    source = out.getvalue()
+
+    result = process_image(source, max_long_edge=1000)
+
+    image = encoded_image(result.image_data_urls[0])
+    assert image.size == (500, 1000)
+    assert not image.getexif()
+    assert result.path == "image" and result.source_bytes == len(source)
+    assert result.renders[0]["width"] == 500 and result.payload_bytes == result.renders[0]["bytes"]
+
+
+def test_transparent_png_on_white(tmp_path):
+    path = tmp_path / "scan.png"
+    Image.new("RGBA", (100, 50), (0, 0, 0, 0)).save(path)
+
+    result = process_image(str(path))
+
+    image = encoded_image(result.image_data_urls[0])
+    assert image.size == (100, 50)
+    assert min(image.getpixel((10, 10))) > 240
+    assert result.source_bytes == path.stat().st_size
+
+
+def test_broken_image_rejected():
+    with pytest.raises(DocumentError):
+        process_image(b"not an image")
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+from hedging import HedgedChain, model_latency, model_latency_stats
+from rate_governor import RateGovernor
+
+
+def governor() -> RateGovernor:
+    return RateGovernor(default_rpm=600, default_tpm=10**6)
+
+
+def chain(name: str, models, **kwargs) -> HedgedChain:
+    options = {"default_delay": 0.05, "min_delay": 0.01}
+    options.update(kwargs)
+    return HedgedChain(name, models, **options)
+
+
+def upstream_call(gov: RateGovernor, latencies: dict, calls: list):
+    """fn для цепочки: вызов через регулятор с заданной задержкой ответа модели."""
+
+    def fn(model: str):
+        async def request():
+            calls.append(model)
+            await asyncio.sleep(latencies[model])
+            return f"ответ {model}"
+
+        return gov.acall("chat", model, 10, request)
+
+    return fn
+
+
+def test_fast_primary_not_hedged():
+    calls = []
+    result = asyncio.run(chain("t-fast", ["a", "b"]).call(upstream_call(governor(), {"a": 0.0, "b": 0.0}, calls)))
+    assert result == ("ответ a", "a")
+    assert calls == ["a"]
+
+
+def test_slow_primary_hedged_and_cancelled():
+    calls = []
+    discarded = []
+
+    async def discard(value):
+        discarded.append(value)
+
+    async def run():
+        fn = upstream_call(governor(), {"a": 0.5, "b": 0.01}, calls)
+        result = await chain("t-slow", ["a", "b"]).call(fn, discard=discard)
+        await asyncio.sleep(0.01)
+        return result
+
+    assert asyncio.run(run()) == ("ответ b", "b")
+    assert calls == ["a", "b"]
+    stats = model_latency_stats()["t-slow"]["full"]
+    assert stats["b"]["hedges"] == 1 and stats["b"]["wins"] == 1
+    # Проигравший отменён на лету: его время учтено в пороге как «не меньше».
+    assert stats["a"]["cancelled"] == 1
+    assert discarded == []
+
+
+def test_no_hedge_while_primary_queued():
+    gov = governor()
+    # Ведро запросов пусто: первая попытка ждёт разрешения около 0.1 с.
+    state = gov._state("a")
+    state.requests.level = 0.0
+    state.requests.updated = time.monotonic()
+    calls = []
+
+    result = asyncio.run(chain("t-queued", ["a", "b"]).call(upstream_call(gov, {"a": 0.01, "b": 0.01}, calls)))
+
+    assert result == ("ответ a", "a")
+    assert calls == ["a"]
+    assert model_latency[("t-queued", "full", "b")].hedges == 0
+
+
+def test_hedge_counted_from_attempt_start():
+    gov = governor()
+    state = gov._state("a")
+    state.requests.level = 0.0
+    state.requests.updated = time.monotonic()
+    calls = []
+
+    async def run():
+        started = time.monotonic()
+        result = await chain("t-after-queue", ["a", "b"]).call(upstream_call(gov, {"a": 1.0, "b": 0.0}, calls))
+        return result, time.monotonic() - started
+
+    (result, model), elapsed = asyncio.run(run())
+    assert model == "b"
+    # Очередь ~0.1 с + порог 0.05 с от начала попытки.
+    assert elapsed >= 0.14
+
+
+def test_fallback_on_error():
+    calls = []
+
+    def fn(model: str):
+        async def request():
+            calls.append(model)
+            if model == "a":
+                raise ValueError("bad request")
+            return "ответ b"
+
+        return governor().acall("chat", model, 10, request)
+
+    result = asyncio.run(chain("t-fallback", ["a", "b"], hedge=False).call(fn))
+    assert result == ("ответ b", "b")
+    assert model_latency[("t-fallback", "full", "a")].errors == 1
+
+
+def test_all_models_failed():
+    async def fn(model: str):
+        raise ValueError(model)
+
+    with pytest.raises(ValueError, match="b"):
+        asyncio.run(chain("t-failed", ["a", "b"], hedge=False).call(fn))
+
+
+def test_latency_keyed_by_chain_and_mode():
+    calls = []
+    fn = upstream_call(governor(), {"a": 0.0}, calls)
+    asyncio.run(chain("t-keys", ["a"]).call(fn))
+    asyncio.run(chain("t-keys", ["a"]).call(fn, mode="stream"))
+
+    stats = model_latency_stats()["t-keys"]
+    assert set(stats) == {"full", "stream"}
+    assert stats["full"]["a"]["count"] == stats["stream"]["a"]["count"] == 1
+
+
+def test_duplicate_models_removed():
+    assert HedgedChain("t-dup", ["a", "b", "a", None, ""]).models == ["a", "b"]
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from llm_backends import LLMBackend, StubClient, StubStream, build_llm_backends, select_backends
+from rate_governor import RateGovernor
+
+
+def governor_factory(rpm: int, tpm: int) -> RateGovernor:
+    return RateGovernor(default_rpm=rpm, default_tpm=tpm)
+
+
+def groq_backend() -> LLMBackend:
+    # Без ключа клиентов Groq нет — как в dev без GROQ_API_KEY.
+    return LLMBackend("groq", "groq", None, None, governor_factory(30, 6000), missing_detail="GROQ_API_KEY не задан")
+
+
+# ---------- РЕЕСТР ----------
+
+
+def test_endpoints_routed_to_configured_backends():
+    backends = build_llm_backends(
+        {"local": {"kind": "openai", "base_url": "http://127.0.0.1:8080/v1/", "model": "qwen"}, "test": {"kind": "stub"}},
+        groq=groq_backend(),
+        governor_factory=governor_factory,
+    )
+    routes = select_backends(backends, {"chat": "groq", "title": "local", "moderation": "test"})
+
+    assert routes["chat"] is backends["groq"]
+    assert not routes["chat"].available
+    assert routes["chat"].missing_detail == "GROQ_API_KEY не задан"
+    assert routes["title"].kind == "openai"
+    assert routes["title"].model_for("llama-3.1-8b-instant") == "qwen"
+    assert str(routes["title"].client.base_url).rstrip("/") == "http://127.0.0.1:8080/v1"
+    assert routes["moderation"].kind == "stub"
+    assert routes["moderation"].available
+    assert routes["moderation"].model_for("llama-3.1-8b-instant") == "stub"
+    # У каждого бэкенда свой регулятор: локальный сервер не тратит лимиты Groq.
+    assert routes["title"].governor is not routes["chat"].governor
+
+
+def test_api_key_read_from_env():
+    backends = build_llm_backends(
+        {"local": {"kind": "openai", "base_url": "http://127.0.0.1:8080/v1", "model": "qwen", "api_key_env": "LOCAL_KEY"}},
+        groq=groq_backend(),
+        governor_factory=governor_factory,
+        env={"LOCAL_KEY": "secret"},
+    )
+    assert backends["local"].client.api_key == "secret"
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        ({"x": {"kind": "anthropic"}}, "неизвестный kind"),
+        ({"x": {"kind": "openai", "model": "qwen"}}, "не задан base_url"),
+        ({"x": {"kind": "openai", "base_url": "http://127.0.0.1:8080/v1"}}, "не задан model"),
+        ({"groq": {"kind": "stub"}}, "имя groq занято"),
+    ],
+)
+def test_invalid_backend_config(config, message):
+    with pytest.raises(ValueError, match=message):
+        build_llm_backends(config, groq=groq_backend(), governor_factory=governor_factory)
+
+
+def test_unknown_backend_route():
+    backends = build_llm_backends({}, groq=groq_backend(), governor_factory=governor_factory)
+    with pytest.raises(ValueError, match="local"):
+        select_backends(backends, {"chat": "groq", "title": "local"})
+
+
+# ---------- ЗАГЛУШКА ----------
+
+
+def test_stub_client_response():
+    client = StubClient()
+    messages = [{"role": "system", "content": "Ты ассистент"}, {"role": "user", "content": "Как наладить сон после ночной смены"}]
+    resp = client.chat.completions.create(model="stub", messages=messages)
+
+    assert resp.choices[0].message.content == "Как наладить сон после ночной смены"
+    assert resp.usage.prompt_tokens > 0
+    assert client.chat.completions.calls == 1
+    # Ответ детерминирован — на нём можно проверять кеши.
+    assert client.chat.completions.create(model="stub", messages=messages).id == resp.id
+
+
+def test_stub_client_stream():
+    async def collect():
+        client = StubClient(reply="один два три", asynchronous=True)
+        stream = await client.chat.completions.create(model="stub", messages=[], stream=True)
+        assert isinstance(stream, StubStream)
+        parts, usage = [], None
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            if chunk.x_groq:
+                usage = chunk.x_groq.usage
+        return "".join(parts), usage
+
+    text, usage = asyncio.run(collect())
+    assert text == "один два три"
+    assert usage is not None
+
+
+# ---------- ЭНДПОИНТЫ ----------
+
+
+def test_service_uses_routed_backends():
+    import chat_app
+    import llm_clients
+
+    assert {endpoint: backend.name for endpoint, backend in llm_clients.endpoint_backends.items()} == {
+        "chat": "stub",
+        "summary": "stub",
+        "title": "stub",
+        "moderation": "stub",
+    }
+    assert chat_app.chat_chain.models[0] == "stub-model"
+
+    completions = llm_clients.chat_backend.async_client.chat.completions
+    calls = completions.calls
+    with TestClient(chat_app.app) as client:
+        resp = client.post("/chat", json={"messages": [{"role": "user", "content": "Сколько воды пить в жару"}]})
+        stats = client.get("/stats").json()["llm_backends"]
+
+    assert resp.status_code == 200
+    assert resp.json()["answer"] == "Сколько воды пить в жару"
+    assert completions.calls == calls + 1
+    assert stats["endpoints"]["chat"] == {"backend": "stub", "kind": "stub", "model": "stub-model", "available": True}
+    assert stats["governors"]["stub"]["lanes"]["chat"]["requests"] >= 1
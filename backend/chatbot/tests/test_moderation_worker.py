@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+from fastapi import HTTPException
+
+import moderation_worker
+from moderation_worker import ModerationWorker
+
+LEASE = datetime(2026, 4, 22, 12, 0, 0)
+LONG_TEXT = "Регулярный сон и прогулки помогают восстановиться после нагрузки. " * 2
+
+
+def article(article_id: str, **fields) -> dict:
+    row = {
+        "id": article_id,
+        "title": "Сон и восстановление",
+        "category": "Сон",
+        "annotation": "Как наладить режим сна",
+        "content": [{"type": "paragraph", "text": LONG_TEXT}],
+        "lease": LEASE,
+    }
+    row.update(fields)
+    return row
+
+
+def run_batch(monkeypatch, rows, moderate):
+    writes = []
+    events = []
+
+    def claim_batch(conn, limit, skip_ids):
+        events.append("claim")
+        return rows
+
+    def write_decisions(conn, decisions, released):
+        events.append("write")
+        writes.append((decisions, released))
+
+    async def moderate_article(body):
+        events.append("moderate")
+        return await moderate(body)
+
+    monkeypatch.setattr(moderation_worker, "claim_batch", claim_batch)
+    monkeypatch.setattr(moderation_worker, "write_decisions", write_decisions)
+    monkeypatch.setattr(moderation_worker, "moderate_article_async", moderate_article)
+
+    worker = ModerationWorker(batch_size=10, concurrency=2)
+    processed = asyncio.run(worker.run_batch(conn=None))
+    return worker, processed, writes, events
+
+
+def test_decisions_written_after_moderation(monkeypatch):
+    async def moderate(body):
+        return {"decision": "approved", "reasons": ["по теме"], "confidence_score": 90}
+
+    _, processed, writes, events = run_batch(monkeypatch, [article("a1")], moderate)
+
+    assert processed == 1
+    # Захват и запись — отдельные транзакции вокруг вызова модели.
+    assert events == ["claim", "moderate", "write"]
+    assert writes == [([("a1", "approved", "по теме", 90, LEASE)], [])]
+
+
+def test_invalid_article_released_without_retries(monkeypatch):
+    async def moderate(body):
+        raise AssertionError("невалидная статья не должна уходить в модель")
+
+    worker, _, writes, events = run_batch(monkeypatch, [article("a1", annotation="")], moderate)
+
+    assert "moderate" not in events
+    decisions, released = writes[0]
+    assert decisions == []
+    assert released[0][0] == "a1" and released[0][2] == LEASE
+    assert released[0][1].startswith("Автомодерация не удалась: annotation")
+    assert "a1" in worker.given_up
+
+
+def test_model_error_released_for_retry(monkeypatch):
+    async def moderate(body):
+        raise HTTPException(status_code=502, detail="модель недоступна")
+
+    worker, _, writes, _ = run_batch(monkeypatch, [article("a1")], moderate)
+
+    assert writes == [([], [("a1", None, LEASE)])]
+    assert worker.retries["a1"][0] == 1
+    assert "a1" in worker._skip_ids()
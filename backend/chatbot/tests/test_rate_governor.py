@@ -0,0 +1,132 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from percentiles import percentile
+from rate_governor import AttemptTiming, GovernorRejected, RateGovernor, attempt_timing
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def drain_requests(governor: RateGovernor, model: str) -> None:
+    state = governor._state(model)
+    state.requests.level = 0.0
+    state.requests.updated = time.monotonic()
+
+
+def test_percentile():
+    assert percentile([], 0.95) is None
+    assert percentile([3.0, 1.0, 2.0], 0.5) == 2.0
+    assert percentile(range(101), 0.95) == 95
+    assert percentile([0.12345], 0.99) == 0.123
+
+
+def test_chat_lane_served_before_batch():
+    # 600 RPM — одно разрешение в 0.1 с: обе полосы успевают встать в очередь.
+    governor = RateGovernor(default_rpm=600, default_tpm=10**6)
+    drain_requests(governor, "m")
+    order = []
+
+    async def request(lane, delay):
+        await asyncio.sleep(delay)
+        await governor.aacquire(lane, "m", 10)
+        order.append(lane)
+
+    async def run():
+        await asyncio.gather(request("batch_moderation", 0), request("moderation", 0.01), request("chat", 0.02))
+
+    asyncio.run(run())
+    assert order == ["chat", "moderation", "batch_moderation"]
+    assert governor.stats()["lanes"]["chat"]["requests"] == 1
+
+
+def test_rejected_after_max_wait():
+    governor = RateGovernor(default_rpm=1, default_tpm=10**6, max_wait_seconds={"batch_moderation": 0.05})
+    drain_requests(governor, "m")
+
+    with pytest.raises(GovernorRejected) as error:
+        governor.acquire("batch_moderation", "m", 10)
+    assert error.value.lane == "batch_moderation"
+    stats = governor.stats()
+    assert stats["lanes"]["batch_moderation"]["rejected"] == 1
+    # Отказавший не остаётся в очереди.
+    assert stats["models"]["m"]["queued"] == 0
+
+
+def test_429_retried_after_retry_after():
+    governor = RateGovernor(default_rpm=1000, default_tpm=10**6, backoff_base_seconds=0.01)
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise UpstreamError(429, {"retry-after-ms": "50"})
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=5))
+
+    assert governor.call("chat", "m", 100, fn).usage.total_tokens == 5
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.05
+    stats = governor.stats()
+    assert stats["lanes"]["chat"]["retries"] == 1
+    assert stats["upstream_errors"] == {"429": 1}
+
+
+def test_client_error_not_retried():
+    governor = RateGovernor(default_rpm=1000, default_tpm=10**6)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise UpstreamError(400)
+
+    with pytest.raises(UpstreamError):
+        governor.call("chat", "m", 10, fn)
+    assert len(calls) == 1
+
+
+def test_retries_limited():
+    governor = RateGovernor(default_rpm=1000, default_tpm=10**6, max_retries=2, backoff_base_seconds=0.001)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        raise UpstreamError(503)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(governor.acall("chat", "m", 10, fn))
+    assert len(calls) == 3
+
+
+def test_unused_tokens_returned():
+    governor = RateGovernor(default_rpm=1000, default_tpm=6000)
+    governor.call("chat", "m", 1000, lambda: SimpleNamespace(usage=SimpleNamespace(total_tokens=200)))
+    # Зарезервировали 1000, потратили 200 — в ведре осталось около 5800.
+    assert governor.stats()["models"]["m"]["tokens_available"] >= 5799
+
+
+def test_attempt_timing_excludes_queue_wait():
+    governor = RateGovernor(default_rpm=600, default_tpm=10**6)
+    drain_requests(governor, "m")
+    timing = AttemptTiming()
+
+    async def upstream():
+        await asyncio.sleep(0.02)
+        return None
+
+    async def run():
+        attempt_timing.set(timing)
+        queued = time.monotonic()
+        await governor.acall("chat", "m", 10, upstream)
+        return time.monotonic() - queued
+
+    total = asyncio.run(run())
+    assert timing.started is not None
+    assert 0.015 <= timing.seconds < total
+    assert total >= 0.09
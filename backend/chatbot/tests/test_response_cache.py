@@ -0,0 +1,100 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import chat_app
+from response_cache import DisabledCache, MemoryCache, SqliteCache, build_cache, make_cache_key
+
+
+def test_cache_key_stable():
+    assert make_cache_key("chat", {"b": 1, "a": 2}) == make_cache_key("chat", {"a": 2, "b": 1})
+    assert make_cache_key("chat", "сон") != make_cache_key("chat", "сон ")
+
+
+def test_memory_cache_lru_and_counters():
+    cache = MemoryCache("t", ttl_seconds=3600, max_entries=2)
+    cache.set("a", {"answer": "a"})
+    cache.set("b", {"answer": "b"})
+    assert cache.get("a") == {"answer": "a"}
+    cache.set("c", {"answer": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("c") == {"answer": "c"}
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 1, 1)
+    assert stats["hit_rate"] == round(2 / 3, 4)
+
+
+def test_memory_cache_expires():
+    cache = MemoryCache("t", ttl_seconds=-1, max_entries=10)
+    cache.set("a", {"answer": "a"})
+    assert cache.get("a") is None
+    assert cache.size() == 0
+
+
+def test_sqlite_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SqliteCache("chat", 3600, 10, path).set("a", {"answer": "сон"})
+
+    assert SqliteCache("chat", 3600, 10, path).get("a") == {"answer": "сон"}
+    # Другой кеш в том же файле записей не видит.
+    assert SqliteCache("title", 3600, 10, path).get("a") is None
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path):
+    cache = SqliteCache("chat", 3600, 2, str(tmp_path / "cache.sqlite3"))
+    cache.set("a", {"answer": "a"})
+    time.sleep(0.01)
+    cache.set("b", {"answer": "b"})
+    time.sleep(0.01)
+    cache.get("a")
+    cache.set("c", {"answer": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sqlite_cache_expires(tmp_path):
+    cache = SqliteCache("chat", -1, 10, str(tmp_path / "cache.sqlite3"))
+    cache.set("a", {"answer": "a"})
+    assert cache.get("a") is None
+    assert cache.size() == 0
+
+
+@pytest.mark.parametrize("backend, kind", [("memory", MemoryCache), ("sqlite", SqliteCache), ("off", DisabledCache)])
+def test_build_cache(tmp_path, backend, kind):
+    cache = build_cache("t-" + backend, backend, 60, 10, str(tmp_path / "cache.sqlite3"))
+    assert isinstance(cache, kind)
+    cache.set("a", {"answer": "a"})
+    assert (cache.get("a") is None) is (backend == "off")
+
+
+def test_chat_key_normalized():
+    def key(*turns):
+        return chat_app.chat_cache_key([{"role": "system", "content": "промпт"}] + list(turns))
+
+    question = {"role": "user", "content": "Как  наладить  сон?"}
+    assert key(question) == key({"role": "user", "content": " как наладить сон? "})
+    assert key({"role": "user", "content": "Ёж"}) == key({"role": "user", "content": "еж"})
+    # Системный промпт в ключ входит версией, а не текстом.
+    assert chat_app.chat_cache_key([{"role": "system", "content": "другой"}, question]) == key(question)
+    assert key(question) != key({"role": "assistant", "content": "Как наладить сон?"})
+
+
+def test_repeated_chat_served_from_cache(monkeypatch):
+    cache = MemoryCache("t-chat", ttl_seconds=3600, max_entries=10)
+    monkeypatch.setattr(chat_app, "chat_response_cache", cache)
+    monkeypatch.setattr(chat_app, "semantic_cache", None)
+    completions = chat_app.chat_backend.async_client.chat.completions
+    calls = completions.calls
+
+    body = {"messages": [{"role": "user", "content": "Сколько спать взрослому"}]}
+    with TestClient(chat_app.app) as client:
+        first = client.post("/chat", json=body).json()
+        second = client.post("/chat", json={"messages": [{"role": "user", "content": "сколько  спать взрослому"}]}).json()
+
+    assert second == first
+    assert completions.calls == calls + 1
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,89 @@
+import pytest
+
+from ru_text import stem_ru
+from semantic_cache import SYNONYM_GROUPS, SemanticCache, jaccard, question_terms
+
+THRESHOLD = 0.75
+
+
+def cache(**kwargs) -> SemanticCache:
+    options = {"threshold": THRESHOLD, "ttl_seconds": 3600, "max_entries": 100}
+    options.update(kwargs)
+    return SemanticCache(**options)
+
+
+@pytest.mark.parametrize(
+    "stored, asked",
+    [
+        ("Как улучшить сон", "Как лучше спать"),
+        ("Как наладить сон?", "как улучшить сон"),
+        ("Почему я плохо сплю ночью", "Почему плохо спится ночью"),
+        ("Вредно ли бегать по утрам", "Вреден ли бег по утрам"),
+    ],
+)
+def test_paraphrase_hits(stored, asked):
+    semantic = cache()
+    semantic.store("scope", stored, {"answer": "ответ"})
+
+    match = semantic.lookup("scope", asked)
+    assert match is not None
+    value, similarity, question = match
+    assert value == {"answer": "ответ"}
+    assert similarity >= THRESHOLD
+    assert question == stored
+
+
+@pytest.mark.parametrize(
+    "stored, asked",
+    [
+        ("Можно ли кофе", "Можно ли кофе при беременности"),
+        ("Как улучшить сон", "Как улучшить кожу"),
+        ("Как улучшить сон", "Как улучшить сон ребенка"),
+        ("Можно ли пить кофе", "Можно ли пить кофе вечером"),
+        ("Как улучшить сон", "Бессонница"),
+    ],
+)
+def test_different_questions_miss(stored, asked):
+    semantic = cache()
+    semantic.store("scope", stored, {"answer": "ответ"})
+
+    assert jaccard(question_terms(stored), question_terms(asked)) < THRESHOLD
+    assert semantic.lookup("scope", asked) is None
+    assert semantic.stats()["misses"] == 1
+
+
+def test_scopes_isolated():
+    semantic = cache()
+    semantic.store("model-a", "Как улучшить сон", {"answer": "a"})
+    assert semantic.lookup("model-b", "Как улучшить сон") is None
+    assert semantic.lookup("model-a", "Как улучшить сон")[0] == {"answer": "a"}
+
+
+def test_expired_entries_dropped():
+    semantic = cache(ttl_seconds=-1)
+    semantic.store("scope", "Как улучшить сон", {"answer": "ответ"})
+    assert semantic.lookup("scope", "Как улучшить сон") is None
+    assert semantic.stats()["size"] == 0
+
+
+def test_oldest_entries_evicted():
+    semantic = cache(max_entries=2)
+    for question in ("Как улучшить сон", "Сколько пить воды", "Как снизить стресс"):
+        semantic.store("scope", question, {"answer": question})
+
+    assert semantic.stats()["size"] == 2
+    assert semantic.lookup("scope", "Как улучшить сон") is None
+    assert semantic.lookup("scope", "Как снизить стресс") is not None
+
+
+def test_stopword_only_question_not_cached():
+    semantic = cache()
+    semantic.store("scope", "Что это?", {"answer": "ответ"})
+    assert semantic.stats()["size"] == 0
+
+
+def test_synonym_stems_do_not_collide():
+    owners = {}
+    for concept, words in SYNONYM_GROUPS.items():
+        for word in words:
+            assert owners.setdefault(stem_ru(word), concept) == concept, word
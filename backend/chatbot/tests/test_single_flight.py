@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_async_calls_coalesced():
+    flight = SingleFlight("t")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def run():
+        return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["ответ"] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["upstream_calls"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+
+
+def test_different_keys_not_coalesced():
+    flight = SingleFlight("t")
+
+    async def run():
+        return await asyncio.gather(
+            flight.ado("a", lambda: asyncio.sleep(0.01, "a")),
+            flight.ado("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert flight.stats()["upstream_calls"] == 2
+
+
+def test_sequential_calls_not_coalesced():
+    flight = SingleFlight("t")
+
+    async def run():
+        first = await flight.ado("key", lambda: asyncio.sleep(0, 1))
+        second = await flight.ado("key", lambda: asyncio.sleep(0, 2))
+        return first, second
+
+    # После завершения вызова повторный идёт к модели заново (это уже забота кеша).
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_error_shared_by_waiters():
+    flight = SingleFlight("t")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def run():
+        return await asyncio.gather(*(flight.ado("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.stats()["upstream_calls"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_call():
+    flight = SingleFlight("t")
+
+    async def run():
+        first = asyncio.create_task(flight.ado("key", lambda: asyncio.sleep(0.05, "ответ")))
+        second = asyncio.create_task(flight.ado("key", lambda: asyncio.sleep(0.05, "другой")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "ответ"
+    assert flight.stats()["cancelled"] == 0
+
+
+def test_last_waiter_gone_cancels_call():
+    flight = SingleFlight("t")
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    async def run():
+        waiter = asyncio.create_task(flight.ado("key", fetch))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.06)
+
+    asyncio.run(run())
+    assert finished == []
+    assert flight.stats()["cancelled"] == 1
+
+
+def test_threaded_calls_coalesced():
+    flight = SingleFlight("t")
+    calls = []
+    started = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "ответ"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "key", fetch)
+        started.wait()
+        followers = [pool.submit(flight.do, "key", fetch) for _ in range(3)]
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == ["ответ"] * 4
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 3
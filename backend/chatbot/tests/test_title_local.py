@@ -0,0 +1,75 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import chat_app
+from ru_text import stem_ru
+from title_local import TIED_TOPICS_CONFIDENCE, TOPIC_CONFIDENCE, TOPIC_WORDS, extract_local_title
+
+
+@pytest.mark.parametrize(
+    "text, title",
+    [
+        ("Болит голова после тренировки", "Тренировки"),
+        ("Сколько тренировок в неделю нужно новичку", "Тренировки"),
+        ("Как наладить сон после ночных смен", "Сон"),
+        ("Плохо сплю и часто просыпаюсь", "Сон"),
+        ("Не могу уснуть по ночам", "Засыпание"),
+        ("Сколько пить воды в день", "Вода"),
+        ("Как похудеть к лету", "Похудение"),
+        ("Пью много кофе, плохо сплю, сплю по пять часов", "Сон"),
+        ("Какой режим выбрать", "Режим дня"),
+        ("Какие бады пить зимой", "БАДы"),
+    ],
+)
+def test_known_topic(text, title):
+    assert extract_local_title(text) == (title, TOPIC_CONFIDENCE)
+
+
+@pytest.mark.parametrize(
+    "text, title",
+    [
+        ("Сон и кофе", "Сон"),
+        ("Бессонница и тревога, что делать", "Бессонница"),
+        ("Стресс на работе и выгорание", "Стресс"),
+    ],
+)
+def test_tied_topics_left_to_model(text, title):
+    assert extract_local_title(text) == (title, TIED_TOPICS_CONFIDENCE)
+    assert TIED_TOPICS_CONFIDENCE < chat_app.CHAT_TITLE_LOCAL_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize(
+    "text, title, confident",
+    [
+        ("Медитация", "Медитация", True),
+        ("Расскажи про мультиварку", "Мультиварку", False),
+        ("Реабилитация", "Реабилитация", True),
+        ("Что лучше купить", "Лучше", False),
+        ("", None, False),
+        ("123 456", None, False),
+    ],
+)
+def test_fallback_heuristic(text, title, confident):
+    local_title, confidence = extract_local_title(text)
+    assert local_title == title
+    assert (confidence >= chat_app.CHAT_TITLE_LOCAL_MIN_CONFIDENCE) is confident
+
+
+def test_topic_stems_do_not_collide():
+    owners = {}
+    for title, words in TOPIC_WORDS.items():
+        for word in words:
+            assert owners.setdefault(stem_ru(word), title) == title, word
+
+
+def test_tie_goes_to_model():
+    completions = chat_app.title_backend.async_client.chat.completions
+    calls = completions.calls
+    with TestClient(chat_app.app) as client:
+        local = client.post("/generate-title", json={"text": "Болит спина после тренировок и тренировки"}).json()
+        assert completions.calls == calls
+        tied = client.post("/generate-title", json={"text": "Сон и кофе вечером"}).json()
+        assert completions.calls == calls + 1
+
+    assert local["title"] == "Тренировки"
+    assert tied["title"]
@@ -0,0 +1,55 @@
+import chat_app
+from chat_app import ChatMessage, compact_chat_history, token_limit_from_env
+from token_budget import chars_to_tokens, estimate_message_tokens, estimate_tokens, truncate_to_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("сон") == 1
+    assert estimate_tokens("здоровье") == 3
+    assert estimate_tokens("sleep, 2024") == 2 + 1 + 2
+    assert estimate_message_tokens("сон") == 1 + 4
+
+
+def test_truncate_on_piece_boundary():
+    text = "Как наладить сон после ночной смены"
+    assert truncate_to_tokens(text, 100) == text
+    cut = truncate_to_tokens(text, 5)
+    assert text.startswith(cut)
+    assert estimate_tokens(cut) <= 5
+    assert cut.split() == text.split()[: len(cut.split())]
+    assert truncate_to_tokens(text, 0) == ""
+
+
+def test_legacy_char_limits_mapped_to_tokens(monkeypatch):
+    monkeypatch.delenv("CHAT_MAX_MESSAGE_TOKENS", raising=False)
+    monkeypatch.setenv("CHAT_MAX_MESSAGE_CHARS", "1200")
+    assert token_limit_from_env("CHAT_MAX_MESSAGE_TOKENS", "CHAT_MAX_MESSAGE_CHARS", 600) == chars_to_tokens(1200) == 400
+
+    monkeypatch.setenv("CHAT_MAX_MESSAGE_TOKENS", "300")
+    assert token_limit_from_env("CHAT_MAX_MESSAGE_TOKENS", "CHAT_MAX_MESSAGE_CHARS", 600) == 300
+
+    monkeypatch.delenv("CHAT_MAX_TOTAL_CHARS", raising=False)
+    assert token_limit_from_env("CHAT_PROMPT_TOKEN_BUDGET", "CHAT_MAX_TOTAL_CHARS", 3500, extra_tokens=100) == 3500
+    monkeypatch.setenv("CHAT_MAX_TOTAL_CHARS", "3000")
+    assert token_limit_from_env("CHAT_PROMPT_TOKEN_BUDGET", "CHAT_MAX_TOTAL_CHARS", 3500, extra_tokens=100) == 1100
+
+
+def test_compaction_keeps_recent_window(monkeypatch):
+    monkeypatch.setattr(chat_app, "CHAT_PROMPT_TOKEN_BUDGET", chat_app.SYSTEM_PROMPT_TOKENS + 600)
+    history = [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=f"реплика {i} " + "текст " * 60)
+        for i in range(10)
+    ]
+    older, window = compact_chat_history(history)
+
+    assert older and window
+    assert len(older) + len(window) == len(history)
+    assert [m.content for m in window] == [m.content.strip() for m in history[-len(window):]]
+    # Место под краткое содержание зарезервировано.
+    assert sum(estimate_message_tokens(m.content) for m in window) <= 600 - chat_app.CHAT_SUMMARY_MAX_TOKENS
+
+
+def test_short_history_not_compacted():
+    history = [ChatMessage(role="user", content="Привет"), ChatMessage(role="assistant", content="Здравствуйте")]
+    assert compact_chat_history(history) == ([], history)
@@ -0,0 +1,58 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import chat_app
+from upload_limit import UPLOAD_FORM_OVERHEAD_BYTES, UPLOAD_MAX_BYTES, UploadLimitMiddleware
+
+
+def limited_app(max_body_bytes: int) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_body_bytes=max_body_bytes, paths=("/upload",))
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    return app
+
+
+def test_body_within_limit_passes():
+    client = TestClient(limited_app(100))
+    assert client.post("/upload", content=b"x" * 100).json() == {"size": 100}
+
+
+def test_declared_length_over_limit_rejected():
+    resp = TestClient(limited_app(100)).post("/upload", content=b"x" * 101)
+    assert resp.status_code == 400
+    assert resp.json()["detail"].startswith("Файл слишком большой")
+    assert resp.headers["connection"] == "close"
+
+
+def test_chunked_body_over_limit_rejected():
+    def chunks():
+        for _ in range(5):
+            yield b"x" * 40
+
+    resp = TestClient(limited_app(100)).post("/upload", content=chunks())
+    assert resp.status_code == 400
+    assert resp.json()["detail"].startswith("Файл слишком большой")
+
+
+def test_other_paths_not_limited():
+    assert TestClient(limited_app(100)).post("/other", content=b"x" * 500).json() == {"size": 500}
+
+
+def test_rejection_carries_cors_headers():
+    # Браузер должен увидеть текст ошибки, а не непрозрачную ошибку CORS.
+    with TestClient(chat_app.app) as client:
+        resp = client.post(
+            "/expert/verify",
+            content=b"x" * (UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES + 1),
+            headers={"Origin": "https://example.org", "Content-Type": "multipart/form-data; boundary=x"},
+        )
+    assert resp.status_code == 400
+    assert resp.headers["access-control-allow-origin"] in ("*", "https://example.org")
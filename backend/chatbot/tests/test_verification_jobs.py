@@ -0,0 +1,192 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from verification_jobs import QueueFullError, VerificationJobQueue
+
+
+def job_queue(path, **kwargs) -> VerificationJobQueue:
+    options = {"workers": 1, "max_queued": 10, "sweep_seconds": 3600}
+    options.update(kwargs)
+    return VerificationJobQueue(str(path), **options)
+
+
+async def wait_finished(queue: VerificationJobQueue, job_id: str) -> dict:
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"задача {job_id} не завершилась")
+
+
+def insert_job(queue: VerificationJobQueue, job_id: str, status: str, **columns) -> None:
+    values = {"id": job_id, "status": status, "params": "{}", "created_at": time.time()}
+    values.update(columns)
+    names = ", ".join(values)
+    marks = ", ".join("?" for _ in values)
+    queue._execute(f"INSERT INTO verification_jobs ({names}) VALUES ({marks})", tuple(values.values()))
+
+
+def test_job_done_and_failed(tmp_path):
+    async def handler(params):
+        if params["fail"]:
+            raise ValueError("документ не читается")
+        return {"verified": True}
+
+    async def run():
+        queue = job_queue(tmp_path / "jobs.sqlite3")
+        await queue.start(handler)
+        try:
+            done = await wait_finished(queue, queue.submit({"fail": False}))
+            failed = await wait_finished(queue, queue.submit({"fail": True}))
+        finally:
+            await queue.stop()
+        return done, failed
+
+    done, failed = asyncio.run(run())
+    assert done["result"] == {"verified": True}
+    assert failed["error"] == {"status_code": 500, "detail": "документ не читается"}
+
+
+def test_queue_full_rejected(tmp_path):
+    async def run():
+        queue = job_queue(tmp_path / "jobs.sqlite3", max_queued=1)
+        # Без воркеров: задачи остаются в очереди.
+        queue._queue = asyncio.Queue()
+        queue.submit({})
+        with pytest.raises(QueueFullError):
+            queue.submit({})
+        return queue.stats()["rejected"]
+
+    assert asyncio.run(run()) == 1
+
+
+def test_job_claimed_by_one_process(tmp_path):
+    calls = []
+
+    async def handler(params):
+        calls.append(params)
+        await asyncio.sleep(0.05)
+        return {}
+
+    async def run():
+        first = job_queue(tmp_path / "jobs.sqlite3")
+        second = job_queue(tmp_path / "jobs.sqlite3")
+        await first.start(handler)
+        job_id = first.submit({"n": 1})
+        # Второй процесс при старте видит ту же ожидающую задачу.
+        await second.start(handler)
+        try:
+            job = await wait_finished(first, job_id)
+        finally:
+            await first.stop()
+            await second.stop()
+        return job
+
+    assert asyncio.run(run())["status"] == "done"
+    assert calls == [{"n": 1}]
+
+
+def test_only_expired_leases_requeued(tmp_path):
+    calls = []
+
+    async def handler(params):
+        calls.append(params)
+        return {}
+
+    async def run():
+        queue = job_queue(tmp_path / "jobs.sqlite3")
+        now = time.time()
+        insert_job(queue, "alive", "running", owner="other", lease_until=now + 600, params='{"job": "alive"}')
+        insert_job(queue, "dead", "running", owner="other", lease_until=now - 1, params='{"job": "dead"}')
+        await queue.start(handler)
+        try:
+            dead = await wait_finished(queue, "dead")
+        finally:
+            await queue.stop()
+        return dead, queue.get("alive")
+
+    dead, alive = asyncio.run(run())
+    assert dead["status"] == "done"
+    assert alive["status"] == "running"
+    assert calls == [{"job": "dead"}]
+
+
+def test_lost_lease_result_discarded(tmp_path):
+    async def run():
+        queue = job_queue(tmp_path / "jobs.sqlite3")
+
+        async def handler(params):
+            # Пока задача работала, аренду перехватил другой процесс.
+            queue._execute("UPDATE verification_jobs SET owner = 'other'")
+            return {"verified": True}
+
+        await queue.start(handler)
+        try:
+            job_id = queue.submit({})
+            for _ in range(200):
+                if queue.lease_lost:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        return queue.get(job_id)
+
+    job = asyncio.run(run())
+    assert job["status"] == "running"
+    assert job["result"] is None
+
+
+def test_stop_releases_running_jobs(tmp_path):
+    async def handler(params):
+        await asyncio.sleep(10)
+        return {}
+
+    async def run():
+        queue = job_queue(tmp_path / "jobs.sqlite3")
+        await queue.start(handler)
+        job_id = queue.submit({})
+        while queue.get(job_id)["status"] != "running":
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return queue.get(job_id)
+
+    assert asyncio.run(run())["status"] == "queued"
+
+
+def test_retention_sweep(tmp_path):
+    queue = job_queue(tmp_path / "jobs.sqlite3", retention_seconds=3600)
+    queue._queue = asyncio.Queue()
+    now = time.time()
+    insert_job(queue, "old-done", "done", finished_at=now - 7200)
+    insert_job(queue, "old-failed", "failed", finished_at=now - 7200)
+    insert_job(queue, "recent", "done", finished_at=now - 60)
+    insert_job(queue, "waiting", "queued", created_at=now - 7200)
+
+    queue.sweep()
+
+    assert queue.get("old-done") is None and queue.get("old-failed") is None
+    assert queue.get("recent")["status"] == "done"
+    assert queue.get("waiting")["status"] == "queued"
+    assert queue.stats()["expired"] == 2
+
+
+def test_schema_migrated(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE verification_jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, "
+        "result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+    )
+    conn.execute("INSERT INTO verification_jobs VALUES ('legacy', 'running', '{}', NULL, NULL, 0, 0, NULL)")
+    conn.commit()
+    conn.close()
+
+    queue = job_queue(path)
+    queue._queue = asyncio.Queue()
+    queue.sweep()
+    # Задача без аренды считается брошенной.
+    assert queue.get("legacy")["status"] == "queued"
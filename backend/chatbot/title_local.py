@@ -0,0 +1,126 @@
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from ru_text import RUSSIAN_STOPWORDS, stem_ru, tokenize
+
+# Название чата (не длиннее 18 символов) -> словоформы темы. Сравниваются
+# основы (stem_ru), поэтому достаточно пары форм: «тренировки», «тренировок»
+# и «тренировка» сводятся к одной основе. Покрывает частые темы
+# wellness-вопросов, для них модель не нужна.
+TOPIC_WORDS: Dict[str, Tuple[str, ...]] = {
+    "Сон": ("сон", "сна", "сну", "сном", "спать", "сплю", "спит", "высыпаться", "высыпаюсь"),
+    "Бессонница": ("бессонница",),
+    "Засыпание": ("засыпание", "засыпать", "засыпаю", "уснуть"),
+    "Питание": ("питание", "рацион"),
+    "Диета": ("диета",),
+    "Похудение": ("похудение", "похудеть", "худеть"),
+    "Вес": ("вес",),
+    "Калории": ("калории", "калория"),
+    "Белок": ("белок", "белка"),
+    "Сахар": ("сахар",),
+    "Голодание": ("голодание",),
+    "Витамины": ("витамины",),
+    "БАДы": ("бад", "бады"),
+    "Магний": ("магний",),
+    "Железо": ("железо",),
+    "Вода": ("вода", "гидратация"),
+    "Стресс": ("стресс",),
+    "Тревожность": ("тревога", "тревожность"),
+    "Выгорание": ("выгорание",),
+    "Медитация": ("медитация",),
+    "Дыхание": ("дыхание",),
+    "Тренировки": ("тренировка", "тренировок", "тренироваться"),
+    "Спорт": ("спорт",),
+    "Бег": ("бег", "бегать"),
+    "Йога": ("йога",),
+    "Растяжка": ("растяжка",),
+    "Ходьба": ("ходьба", "шаги"),
+    "Активность": ("активность",),
+    "Осанка": ("осанка",),
+    "Спина": ("спина",),
+    "Уход за кожей": ("кожа",),
+    "Волосы": ("волосы",),
+    "Иммунитет": ("иммунитет",),
+    "Простуда": ("простуда",),
+    "Давление": ("давление",),
+    "Сердце": ("сердце",),
+    "Холестерин": ("холестерин",),
+    "Кофе": ("кофе",),
+    "Кофеин": ("кофеин",),
+    "Алкоголь": ("алкоголь",),
+    "Курение": ("курение", "курить"),
+    "Энергия": ("энергия",),
+    "Усталость": ("усталость", "устаю", "уставать"),
+    "Мотивация": ("мотивация",),
+    "Привычки": ("привычки",),
+    "Режим дня": ("режим",),
+}
+
+# Основа слова -> название чата.
+TOPIC_TITLES: Dict[str, str] = {
+    stem_ru(word): title for title, words in TOPIC_WORDS.items() for word in words
+}
+
+# Уверенность по известной теме. Если несколько тем упомянуты одинаково часто,
+# уверенность ниже порога CHAT_TITLE_LOCAL_MIN_CONFIDENCE (0.7 по умолчанию):
+# название лучше подберёт модель.
+TOPIC_CONFIDENCE = 0.9
+TIED_TOPICS_CONFIDENCE = 0.5
+
+# Окончания, типичные для существительных в именительном падеже.
+NOUN_SUFFIXES = ("ние", "ция", "ость", "ство", "тель", "изм", "ура", "ика")
+NON_NOUN_SUFFIXES = (
+    "ть", "ться", "ешь", "ет", "ют", "ит", "ят", "уй", "ите", "йте",
+    "ый", "ий", "ой", "ая", "яя", "ое", "ее", "ые", "ие",
+)
+
+MAX_TITLE_CHARS = 18
+
+
+def extract_local_title(text: str) -> Tuple[Optional[str], float]:
+    """
+    Пытается выбрать название чата без модели.
+    Возвращает (название, уверенность 0..1); при пустом результате — (None, 0.0).
+    """
+    tokens = [
+        t for t in tokenize(text)
+        if t not in RUSSIAN_STOPWORDS and len(t) > 2 and not t.isdigit()
+    ]
+    if not tokens:
+        return None, 0.0
+
+    # 1) Известные темы: считаем упоминания, при равенстве — кто раньше.
+    topic_hits: Counter = Counter()
+    first_seen: Dict[str, int] = {}
+    for pos, token in enumerate(tokens):
+        title = TOPIC_TITLES.get(stem_ru(token))
+        if title:
+            topic_hits[title] += 1
+            first_seen.setdefault(title, pos)
+
+    if topic_hits:
+        ranked = sorted(topic_hits, key=lambda t: (-topic_hits[t], first_seen[t]))
+        best = ranked[0]
+        tied = len(ranked) > 1 and topic_hits[ranked[1]] == topic_hits[best]
+        return best, TIED_TOPICS_CONFIDENCE if tied else TOPIC_CONFIDENCE
+
+    # 2) Эвристика: самое частое и раннее слово, похожее на существительное.
+    stems = [stem_ru(t) for t in tokens]
+    freq = Counter(stems)
+    best_token, best_score = None, 0.0
+    for pos, (token, stem) in enumerate(zip(tokens, stems)):
+        if token.endswith(NON_NOUN_SUFFIXES) and not token.endswith(NOUN_SUFFIXES):
+            continue
+        score = freq[stem] + 1.0 / (pos + 1)
+        if token.endswith(NOUN_SUFFIXES):
+            score += 1.0
+        if score > best_score:
+            best_token, best_score = token, score
+
+    if not best_token or len(best_token) > MAX_TITLE_CHARS:
+        return None, 0.0
+
+    confidence = 0.6 if best_token.endswith(NOUN_SUFFIXES) else 0.4
+    if len(set(stems)) == 1:
+        confidence += 0.1
+    return best_token.capitalize(), round(confidence, 2)
@@ -0,0 +1,59 @@
+import math
+import re
+from typing import List
+
+# Локальная оценка числа токенов — без токенизатора модели и сетевых запросов.
+# BPE-токенизаторы Llama/GPT-OSS режут кириллицу примерно по 3 символа,
+# латиницу — по 4, знаки препинания обычно отдельными токенами. Оценка
+# намеренно немного завышена: лучше недобрать истории, чем получить 413.
+
+_PIECE_RE = re.compile(r"[a-zA-Z]+|[а-яА-ЯёЁ]+|\d+|[^\s\w]|\w+")
+
+CYRILLIC_CHARS_PER_TOKEN = 3
+LATIN_CHARS_PER_TOKEN = 4
+DIGITS_PER_TOKEN = 3
+# Служебные токены разметки чата на каждое сообщение (роль, разделители).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _piece_tokens(piece: str) -> int:
+    first = piece[0]
+    if first.isdigit():
+        return math.ceil(len(piece) / DIGITS_PER_TOKEN)
+    if "a" <= first.lower() <= "z":
+        return math.ceil(len(piece) / LATIN_CHARS_PER_TOKEN)
+    if first.isalpha():
+        return math.ceil(len(piece) / CYRILLIC_CHARS_PER_TOKEN)
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    return sum(_piece_tokens(piece) for piece in _PIECE_RE.findall(text or ""))
+
+
+def estimate_message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_messages_tokens(messages: List[dict]) -> int:
+    return sum(estimate_message_tokens(m["content"]) for m in messages)
+
+
+def chars_to_tokens(chars: int) -> int:
+    """Лимит в символах -> в токенах, с запасом: как будто весь текст кириллический."""
+    return math.ceil(chars / CYRILLIC_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Обрезает текст так, чтобы оценка не превышала max_tokens.
+    Режет по границе «куска» (слова или знака), а не посреди слова.
+    """
+    if max_tokens <= 0:
+        return ""
+    total = 0
+    for match in _PIECE_RE.finditer(text):
+        total += _piece_tokens(match.group())
+        if total > max_tokens:
+            return text[: match.start()].rstrip()
+    return text
@@ -0,0 +1,86 @@
+import os
+from typing import Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Ограничение размера загрузок (/expert/verify) ещё до разбора multipart:
+# Starlette складывает файл во временный файл целиком до вызова обработчика,
+# и проверка размера при сохранении этот приём уже не остановила бы.
+UPLOAD_MAX_BYTES = int(os.environ.get("CHAT_UPLOAD_MAX_MB", "10")) * 1024 * 1024
+# Запас на поля формы и границы multipart сверх самого файла.
+UPLOAD_FORM_OVERHEAD_BYTES = 256 * 1024
+UPLOAD_PATHS = ("/expert/verify",)
+
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Файл слишком большой. Максимум {UPLOAD_MAX_BYTES // (1024 * 1024)} МБ",
+    )
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    Отсекает слишком большие загрузки до чтения тела: по Content-Length сразу,
+    без него (chunked) — как только принятых байт стало больше лимита.
+    """
+
+    def __init__(self, app, max_body_bytes: int, paths: Tuple[str, ...]):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        try:
+            declared = int(headers.get(b"content-length", b"-1"))
+        except ValueError:
+            declared = -1
+        if declared > self.max_body_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # FastAPI превращает ошибку разбора тела в свой 400 — подменяем его нашим ответом.
+            if not too_large:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if too_large:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        error = upload_too_large()
+        # Connection: close — остаток тела клиента не дочитываем.
+        response = JSONResponse(
+            status_code=error.status_code,
+            content={"detail": error.detail},
+            headers={"Connection": "close"},
+        )
+        await response(scope, receive, send)
+
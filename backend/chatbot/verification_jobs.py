@@ -0,0 +1,314 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from percentiles import percentile
+
+# Очередь асинхронной верификации экспертов: /expert/verify сразу отвечает
+# job_id, а ограниченный пул воркеров обрабатывает документы в фоне.
+# Задачи хранятся в sqlite и переживают перезапуск сервиса.
+# Файл может быть общим для нескольких процессов (uvicorn --workers, второй
+# экземпляр при перезапуске): задача захватывается атомарным UPDATE ... WHERE
+# status = 'queued' с арендой (owner, lease_until), которую воркер продлевает,
+# пока работает. Чужие задачи в работе не трогаем, пока аренда не истекла.
+# Завершённые задачи (с ФИО и результатом проверки документа) удаляются
+# через retention_seconds.
+
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class VerificationJobQueue:
+    def __init__(
+        self,
+        path: str,
+        workers: int,
+        max_queued: int,
+        webhook_url: str = "",
+        webhook_timeout: float = 10.0,
+        lease_seconds: float = 600.0,
+        retention_seconds: float = 7 * 86400,
+        sweep_seconds: float = 60.0,
+    ):
+        self.workers = max(workers, 1)
+        self.max_queued = max_queued
+        self.webhook_url = webhook_url
+        self.webhook_timeout = webhook_timeout
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.sweep_seconds = sweep_seconds
+        self.handler: Optional[JobHandler] = None
+        # Владелец аренды: процесс и экземпляр очереди.
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS verification_jobs (
+                id          TEXT PRIMARY KEY,
+                status      TEXT NOT NULL,
+                params      TEXT NOT NULL,
+                result      TEXT,
+                error       TEXT,
+                created_at  REAL NOT NULL,
+                started_at  REAL,
+                finished_at REAL,
+                owner       TEXT,
+                lease_until REAL
+            )
+            """
+        )
+        # Файлы, созданные до появления аренды.
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(verification_jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE verification_jobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+        self._queue: Optional[asyncio.Queue] = None
+        # Id в локальной очереди — чтобы периодический обход не ставил их повторно.
+        self._queued_ids: set = set()
+        self._tasks: list = []
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.lease_lost = 0
+        self.expired = 0
+        self._wait_times: deque = deque(maxlen=500)
+        self._processing_times: deque = deque(maxlen=500)
+
+    # --------- sqlite ---------
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    # --------- жизненный цикл ---------
+
+    async def start(self, handler: JobHandler) -> None:
+        self.handler = handler
+        self._queue = asyncio.Queue()
+        self.sweep()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Прерванные остановкой задачи сразу отдаём другим процессам, не дожидаясь конца аренды.
+        self._execute(
+            "UPDATE verification_jobs SET status = 'queued', owner = NULL, lease_until = NULL "
+            "WHERE owner = ? AND status = 'running'",
+            (self.owner,),
+        )
+
+    def _enqueue(self, job_id: str) -> None:
+        self._queued_ids.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    def sweep(self) -> None:
+        """
+        Возвращает в очередь задачи с истёкшей арендой (процесс упал посреди
+        обработки), ставит в локальную очередь ожидающие задачи и удаляет
+        завершённые старше retention_seconds.
+        """
+        now = time.time()
+        requeued = self._execute(
+            "UPDATE verification_jobs SET status = 'queued', owner = NULL, lease_until = NULL "
+            "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (now,),
+        ).rowcount
+        if requeued:
+            print(f"Verification jobs: {requeued} with expired lease requeued")
+
+        expired = self._execute(
+            "DELETE FROM verification_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (now - self.retention_seconds,),
+        ).rowcount
+        self.expired += expired
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM verification_jobs WHERE status = 'queued' ORDER BY created_at LIMIT ?",
+                (self.max_queued,),
+            ).fetchall()
+        # Задачу могут поставить в очередь несколько процессов — обработает тот, кто захватит.
+        for (job_id,) in rows:
+            if job_id not in self._queued_ids:
+                self._enqueue(job_id)
+
+    async def _sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                print("Verification jobs sweep error:", repr(e))
+
+    # --------- API ---------
+
+    def submit(self, params: dict) -> str:
+        if self._queue is None:
+            raise RuntimeError("Очередь верификации не запущена")
+        if self._queue.qsize() >= self.max_queued:
+            self.rejected += 1
+            raise QueueFullError()
+
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO verification_jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+            (job_id, json.dumps(params, ensure_ascii=False), time.time()),
+        )
+        self._enqueue(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._fetchone(
+            "SELECT id, status, result, error, created_at, started_at, finished_at "
+            "FROM verification_jobs WHERE id = ?",
+            (job_id,),
+        )
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": json.loads(row[3]) if row[3] else None,
+            "created_at": row[4],
+            "started_at": row[5],
+            "finished_at": row[6],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "lease_lost": self.lease_lost,
+            "expired": self.expired,
+            "wait_seconds_p50": percentile(self._wait_times, 0.5),
+            "wait_seconds_p95": percentile(self._wait_times, 0.95),
+            "processing_seconds_p50": percentile(self._processing_times, 0.5),
+            "processing_seconds_p95": percentile(self._processing_times, 0.95),
+        }
+
+    # --------- обработка ---------
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued_ids.discard(job_id)
+            try:
+                await self._process(job_id)
+            except Exception as e:
+                print("Verification job crashed:", job_id, repr(e))
+            finally:
+                self._queue.task_done()
+
+    def _claim(self, job_id: str, started_at: float) -> bool:
+        return self._execute(
+            "UPDATE verification_jobs SET status = 'running', owner = ?, started_at = ?, lease_until = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (self.owner, started_at, started_at + self.lease_seconds, job_id),
+        ).rowcount == 1
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            self._execute(
+                "UPDATE verification_jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+                (time.time() + self.lease_seconds, job_id, self.owner),
+            )
+
+    async def _process(self, job_id: str) -> None:
+        started_at = time.time()
+        if not self._claim(job_id, started_at):
+            # Задачу уже взял другой процесс (или она удалена).
+            return
+        row = self._fetchone(
+            "SELECT params, created_at FROM verification_jobs WHERE id = ?", (job_id,)
+        )
+        params, created_at = json.loads(row[0]), row[1]
+        self._wait_times.append(started_at - created_at)
+
+        self._running += 1
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        result = error = None
+        try:
+            result = await self.handler(params)
+        except Exception as e:
+            error = {
+                "status_code": getattr(e, "status_code", 500),
+                "detail": getattr(e, "detail", None) or str(e),
+            }
+        finally:
+            lease.cancel()
+            self._running -= 1
+
+        finished_at = time.time()
+        self._processing_times.append(finished_at - started_at)
+        status = "done" if error is None else "failed"
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+        saved = self._execute(
+            "UPDATE verification_jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND owner = ? AND status = 'running'",
+            (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                json.dumps(error, ensure_ascii=False) if error is not None else None,
+                finished_at,
+                job_id,
+                self.owner,
+            ),
+        ).rowcount
+        if not saved:
+            # Аренду перехватили (мы не продлили её вовремя) — результат и вебхук за новым владельцем.
+            self.lease_lost += 1
+            print("Verification job lease lost:", job_id)
+            return
+
+        if self.webhook_url:
+            await self._notify(job_id)
+
+    async def _notify(self, job_id: str) -> None:
+        payload = self.get(job_id)
+        try:
+            async with httpx.AsyncClient(timeout=self.webhook_timeout) as http:
+                resp = await http.post(self.webhook_url, json=payload)
+                resp.raise_for_status()
+        except Exception as e:
+            print("Verification webhook error:", job_id, repr(e))
@@ -0,0 +1,3 @@
+-- AlterTable
+ALTER TABLE "Article"
+ADD COLUMN "moderationLeaseUntil" TIMESTAMP(3);